@@ -0,0 +1,537 @@
+"""
+工事細目自動判定システム - ベンチマーク
+合成した見積書で判定・読み込み・保存の速度とメモリ使用量を計測する
+
+使い方:
+    # 1k〜100k行の見積書で計測し、結果をJSON Linesに追記する
+    python benchmark.py suite --rows 1000 10000 100000 --output benchmark_results.jsonl
+
+    # 並列ワーカー数ごとの判定スループット
+    python benchmark.py parallel --rows 200000 --workers 1 2 4 8
+
+    # 合成見積書だけを作る
+    python benchmark.py generate --rows 10000 --output 合成見積_10k.xlsx
+
+    # 実運用の計測ログ（construction_classifier.py --telemetry・Webアプリ）を段階別に集計する
+    python benchmark.py telemetry classify_telemetry.jsonl
+
+    # Webアプリの負荷試験（同時セッション数ごとのスループット・待ち時間・メモリ）
+    python benchmark.py load --sessions 1 2 4 8 --rows 5000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import unicodedata
+import zipfile
+from datetime import datetime
+
+from construction_classifier import (
+    ConstructionItemClassifier,
+    DATA_START_ROW,
+    HEADER_ROW,
+    NAME_COL,
+    PARALLEL_CHUNK_SIZE,
+    TARGET_SHEET,
+    WORK_CATEGORY_COL,
+    classify_detail_rows,
+    classify_detail_rows_parallel,
+    iter_detail_rows,
+    process_workbook,
+)
+from telemetry import current_rss_mb, peak_rss_mb, percentile, read_telemetry, summarize_telemetry
+
+# 合成見積書の保存先
+DATA_DIR = 'bench_data'
+
+# 負荷試験で操作するWebアプリと、結果の表示を待つ間の再実行の間隔・1セッションの制限時間（秒）
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app_secure.py')
+LOAD_POLL_INTERVAL = 0.5
+LOAD_SESSION_TIMEOUT = 600
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# 親カテゴリになる設備工事の見出し行
+PARENT_NAMES = ['電気設備工事', '給排水衛生設備工事', '空調設備工事', '機械設備工事']
+WORK_CATEGORIES = ['', '', '仮設工事', '杭工事', '躯体工事', '仕上工事', '外構工事']
+
+# キーワードに該当しない名称（0.0 対象外に落ちる行）
+PLAIN_NAMES = ['諸経費', '現場管理費', '雑工事', '運搬費', '発生材処理', '清掃片付', '養生費', '小計']
+SPEC_SUFFIXES = ['', '', '', ' D13 SD295A', ' Fc24 S18', '（1階）', '（共用部）', ' t=12.5', ' W900×H2000', ' 一式']
+
+# 全角→半角の変換表（カタカナ・英数字）
+_HALFWIDTH = {}
+for _code in range(0xFF61, 0xFFA0):
+    _HALFWIDTH.setdefault(unicodedata.normalize('NFKC', chr(_code)), chr(_code))
+_HALFWIDTH['゙'] = 'ﾞ'  # 濁点
+_HALFWIDTH['゚'] = 'ﾟ'  # 半濁点
+for _code in range(0xFF01, 0xFF5F):
+    _HALFWIDTH[chr(_code)] = chr(_code - 0xFEE0)
+
+def to_halfwidth(text):
+    """全角カタカナ・英数字を半角にする（濁点は分解して半角の濁点を付ける）"""
+    return ''.join(_HALFWIDTH.get(ch, ch) for ch in unicodedata.normalize('NFD', text))
+
+def to_fullwidth(text):
+    """英数字を全角にする"""
+    return ''.join(chr(ord(ch) + 0xFEE0) if '!' <= ch <= '~' else ch for ch in text)
+
+def generate_names(row_count, seed=0):
+    """分類器の語彙から実際の見積書に近い名称の並びを作る
+    
+    同じ名称が繰り返し出現し、一部は全角・半角の表記ゆれを含む。
+    シートの終盤に設備工事の見出し行と、その配下の明細を置く。
+    """
+    rng = random.Random(seed)
+    # 分類器のクラス定義のままのキーワード（インスタンスのキーワードは正規化済みで、見積書の表記とは異なる）
+    vocabulary = sorted(set().union(*(
+        value for name, value in vars(ConstructionItemClassifier).items()
+        if name.isupper() and isinstance(value, frozenset)
+    )))
+    
+    # 出現する名称の種類（出現頻度に偏りを持たせる）
+    pool = []
+    for _ in range(max(50, min(row_count // 5, 20000))):
+        if rng.random() < 0.15:
+            name = rng.choice(PLAIN_NAMES)
+        else:
+            name = ''.join(rng.choice(vocabulary) for _ in range(rng.choice([1, 1, 1, 2])))
+        name += rng.choice(SPEC_SUFFIXES)
+        variant = rng.random()
+        if variant < 0.1:
+            name = to_halfwidth(name)
+        elif variant < 0.15:
+            name = to_fullwidth(name)
+        pool.append(name)
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    
+    building_rows = int(row_count * 0.85)
+    names = rng.choices(pool, weights=weights, k=row_count)
+    
+    # 終盤の設備工事セクション
+    section_starts = sorted(rng.sample(range(building_rows, row_count), min(len(PARENT_NAMES), row_count - building_rows)))
+    for start, parent in zip(section_starts, PARENT_NAMES):
+        names[start] = parent
+    
+    # 空行を少し混ぜる
+    for index in rng.sample(range(row_count), row_count // 50):
+        if names[index] not in PARENT_NAMES:
+            names[index] = None
+    return names
+
+def generate_workbook(path, row_count, seed=0):
+    """最上位明細シートを持つ合成見積書を書き出す"""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    
+    rng = random.Random(seed + 1)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(TARGET_SHEET)
+    ws.column_dimensions['C'].width = 40
+    ws.column_dimensions['M'].width = 16
+    
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_fill = PatternFill('solid', fgColor='DDEBF7')
+    
+    def styled(value, **styles):
+        cell = WriteOnlyCell(ws, value=value)
+        for key, style in styles.items():
+            setattr(cell, key, style)
+        return cell
+    
+    # 見出し部分（HEADER_ROW の行に列見出し、その次の行から明細）
+    ws.append([styled('請負契約見積書', font=Font(bold=True, size=16))])
+    ws.append([None, '工事名称', '（合成データ）'])
+    ws.append([None, '作成日', datetime.now().strftime('%Y/%m/%d')])
+    for _ in range(HEADER_ROW - 3):
+        ws.append([])
+    
+    headers = ['No', '工事科目', '名称', '仕様', '数量', '単位', '単価', '金額',
+               '備考', '', '', '', '判定結果']
+    ws.append([styled(h, font=Font(bold=True), fill=header_fill, border=border,
+                      alignment=Alignment(horizontal='center')) for h in headers])
+    
+    work_category_col = WORK_CATEGORY_COL
+    name_col = NAME_COL
+    for index, name in enumerate(generate_names(row_count, seed)):
+        row = [None] * 9
+        row[0] = index + 1
+        row[work_category_col] = rng.choice(WORK_CATEGORIES)
+        row[name_col] = styled(name, border=border)
+        if name:
+            quantity = rng.randint(1, 500)
+            price = rng.randint(100, 50000)
+            row[4] = quantity
+            row[5] = rng.choice(['m2', 'm3', 't', '箇所', '式', 'm'])
+            row[6] = price
+            row[7] = quantity * price
+        ws.append(row)
+    
+    wb.save(path)
+
+def workbook_path(row_count, data_dir=DATA_DIR, seed=0):
+    """行数・乱数シードごとの合成見積書（なければ作る）"""
+    os.makedirs(data_dir, exist_ok=True)
+    suffix = f'_seed{seed}' if seed else ''
+    path = os.path.join(data_dir, f'synthetic_{row_count}{suffix}.xlsx')
+    if not os.path.exists(path):
+        generate_workbook(path, row_count, seed)
+    return path
+
+def measure_stage(stage, path):
+    """1つの段階だけを実行して計測する（ピークメモリを段階ごとに分けるため別プロセスで呼ぶ）"""
+    import openpyxl
+    from io import BytesIO
+    
+    result = {'stage': stage}
+    if stage == 'classify':
+        wb = openpyxl.load_workbook(path, read_only=True)
+        rows = list(iter_detail_rows(wb[TARGET_SHEET]))
+        wb.close()
+        classifier = ConstructionItemClassifier()
+        start = time.perf_counter()
+        classify_detail_rows(rows, classifier)
+        result['seconds'] = time.perf_counter() - start
+        result['rows_per_sec'] = len(rows) / result['seconds']
+        cache_info = classifier.cache_info()
+        result['cache_hit_ratio'] = cache_info.hits / max(cache_info.hits + cache_info.misses, 1)
+    elif stage == 'load':
+        start = time.perf_counter()
+        openpyxl.load_workbook(path)
+        result['seconds'] = time.perf_counter() - start
+    elif stage == 'save':
+        wb = openpyxl.load_workbook(path)
+        start = time.perf_counter()
+        wb.save(BytesIO())
+        result['seconds'] = time.perf_counter() - start
+    elif stage == 'pipeline':
+        start = time.perf_counter()
+        process_workbook(path)
+        result['seconds'] = time.perf_counter() - start
+    else:
+        raise ValueError(f'不明な計測段階です: {stage}')
+    
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run_stage(stage, path):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'measure', stage, path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(row_counts, output, data_dir=DATA_DIR, stages=('classify', 'load', 'save', 'pipeline')):
+    """行数ごとに各段階を計測し、1回の実行を1行のJSONとして追記する"""
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': [],
+    }
+    
+    print(f"{'行数':>8} {'段階':>10} {'秒':>8} {'行/秒':>12} {'ピークRSS(MB)':>14}")
+    for row_count in row_counts:
+        path = workbook_path(row_count, data_dir)
+        entry = {'rows': row_count, 'file_bytes': os.path.getsize(path)}
+        for stage in stages:
+            measured = run_stage(stage, path)
+            entry[stage] = measured
+            rate = f"{measured['rows_per_sec']:12,.0f}" if 'rows_per_sec' in measured else f"{'':>12}"
+            print(f"{row_count:>8} {stage:>10} {measured['seconds']:8.2f} {rate} {measured['peak_rss_mb']:14.0f}")
+        record['results'].append(entry)
+    
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"結果を {output} に追記しました")
+    return record
+
+def run_parallel(row_count, worker_counts, chunk_size=PARALLEL_CHUNK_SIZE):
+    """並列ワーカー数ごとの判定スループットを逐次判定と比べる"""
+    names = generate_names(row_count)
+    rng = random.Random(0)
+    rows = [(DATA_START_ROW + 1 + index, rng.choice(WORK_CATEGORIES), name) for index, name in enumerate(names)]
+    
+    start = time.perf_counter()
+    expected = classify_detail_rows(rows, ConstructionItemClassifier())
+    baseline = time.perf_counter() - start
+    print(f"{'workers':>8} {'秒':>8} {'行/秒':>12} {'倍率':>6}")
+    print(f"{'逐次':>8} {baseline:8.2f} {row_count / baseline:12,.0f} {1.0:6.2f}")
+    
+    for workers in worker_counts:
+        start = time.perf_counter()
+        results, _ = classify_detail_rows_parallel(rows, workers=workers, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        
+        if results != expected:
+            raise SystemExit(f"並列判定の結果が逐次判定と一致しません (workers={workers})")
+        print(f"{workers:>8} {elapsed:8.2f} {row_count / elapsed:12,.0f} {baseline / elapsed:6.2f}")
+
+def show_telemetry(path, mode=None):
+    """計測ログの段階別の p50 / p95 を表示する"""
+    records = [record for record in read_telemetry(path) if mode is None or record.get('mode') == mode]
+    if not records:
+        raise SystemExit(f"{path} に計測結果がありません")
+    rows = [record.get('rows', 0) for record in records]
+    print(f"{len(records):,}件 / 明細行数 p50 {percentile(rows, 0.5):,} p95 {percentile(rows, 0.95):,}")
+    print(f"{'段階':<14} {'件数':>6} {'p50秒':>8} {'p95秒':>8} {'平均秒':>8}")
+    for summary in summarize_telemetry(records):
+        print(f"{summary['stage']:<14} {summary['count']:>6} {summary['p50_seconds']:8.3f} "
+              f"{summary['p95_seconds']:8.3f} {summary['mean_seconds']:8.3f}")
+
+def run_session(path, password, run_lock, poll_interval=LOAD_POLL_INTERVAL, timeout=LOAD_SESSION_TIMEOUT):
+    """Webアプリの1セッション（ログイン → アップロード → 判定を実行 → 結果のダウンロード）を操作し、段階別の秒数を返す
+    
+    AppTest は実行のたびにプロセス全体の Runtime を差し替えるので、スクリプトの実行は run_lock で1つずつ行う。
+    判定はアプリのジョブプールで実行されるので、サーバーと同じくセッションをまたいで並行に処理される。
+    結果の表示はブラウザの定期更新の代わりに poll_interval ごとに再実行して待つ。
+    """
+    from io import BytesIO
+    from streamlit.testing.v1 import AppTest
+    
+    def run(at):
+        with run_lock:
+            at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    
+    def click(at, label):
+        next(button for button in at.button if button.label == label).click()
+        run(at)
+    
+    result = {'file': os.path.basename(path), 'status': 'ok'}
+    start = time.perf_counter()
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=timeout)
+    run(at)
+    at.text_input(key='password_input').input(password)
+    click(at, 'ログイン')
+    if not at.session_state['authenticated']:
+        raise RuntimeError('ログインできませんでした')
+    result['login_seconds'] = time.perf_counter() - start
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    started = time.perf_counter()
+    uploader = next(widget for widget in at.file_uploader if widget.label == 'Excelファイルを選択してください')
+    uploader.set_value((os.path.basename(path), data, XLSX_MIME))
+    run(at)
+    result['upload_seconds'] = time.perf_counter() - started
+    
+    submitted = time.perf_counter()
+    click(at, '🚀 判定を実行')
+    if any('待ってから実行してください' in warning.value for warning in at.warning):
+        result['status'] = 'rejected'
+        return result
+    while not at.download_button:
+        if at.error:
+            result['status'] = 'failed'
+            result['error'] = at.error[0].value
+            return result
+        if time.perf_counter() - submitted > timeout:
+            result['status'] = 'timeout'
+            return result
+        time.sleep(poll_interval)
+        run(at)
+    result['result_seconds'] = time.perf_counter() - submitted
+    job = at.session_state['jobs'][-1]['job']
+    result['job_wait_seconds'] = job.wait_seconds
+    result['job_run_seconds'] = job.run_seconds
+    
+    # ダウンロードされる結果ファイルを取り出して壊れていないことを確かめる
+    started = time.perf_counter()
+    output = job.result[0]
+    with zipfile.ZipFile(BytesIO(output)) as archive:
+        if archive.testzip() is not None:
+            raise RuntimeError('結果ファイルが壊れています')
+    result['download_seconds'] = time.perf_counter() - started
+    result['output_bytes'] = len(output)
+    result['total_seconds'] = time.perf_counter() - start
+    return result
+
+def run_load_level(paths, password, run_lock, poll_interval=LOAD_POLL_INTERVAL):
+    """len(paths) 個のセッションを同時に始めて、全体の秒数・セッションごとの結果・処理中の最大常駐メモリを返す"""
+    results = [None] * len(paths)
+    barrier = threading.Barrier(len(paths))
+    
+    def session(index):
+        barrier.wait()
+        try:
+            results[index] = run_session(paths[index], password, run_lock, poll_interval)
+        except Exception as e:
+            results[index] = {'file': os.path.basename(paths[index]), 'status': 'error', 'error': str(e)}
+    
+    max_rss = [current_rss_mb()]
+    finished = threading.Event()
+    
+    def sample_memory():
+        while not finished.wait(0.1):
+            rss = current_rss_mb()
+            if rss is not None and (max_rss[0] is None or rss > max_rss[0]):
+                max_rss[0] = rss
+    
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(len(paths))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    finished.set()
+    sampler.join()
+    return elapsed, results, max_rss[0]
+
+def run_load(session_counts, row_count, output, data_dir=DATA_DIR, password='demo123',
+             job_workers=None, queue_depth=None, poll_interval=LOAD_POLL_INTERVAL):
+    """同時セッション数ごとにWebアプリを操作して、スループット・待ち時間の p50 / p95・メモリを計測する
+    
+    アプリは AppTest でこのプロセス内で動かすので、ジョブプール・キャッシュは1台のサーバーと同じく全セッションで共有される。
+    セッションごとに別の合成見積書をアップロードする（処理結果キャッシュに当たらないよう、実行全体で同じファイルは使わない）。
+    最初に1セッションを流して、モジュールの読み込み・判定器の構築を計測から除く。
+    """
+    # アプリの永続ストア・計測ログは合成見積書と同じ場所に作る（作業ディレクトリの本番用ファイルを汚さない）
+    os.environ.setdefault('CLASSIFY_STORE_PATH', os.path.join(data_dir, 'load_category_store.sqlite3'))
+    os.environ.setdefault('CLASSIFY_TELEMETRY_PATH', os.path.join(data_dir, 'load_telemetry.jsonl'))
+    if job_workers is not None:
+        os.environ['CLASSIFY_JOB_WORKERS'] = str(job_workers)
+    if queue_depth is not None:
+        os.environ['CLASSIFY_JOB_QUEUE_DEPTH'] = str(queue_depth)
+    
+    seeds = iter(range(1, 1 + 1 + sum(session_counts)))
+    warmup = workbook_path(row_count, data_dir, next(seeds))
+    levels = [[workbook_path(row_count, data_dir, next(seeds)) for _ in range(count)] for count in session_counts]
+    
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'rows': row_count,
+        'job_workers': os.environ.get('CLASSIFY_JOB_WORKERS'),
+        'queue_depth': os.environ.get('CLASSIFY_JOB_QUEUE_DEPTH'),
+        'results': [],
+    }
+    # アプリの描画に伴う警告ログ（非推奨の引数など）で結果の表が埋もれないようにする
+    logging.disable(logging.WARNING)
+    
+    run_lock = threading.Lock()
+    _, (warmup_result,), _ = run_load_level([warmup], password, run_lock, poll_interval)
+    if warmup_result['status'] != 'ok':
+        raise SystemExit(f"ウォームアップのセッションが失敗しました: {warmup_result.get('error', warmup_result['status'])}")
+    
+    def seconds(value):
+        return f"{value:7.2f}" if value is not None else f"{'-':>7}"
+    
+    print(f"{'同時数':>6} {'完了':>4} {'拒否':>4} {'失敗':>4} {'秒':>7} {'件/分':>7} {'行/秒':>9} "
+          f"{'p50秒':>7} {'p95秒':>7} {'待ちp95':>7} {'RSS(MB)':>8}")
+    for paths in levels:
+        elapsed, results, max_rss = run_load_level(paths, password, run_lock, poll_interval)
+        done = [result for result in results if result['status'] == 'ok']
+        totals = [result['total_seconds'] for result in done]
+        waits = [result['job_wait_seconds'] for result in done]
+        entry = {
+            'sessions': len(paths),
+            'completed': len(done),
+            'rejected': sum(1 for result in results if result['status'] == 'rejected'),
+            'failed': len(results) - len(done) - sum(1 for result in results if result['status'] == 'rejected'),
+            'seconds': elapsed,
+            'sessions_per_min': len(done) / elapsed * 60,
+            'rows_per_sec': len(done) * row_count / elapsed,
+            'p50_seconds': percentile(totals, 0.5) if totals else None,
+            'p95_seconds': percentile(totals, 0.95) if totals else None,
+            'p95_job_wait_seconds': percentile(waits, 0.95) if waits else None,
+            'max_rss_mb': max_rss,
+            'peak_rss_mb': peak_rss_mb(),
+            'session_results': results,
+        }
+        record['results'].append(entry)
+        print(f"{entry['sessions']:>6} {entry['completed']:>4} {entry['rejected']:>4} {entry['failed']:>4} "
+              f"{elapsed:7.2f} {entry['sessions_per_min']:7.1f} {entry['rows_per_sec']:9,.0f} "
+              f"{seconds(entry['p50_seconds'])} {seconds(entry['p95_seconds'])} "
+              f"{seconds(entry['p95_job_wait_seconds'])} {max_rss or 0:8.0f}")
+        for result in results:
+            if result['status'] in ('failed', 'error', 'timeout'):
+                print(f"  ❌ {result['file']}: {result['status']} {result.get('error', '')}")
+    
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"結果を {output} に追記しました（アプリ側の段階別の内訳は "
+          f"python benchmark.py telemetry {os.environ['CLASSIFY_TELEMETRY_PATH']} で集計できます）")
+    return record
+
+def main():
+    parser = argparse.ArgumentParser(description='工事細目自動判定のベンチマーク')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    suite = subparsers.add_parser('suite', help='判定・読み込み・保存・全体処理を計測する')
+    suite.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='計測する明細行数')
+    suite.add_argument('--output', default='benchmark_results.jsonl', help='結果を追記するJSON Linesファイル')
+    suite.add_argument('--data-dir', default=DATA_DIR, help='合成見積書の保存先')
+    
+    parallel = subparsers.add_parser('parallel', help='並列ワーカー数ごとの判定スループット')
+    parallel.add_argument('--rows', type=int, default=200000, help='生成する明細行数')
+    parallel.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='計測するワーカー数')
+    parallel.add_argument('--chunk-size', type=int, default=PARALLEL_CHUNK_SIZE, help='1チャンクの行数')
+    
+    generate = subparsers.add_parser('generate', help='合成見積書を作る')
+    generate.add_argument('--rows', type=int, required=True, help='明細行数')
+    generate.add_argument('--output', required=True, help='保存先の.xlsx')
+    generate.add_argument('--seed', type=int, default=0, help='乱数シード')
+    
+    telemetry = subparsers.add_parser('telemetry', help='計測ログを段階別に集計する（p50 / p95）')
+    telemetry.add_argument('path', nargs='?', default='classify_telemetry.jsonl', help='計測ログ（JSON Lines）')
+    telemetry.add_argument('--mode', choices=['cli', 'app'], help='集計する実行元（省略時はすべて）')
+    
+    load = subparsers.add_parser('load', help='Webアプリの同時セッション数ごとの負荷試験')
+    load.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8], help='同時に操作するセッション数')
+    load.add_argument('--rows', type=int, default=5000, help='1ファイルの明細行数')
+    load.add_argument('--output', default='load_results.jsonl', help='結果を追記するJSON Linesファイル')
+    load.add_argument('--data-dir', default=DATA_DIR, help='合成見積書の保存先')
+    load.add_argument('--password', default='demo123', help='ログインのパスワード')
+    load.add_argument('--job-workers', type=int, help='アプリのジョブの同時実行数（CLASSIFY_JOB_WORKERS）')
+    load.add_argument('--queue-depth', type=int, help='アプリのジョブの待ち行列の長さ（CLASSIFY_JOB_QUEUE_DEPTH）')
+    load.add_argument('--poll-interval', type=float, default=LOAD_POLL_INTERVAL, help='結果の表示を待つ間の再実行の間隔（秒）')
+    
+    measure = subparsers.add_parser('measure', help=argparse.SUPPRESS)
+    measure.add_argument('stage')
+    measure.add_argument('path')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'suite':
+        run_suite(args.rows, args.output, args.data_dir)
+    elif args.command == 'parallel':
+        run_parallel(args.rows, args.workers, args.chunk_size)
+    elif args.command == 'generate':
+        generate_workbook(args.output, args.rows, args.seed)
+    elif args.command == 'telemetry':
+        show_telemetry(args.path, args.mode)
+    elif args.command == 'load':
+        run_load(args.sessions, args.rows, args.output, args.data_dir, args.password,
+                 args.job_workers, args.queue_depth, args.poll_interval)
+    elif args.command == 'measure':
+        print(json.dumps(measure_stage(args.stage, args.path)))
+
+if __name__ == '__main__':
+    main()
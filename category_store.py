@@ -0,0 +1,164 @@
+"""
+名称→判定結果の永続ストア（SQLite）
+正規化した (名称, 工事科目, 親カテゴリ) をキーに判定結果を保存し、実行やユーザーをまたいで使い回す。
+
+登録元は2種類:
+    'run'    … 判定ルールで判定した結果。判定ルールの指紋と一緒に保存し、ルールが変わると使わない
+    'manual' … 判定済みファイルを手で修正した結果。ルールが変わっても優先して使う
+WAL モードで開くので、読み込みは書き込み中でも並行して行える（接続はスレッドごとに作る）。
+標準ライブラリだけで動く。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+SOURCE_RUN = 'run'
+SOURCE_MANUAL = 'manual'
+
+# 1回の問い合わせで照会するキーの数（SQLite のパラメータ数の上限に収まるように）
+LOOKUP_BATCH_SIZE = 300
+
+# メモリ上に控えておく照会結果の上限（件数。超えたら捨てて照会し直す）
+MEMORY_CACHE_SIZE = 200000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT NOT NULL,
+    work_category TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    category TEXT NOT NULL,
+    source TEXT NOT NULL,
+    rules TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, work_category, parent)
+) WITHOUT ROWID
+"""
+
+# 手で修正した結果は判定ルールの結果で上書きしない
+_UPSERT = """
+INSERT INTO categories (name, work_category, parent, category, source, rules, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (name, work_category, parent) DO UPDATE SET
+    category = excluded.category,
+    source = excluded.source,
+    rules = excluded.rules,
+    updated_at = excluded.updated_at
+WHERE categories.source != 'manual' OR excluded.source = 'manual'
+"""
+
+class CategoryStore:
+    """名称→判定結果の永続ストア（スレッドセーフ）
+    
+    キーは正規化済みの (名称, 工事科目, 親カテゴリ)。
+    rules（判定ルールの指紋）が保存時と違う 'run' の結果は照会しても返さない。
+    照会結果はメモリに控え、同じキーはSQLiteに問い合わせずに返す（prefetch でシート単位にまとめて読み直す）。
+    """
+    
+    def __init__(self, path, timeout=30.0):
+        self.path = os.fspath(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._memory = {}  # (rules, キー) -> 判定結果（ストアにない場合は None）
+        self._lock = threading.Lock()
+        
+        with self._connection() as conn:
+            conn.execute(_SCHEMA)
+    
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _remember(self, rules, found):
+        with self._lock:
+            if len(self._memory) + len(found) > MEMORY_CACHE_SIZE:
+                self._memory.clear()
+            for key, category in found.items():
+                self._memory[(rules, key)] = category
+    
+    def _query(self, keys, rules):
+        """キーの一覧をまとめて照会し、{キー: 判定結果} を返す（見つからないキーは含めない）"""
+        conn = self._connection()
+        found = {}
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join(['(?, ?, ?)'] * len(batch))
+            rows = conn.execute(
+                f"SELECT name, work_category, parent, category FROM categories"
+                f" WHERE (name, work_category, parent) IN (VALUES {placeholders})"
+                f" AND (source = ? OR rules = ?)",
+                [value for key in batch for value in key] + [SOURCE_MANUAL, rules]
+            )
+            for name, work_category, parent, category in rows:
+                found[(name, work_category, parent)] = category
+        return found
+    
+    def prefetch(self, keys, rules=''):
+        """キーの一覧（シート1枚分など）をまとめて照会し直し、{キー: 判定結果} を返す
+        
+        照会結果（見つからなかったことも含む）はメモリに控え、get で使う。
+        """
+        keys = list(dict.fromkeys(keys))
+        found = self._query(keys, rules)
+        self._remember(rules, {key: found.get(key) for key in keys})
+        return found
+    
+    def get(self, key, rules=''):
+        """1件の判定結果を返す（ストアにない場合は None）"""
+        try:
+            return self._memory[(rules, key)]
+        except KeyError:
+            pass
+        category = self._query([key], rules).get(key)
+        self._remember(rules, {key: category})
+        return category
+    
+    def put_many(self, entries, source=SOURCE_RUN, rules=''):
+        """(キー, 判定結果) の組をまとめて保存し、保存した件数を返す
+        
+        'run' の結果は同じキーの 'manual' の結果を上書きしない。
+        """
+        now = time.time()
+        rows = [(*key, category, source, rules, now) for key, category in entries if category]
+        if not rows:
+            return 0
+        conn = self._connection()
+        with conn:
+            conn.executemany(_UPSERT, rows)
+        with self._lock:
+            self._memory.clear()
+        return len(rows)
+    
+    def remove_manual(self, keys):
+        """手で修正した結果を取り消し、取り消した件数を返す"""
+        rows = [(*key, SOURCE_MANUAL) for key in keys]
+        if not rows:
+            return 0
+        conn = self._connection()
+        with conn:
+            removed = conn.executemany(
+                "DELETE FROM categories WHERE name = ? AND work_category = ? AND parent = ? AND source = ?", rows
+            ).rowcount
+        with self._lock:
+            self._memory.clear()
+        return removed
+    
+    def counts(self):
+        """登録元別の件数 {'run': 件数, 'manual': 件数}"""
+        rows = self._connection().execute("SELECT source, COUNT(*) FROM categories GROUP BY source")
+        counts = dict.fromkeys((SOURCE_RUN, SOURCE_MANUAL), 0)
+        counts.update(rows)
+        return counts
+    
+    def close(self):
+        """このスレッドの接続を閉じる"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
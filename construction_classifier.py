@@ -0,0 +1,2358 @@
+"""
+工事細目自動判定 - 判定ライブラリ（Streamlit非依存）
+分類器とExcel処理本体。pandas・openpyxl（Parquet 出力時は pyarrow）は使う時点で読み込む。
+
+コマンドラインから一括判定する場合:
+    python construction_classifier.py 見積書.xlsx 見積フォルダ/ --workers 4 --output-dir 結果/
+分析用に判定結果だけを CSV / Parquet で保存する場合:
+    python construction_classifier.py 見積フォルダ/ --export parquet --output-dir 結果/
+手で修正した判定済みファイルを永続ストアに登録し、次回から優先させる場合:
+    python construction_classifier.py 修正済み.xlsx --learn --store 判定結果.sqlite3
+    python construction_classifier.py 見積書.xlsx --store 判定結果.sqlite3
+最上位明細以外のシート（内訳明細・棟別など）もまとめて判定する場合:
+    python construction_classifier.py 見積書.xlsx --sheets --workers 4
+    python construction_classifier.py 見積書.xlsx --sheets 最上位明細 内訳明細 --layout 内訳明細=7,B,C,M
+どのキーワードにも該当しない名称を、過去の判定済みファイルの近い名称の判定結果で判定する場合:
+    python construction_classifier.py 見積書.xlsx --neighbors 判定済みフォルダ/
+改訂版の見積書を旧版と比べ、追加・削除・判定変更の行を差分表（CSV）に保存する場合:
+    python construction_classifier.py 旧版.xlsx 改訂版.xlsx --compare --output-dir 結果/
+段階別の所要時間を JSON Lines のログに記録する場合（集計は benchmark.py telemetry）:
+    python construction_classifier.py 見積フォルダ/ --telemetry classify_telemetry.jsonl
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import unicodedata
+import uuid
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+
+from category_store import SOURCE_MANUAL, SOURCE_RUN, CategoryStore
+from neighbor_index import NeighborIndex
+from telemetry import RunTelemetry, TelemetryLog
+from xlsx_patch import XlsxPatchError, iter_sheet_values, patch_xlsx, patch_xlsx_sheets
+
+# 判定結果キャッシュの既定容量（件数）
+CLASSIFY_CACHE_SIZE = 8192
+
+# 判定結果の保存方法
+# 'patch': 元のxlsxをストリーミングで読み、最上位明細シートの判定結果列だけを書き換える（他のパーツはそのままコピー）
+# 'openpyxl': ワークブック全体を読み込んで保存し直す（patch で扱えない構造の場合もこちらで保存する）
+WORKBOOK_WRITER = 'patch'
+
+# 並列判定の設定（行数がこれ未満なら並列化しない）
+CLASSIFY_WORKERS = 1
+PARALLEL_CHUNK_SIZE = 5000
+PARALLEL_MIN_ROWS = 20000
+
+# プロセスプールの開始方式（Webアプリのようにスレッドが動いているプロセスから fork すると、
+# ほかのスレッドが持っていたロック（SQLite・ログ・キャッシュ）を持ったまま子プロセスが止まることがあるので使わない）
+PROCESS_START_METHODS = ('forkserver', 'spawn')
+
+# 表記ゆれ正規化の結果キャッシュ容量（件数）
+NORMALIZE_CACHE_SIZE = 65536
+
+_HIRAGANA = re.compile('[\u3041-\u3096\u309d\u309e]')
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in [*range(0x3041, 0x3097), 0x309D, 0x309E]}
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def canonicalize(text):
+    """表記ゆれを吸収した比較用の文字列を返す
+    
+    NFKC で全角英数・半角カナの幅を揃え、ひらがなをカタカナに寄せ、空白（全角空白を含む）を取り除く。
+    例: 'ｺﾝｸﾘｰﾄ' → 'コンクリート'、'ＩＴＶ' → 'ITV'、'サ ヤ 管' → 'サヤ管'
+    """
+    text = unicodedata.normalize('NFKC', text)
+    # translate は遅いので、ひらがなを含む場合だけ変換する
+    if _HIRAGANA.search(text):
+        text = text.translate(_HIRAGANA_TO_KATAKANA)
+    return ''.join(text.split())
+
+# 複数キーワードの一括照合（Aho-Corasick）
+class KeywordMatcher:
+    """キーワード集合を1回の走査で照合するオートマトン"""
+    
+    def __init__(self, keywords):
+        self.keywords = tuple(sorted(set(k for k in keywords if k)))
+        
+        # トライ木を構築
+        goto = [{}]
+        output = [set()]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    output.append(set())
+                state = next_state
+            output[state].add(keyword)
+        
+        # 幅優先で失敗遷移を解決する。各状態にはルートと異なる遷移だけを持たせ、
+        # それ以外はルートの遷移表を引く（遷移表の重複を避ける）
+        root = goto[0]
+        fail = [0] * len(goto)
+        delta = [{} for _ in goto]
+        queue = deque(root.values())
+        while queue:
+            state = queue.popleft()
+            transitions = dict(delta[fail[state]])
+            transitions.update(goto[state])
+            delta[state] = {ch: t for ch, t in transitions.items() if root.get(ch, 0) != t}
+            output[state] |= output[fail[state]]
+            for ch, next_state in goto[state].items():
+                fallback = delta[fail[state]].get(ch)
+                if fallback is None:
+                    fallback = root.get(ch, 0)
+                fail[next_state] = fallback
+                queue.append(next_state)
+        
+        self._root = root
+        self._delta = delta
+        self._output = [frozenset(o) for o in output]
+    
+    def find(self, text):
+        """テキスト中に含まれるキーワードの集合を返す"""
+        root = self._root
+        delta = self._delta
+        output = self._output
+        state = 0
+        hits = set()
+        for ch in text:
+            next_state = delta[state].get(ch)
+            state = root.get(ch, 0) if next_state is None else next_state
+            if output[state]:
+                hits |= output[state]
+        return hits
+
+class CacheCounter:
+    """1回の処理分の判定キャッシュの照会・ミス件数（分類器を共有するほかのジョブの照会は含めない）"""
+    
+    def __init__(self):
+        self.lookups = 0
+        self.misses = 0
+    
+    @property
+    def hits(self):
+        return self.lookups - self.misses
+
+class RuleProfile:
+    """判定ルールごとの呼び出し回数・所要時間・判定件数の記録"""
+    
+    # キーワード照合（名称の走査）、近傍検索での判定と、どのルールにも該当しなかった行の記録名
+    SCAN = 'keyword_scan'
+    NEIGHBOR = 'neighbor_fallback'
+    DEFAULT = 'default'
+    
+    def __init__(self, rules):
+        self.rules = list(rules)  # (ルール名, カテゴリ) の優先順位順
+        self.clear()
+    
+    def clear(self):
+        names = [self.SCAN] + [name for name, _ in self.rules] + [self.NEIGHBOR, self.DEFAULT]
+        self.rows = 0
+        self.calls = dict.fromkeys(names, 0)
+        self.seconds = dict.fromkeys(names, 0.0)
+        self.decided = dict.fromkeys(names, 0)
+    
+    def merge(self, other):
+        """別のプロファイル（並列判定のワーカーなど）の記録を足し込む"""
+        self.rows += other.rows
+        for name in self.calls:
+            self.calls[name] += other.calls.get(name, 0)
+            self.seconds[name] += other.seconds.get(name, 0.0)
+            self.decided[name] += other.decided.get(name, 0)
+    
+    def to_records(self):
+        """表示・出力用に1ルール1行の辞書のリストを返す"""
+        categories = dict(self.rules)
+        categories[self.DEFAULT] = '0.0 対象外'
+        records = []
+        for name in self.calls:
+            records.append({
+                'rule': name,
+                'category': categories.get(name, ''),
+                'calls': self.calls[name],
+                'seconds': self.seconds[name],
+                'decided': self.decided[name],
+                'decided_ratio': self.decided[name] / self.rows if self.rows else 0.0,
+            })
+        return records
+    
+    def to_json(self):
+        import json
+        return json.dumps({'rows': self.rows, 'rules': self.to_records()}, ensure_ascii=False, indent=2)
+
+# classify_frame の既定の列名
+FRAME_NAME_COL = '名称'
+FRAME_WORK_CATEGORY_COL = '工事科目'
+FRAME_PARENT_COL = '親カテゴリ'
+
+class ConstructionItemClassifier:
+    """工事細目自動判定クラス"""
+    
+    # キーワード集合は構築時に canonicalize で正規化するので、幅違いの表記を並べる必要はない
+    # （_match_* に直接書く語は正規化後の表記にすること。ひらがなを含む語は集合に入れる）
+    # 親カテゴリ（設備工事）の判定キーワード
+    PARENT_ELECTRIC_KEYWORDS = frozenset(['電気', '電力', '電灯', '照明', '電話', 'インターネット', 'テレビ', 'インターホン', 'ITV', '火災報知', '避雷'])
+    PARENT_HVAC_KEYWORDS = frozenset(['給排水', '給水', '給湯', '排水', '衛生器具', 'ガス', '消火', '空調'])
+    
+    ELECTRIC_KEYWORDS = frozenset([
+        '電気設備', '電力引込設備', '幹線動力設備', '共用電灯コンセント設備',
+        '専有部電灯コンセント設備', '共用照明器具設備', '専有部照明器具設備',
+        '電話配管設備', 'インターネット設備', 'テレビ共聴設備',
+        'インターホン設備', 'ITV設備', '自動火災報知設備', '避雷針設備',
+        '電線', '電線管', 'ライニング鋼管', 'ケーブル',
+        '高圧キャビネット', 'キャビネット', '分電盤', '照明器具',
+        '接地端子盤', 'UGS', '埋設標示シート', 'コンセント'
+    ])
+    HVAC_KEYWORDS = frozenset([
+        '給排水衛生設備', '給水設備', '給湯設備', '排水設備', '衛生器具設備',
+        '都市ガス設備', '消火設備', '空調設備',
+        '増圧直結給水ポンプ', '量水器', '止水栓', '給水栓',
+        '大便器', '小便器', '洗面器', '流し',
+        '水道用ポリエチレン管', '架橋ポリエチレン管', '排水管', '通気管', 'ガス管',
+        'サヤ管', '継手類', '防食塗装',
+        '雑排水', '汚水', '雨水', '消火栓', 'スプリンクラー',
+        '屋外埋設', '散水栓'
+    ])
+    ROOF_EXCLUDE = frozenset(['EVピット', '消火水槽'])
+    ROOF_POSITIONS = frozenset(['屋上', '屋根', 'ルーフバルコニー', '勾配屋根', '階段屋根',
+                                'EV屋根', '庇', 'バルコニー', 'サービスバルコニー',
+                                '廊下', 'マリオン', 'パラペット'])
+    ROOF_FINISHES = frozenset(['コンクリート金鏝押え', '打放し補修'])
+    WATERPROOF_KEYWORDS = frozenset(['防水', 'アスファルト防水', 'ウレタン系塗膜防水', '塗膜防水',
+                                     '露出防水', '断熱防水', 'シート防水', '防水仕舞',
+                                     'アスファルトシングル葺', '脱気装置'])
+    ROOF_PARTS = frozenset(['立上り', '笠木', '防水押え金物', '化粧防水押え金物',
+                            '軒先水切', '水上水切', 'ケラバ水切', '雪止め金具',
+                            '排水溝', '成型緩衝材', '伸縮目地', 'コーナーキャント', '通気立上り'])
+    PILE_EXCLUDE = frozenset(['クレーン基礎杭費', '杭間浚い'])
+    PILE_KEYWORDS = frozenset(['杭', '場所打ち杭', '既製杭', '杭頭', '補強リング', '水中コンクリート', '試験堀', '継手材料'])
+    CONCRETE_EXCLUDE = frozenset(['型枠', 'コンクリート足場'])
+    CONCRETE_ROOF_POSITIONS = frozenset(['屋上', 'ルーフバルコニー', 'バルコニー', '廊下', '庇', 'EV屋根'])
+    CONCRETE_ROOF_FINISHES = frozenset(['コンクリート金鏝押え'])
+    CONCRETE_KEYWORDS = frozenset(['コンクリート', '捨コン',
+                                   '土間コンクリート', '基礎コンクリート', '耐圧コンクリート', 'スラブコンクリート',
+                                   '躯体コンクリート', '増打用コンクリート', '防水押えコンクリート', '浮床コンクリート',
+                                   '構造体強度補正', '打設費', '圧送費', '圧送料', 'ポンプ車',
+                                   'ポンプ用モルタル', '垂直打継処理', '配管費', '金鏝'])
+    STEEL_EXCLUDE = frozenset(['軽量鉄骨', 'LGS'])
+    STEEL_KEYWORDS = frozenset(['定着板', '下地鉄骨', '縞鋼板', '柱型', '大梁', '小梁', 'ブレース', '吊ボルト'])
+    REBAR_EXCLUDE = frozenset(['鉄筋足場'])
+    REBAR_CAST_IN_PLACE = frozenset(['場所打ち', '場所打'])
+    REBAR_KEYWORDS = frozenset(['鉄筋', '溶接閉鎖型鉄筋', '高強度せん断補強筋', '鉄筋加工費', '鉄筋組立費',
+                                '鉄筋小運搬費', '鉄筋圧接費', '鉄筋切断費', 'スペーサーブロック',
+                                'D10', 'D13', 'テストピース', 'スリット連結筋',
+                                '溶接金網', '人通孔補強', '梁貫通スリーブ補強', 'ダメ穴補強'])
+    OTHER_STRUCTURE_KEYWORDS = frozenset(['型枠', '基礎型枠', '普通型枠', '打放型枠', '捨コン用型枠',
+                                          'スラブ段差型枠', '勾配型枠', '上蓋型枠',
+                                          '止水板', '構造スリット', '階段構造スリット'])
+    EXTERIOR_WALL_EXCLUDE = frozenset(['手摺', '窓', 'サッシ', '巾木'])
+    EXTERIOR_WALL_KEYWORDS = frozenset(['外壁', 'ALC版', 'カーテンウォール', 'タイル', '磁器質タイル',
+                                        '二丁掛', '役物', 'タイルクリーニング', '超高圧洗浄'])
+    EXTERIOR_OPENING_KEYWORDS = frozenset(['手摺', '手摺足元', '手摺壁', '進入防止竪格子', '防風スクリーン',
+                                           '仕上見切金物', '巾木', 'ボーダー', '壁付手摺', '養生目的ガード',
+                                           '膳板', '吊りフック', '窓', 'AW', 'FIX', '引違い', '片引き', 'サッシ',
+                                           '面格子', '雨戸', 'シャッター', '玄関扉', 'ED'])
+    EXTERIOR_BASEBOARD_POSITIONS = frozenset(['廊下', 'バルコニー', '防水'])
+    INTERIOR_FLOOR_EXCLUDE = frozenset(['天井', '壁'])
+    INTERIOR_FLOOR_ROOF_POSITIONS = frozenset(['屋上', 'ルーフバルコニー', 'バルコニー', 'サービスバルコニー', '廊下'])
+    INTERIOR_FLOOR_ROOF_FINISHES = frozenset(['防水', 'コンクリート金鏝押え'])
+    INTERIOR_FLOOR_KEYWORDS = frozenset(['床'])
+    INTERIOR_WALL_EXCLUDE = frozenset(['天井', '額縁', 'SD', '開口'])
+    INTERIOR_WALL_KEYWORDS = frozenset(['間仕切', '壁', '木下地', '取付下地', '固定棚取付下地',
+                                        '軽量鉄骨壁下地', 'LGS', 'ボード下地', 'プラスターボード',
+                                        '石膏ボード', 'クロス下地', 'カーテンボックス', 'ウォールドア', '壁補強'])
+    INTERIOR_OPENING_KEYWORDS = frozenset(['額縁', 'ユニットバス額縁', '玄関額縁', '掃出し窓下枠', '見切縁',
+                                           '開口枠', '開口上枠', 'SD', '片開き', '両開き', 'フラッシュ戸',
+                                           '戸袋付', '点検口', '集中購買品', '電気錠'])
+    CEILING_KEYWORDS = frozenset(['下り天井', '段裏', '軽量天井下地', '軽量鉄骨天井下地',
+                                  '天井開口補強', 'プラスターボード', '化粧石膏ボード',
+                                  'ステンレスパネル', '廻縁', '廻り縁', 'コーナービート',
+                                  '天井インサート', '天井打放し補修'])
+    INTERIOR_MISC_KEYWORDS = frozenset(['カウンター', '固定棚', '玄関カウンター', '洗面室カウンター',
+                                        'カウンター天板', 'FAMCL', 'WICL', 'SICL', '集成材', '人工大理石',
+                                        'ポスト', '宅配ボックス', '宅配BOX', '集合郵便受', '掲示板'])
+    EXCLUDED_EXCLUDE = frozenset(['鉄筋足場', 'コンクリート足場', 'クレーン基礎杭費', '杭間浚い'])
+    EXCLUDED_KEYWORDS = frozenset(['仮囲費', '仮設建物費', '仮設道路費', '借地費', '整地費', '共通費',
+                                   '残材処分費', '遣り方', '墨だし', '外部足場', '内部足場', '朝顔',
+                                   'ステージ', '跡片付清掃', '根切', '埋戻', '残土処分', '山留', '土留', '地盤改良'])
+    PILE_WORK_KEYWORDS = frozenset(['施工費'])
+    
+    # 判定結果のカテゴリ（この並びの添字がカテゴリコードになる。ClassifiedRows を参照）
+    CATEGORIES = (
+        '電気設備', '空気調和設備', '4.1 屋根', '2.2 杭・基礎',
+        '3.1 コンクリート', '3.3 鉄骨', '3.4 鉄筋', '3.9 その他',
+        '4.2 外壁', '4.3 外部開口部', '5.1 内部床', '5.2 内壁',
+        '5.3 内部開口部', '5.4 天井', '5.9 内部雑', '0.0 対象外'
+    )
+    
+    # 判定優先順位（ルール名, カテゴリ）。_classify_normalized の判定順と揃えること
+    RULES = [
+        ('parent_electric', '電気設備'),
+        ('parent_hvac', '空気調和設備'),
+        ('is_electric_equipment', '電気設備'),
+        ('is_hvac_equipment', '空気調和設備'),
+        ('is_roof', '4.1 屋根'),
+        ('is_pile_foundation', '2.2 杭・基礎'),
+        ('pile_work_category', '2.2 杭・基礎'),
+        ('is_concrete', '3.1 コンクリート'),
+        ('is_steel_frame', '3.3 鉄骨'),
+        ('is_rebar', '3.4 鉄筋'),
+        ('is_other_structure', '3.9 その他'),
+        ('is_exterior_wall', '4.2 外壁'),
+        ('is_exterior_opening', '4.3 外部開口部'),
+        ('is_interior_floor', '5.1 内部床'),
+        ('is_interior_wall', '5.2 内壁'),
+        ('is_interior_opening', '5.3 内部開口部'),
+        ('is_ceiling', '5.4 天井'),
+        ('is_interior_misc', '5.9 内部雑'),
+        ('is_excluded', '0.0 対象外'),
+    ]
+    
+    def __init__(self, cache_size=CLASSIFY_CACHE_SIZE, profile=False, store=None, neighbors=None):
+        self.categories = list(self.CATEGORIES)
+        
+        # キーワード集合を名称と同じ規則で正規化しておく（インスタンス属性で上書きする）
+        for attr in dir(type(self)):
+            keywords = getattr(self, attr)
+            if attr.isupper() and isinstance(keywords, frozenset):
+                setattr(self, attr, frozenset(canonicalize(k) for k in keywords))
+        
+        # 全キーワードを1つのオートマトンにまとめる（名称は1回だけ走査する）
+        keywords = (
+            self.ELECTRIC_KEYWORDS | self.HVAC_KEYWORDS
+            | self.ROOF_EXCLUDE | self.ROOF_POSITIONS | self.ROOF_FINISHES
+            | self.WATERPROOF_KEYWORDS | self.ROOF_PARTS
+            | self.PILE_EXCLUDE | self.PILE_KEYWORDS | self.PILE_WORK_KEYWORDS
+            | self.CONCRETE_EXCLUDE | self.CONCRETE_ROOF_POSITIONS | self.CONCRETE_ROOF_FINISHES
+            | self.CONCRETE_KEYWORDS
+            | self.STEEL_EXCLUDE | self.STEEL_KEYWORDS
+            | self.REBAR_EXCLUDE | self.REBAR_CAST_IN_PLACE | self.REBAR_KEYWORDS
+            | self.OTHER_STRUCTURE_KEYWORDS
+            | self.EXTERIOR_WALL_EXCLUDE | self.EXTERIOR_WALL_KEYWORDS
+            | self.EXTERIOR_OPENING_KEYWORDS | self.EXTERIOR_BASEBOARD_POSITIONS
+            | self.INTERIOR_FLOOR_EXCLUDE | self.INTERIOR_FLOOR_ROOF_POSITIONS
+            | self.INTERIOR_FLOOR_ROOF_FINISHES | self.INTERIOR_FLOOR_KEYWORDS
+            | self.INTERIOR_WALL_EXCLUDE | self.INTERIOR_WALL_KEYWORDS
+            | self.INTERIOR_OPENING_KEYWORDS | self.CEILING_KEYWORDS
+            | self.INTERIOR_MISC_KEYWORDS
+            | self.EXCLUDED_EXCLUDE | self.EXCLUDED_KEYWORDS
+        )
+        self.matcher = KeywordMatcher(keywords)
+        
+        # 正規化済みの (名称, 工事科目, 親カテゴリ) をキーにしたLRUキャッシュ
+        self.cache_size = cache_size
+        self._classify_cached = lru_cache(maxsize=cache_size)(self._classify_counted)
+        # counting() で渡されたスレッドごとのカウンター（ジョブごとにヒット・ミスを数える）
+        self._counting = threading.local()
+        
+        # ルール別プロファイル（有効時はキャッシュを通さず全行でルールを評価する）
+        self.profile = RuleProfile(self.RULES) if profile else None
+        # (ルール名, カテゴリ, 判定関数, 工事科目・親カテゴリも使うか)
+        self._profiled_rules = [
+            (name, category, getattr(self, '_match_' + name.removeprefix('is_')), not name.startswith('is_'))
+            for name, category in self.RULES
+        ]
+        
+        # 判定済みの名称の近傍索引（NeighborIndex。あればどのルールにも該当しない名称を近い名称の判定結果で判定する）
+        # 名称だけで決まるので、工事科目・親カテゴリを含む判定キャッシュとは別に名称単位でキャッシュする
+        self.neighbors = neighbors
+        self._neighbor_cached = lru_cache(maxsize=cache_size)(self._neighbor_category)
+        
+        # 名称→判定結果の永続ストア（CategoryStore。あれば判定ルールより先に照会する。プロファイル時は照会しない）
+        self.store = store
+        self._store_rules = self.rules_signature() if store is not None else ''
+    
+    def normalize_text(self, text):
+        """比較用に正規化する（canonicalize の結果はキャッシュされる）"""
+        if not text or text is None:
+            return ''
+        return canonicalize(str(text))
+    
+    def contains_any(self, text, keywords):
+        normalized = self.normalize_text(text)
+        return any(keyword in normalized for keyword in keywords)
+    
+    def find_keywords(self, name):
+        """名称に含まれるキーワード（除外語を含む）の集合を返す"""
+        return self.matcher.find(self.normalize_text(name))
+    
+    # 以下の _match_* はキーワードのヒット集合に対する判定ルール
+    def _match_electric_equipment(self, hits):
+        return not hits.isdisjoint(self.ELECTRIC_KEYWORDS)
+    
+    def _match_hvac_equipment(self, hits):
+        return not hits.isdisjoint(self.HVAC_KEYWORDS)
+    
+    def _match_roof(self, hits):
+        if not hits.isdisjoint(self.ROOF_EXCLUDE):
+            return False
+        
+        has_roof = not hits.isdisjoint(self.ROOF_POSITIONS)
+        if has_roof and not hits.isdisjoint(self.ROOF_FINISHES):
+            return True
+        if has_roof and not hits.isdisjoint(self.WATERPROOF_KEYWORDS):
+            return True
+        return not hits.isdisjoint(self.ROOF_PARTS)
+    
+    def _match_pile_foundation(self, hits):
+        if not hits.isdisjoint(self.PILE_EXCLUDE):
+            return False
+        return not hits.isdisjoint(self.PILE_KEYWORDS)
+    
+    def _match_concrete(self, hits):
+        if not hits.isdisjoint(self.CONCRETE_EXCLUDE):
+            return False
+        if not hits.isdisjoint(self.CONCRETE_ROOF_POSITIONS) and not hits.isdisjoint(self.CONCRETE_ROOF_FINISHES):
+            return False
+        return not hits.isdisjoint(self.CONCRETE_KEYWORDS)
+    
+    def _match_steel_frame(self, hits):
+        if not hits.isdisjoint(self.STEEL_EXCLUDE):
+            return False
+        return not hits.isdisjoint(self.STEEL_KEYWORDS)
+    
+    def _match_rebar(self, hits):
+        if not hits.isdisjoint(self.REBAR_EXCLUDE):
+            return False
+        if not hits.isdisjoint(self.REBAR_CAST_IN_PLACE) and '鉄筋' in hits:
+            return False
+        return not hits.isdisjoint(self.REBAR_KEYWORDS)
+    
+    def _match_other_structure(self, hits):
+        return not hits.isdisjoint(self.OTHER_STRUCTURE_KEYWORDS)
+    
+    def _match_exterior_wall(self, hits):
+        if not hits.isdisjoint(self.EXTERIOR_WALL_EXCLUDE):
+            return False
+        return not hits.isdisjoint(self.EXTERIOR_WALL_KEYWORDS)
+    
+    def _match_exterior_opening(self, hits):
+        if '巾木' in hits and not hits.isdisjoint(self.EXTERIOR_BASEBOARD_POSITIONS):
+            return True
+        return not hits.isdisjoint(self.EXTERIOR_OPENING_KEYWORDS)
+    
+    def _match_interior_floor(self, hits):
+        if not hits.isdisjoint(self.INTERIOR_FLOOR_EXCLUDE):
+            return False
+        if not hits.isdisjoint(self.INTERIOR_FLOOR_ROOF_POSITIONS) and not hits.isdisjoint(self.INTERIOR_FLOOR_ROOF_FINISHES):
+            return False
+        return not hits.isdisjoint(self.INTERIOR_FLOOR_KEYWORDS)
+    
+    def _match_interior_wall(self, hits):
+        if not hits.isdisjoint(self.INTERIOR_WALL_EXCLUDE):
+            return False
+        return not hits.isdisjoint(self.INTERIOR_WALL_KEYWORDS)
+    
+    def _match_interior_opening(self, hits):
+        return not hits.isdisjoint(self.INTERIOR_OPENING_KEYWORDS)
+    
+    def _match_ceiling(self, hits):
+        if '天井' in hits:
+            return True
+        return not hits.isdisjoint(self.CEILING_KEYWORDS)
+    
+    def _match_interior_misc(self, hits):
+        return not hits.isdisjoint(self.INTERIOR_MISC_KEYWORDS)
+    
+    def _match_excluded(self, hits):
+        if not hits.isdisjoint(self.EXCLUDED_EXCLUDE):
+            return True
+        return not hits.isdisjoint(self.EXCLUDED_KEYWORDS)
+    
+    def is_electric_equipment(self, name):
+        return self._match_electric_equipment(self.find_keywords(name))
+    
+    def is_hvac_equipment(self, name):
+        return self._match_hvac_equipment(self.find_keywords(name))
+    
+    def is_roof(self, name):
+        return self._match_roof(self.find_keywords(name))
+    
+    def is_pile_foundation(self, name):
+        return self._match_pile_foundation(self.find_keywords(name))
+    
+    def is_concrete(self, name):
+        return self._match_concrete(self.find_keywords(name))
+    
+    def is_steel_frame(self, name):
+        return self._match_steel_frame(self.find_keywords(name))
+    
+    def is_rebar(self, name):
+        return self._match_rebar(self.find_keywords(name))
+    
+    def is_other_structure(self, name):
+        return self._match_other_structure(self.find_keywords(name))
+    
+    def is_exterior_wall(self, name):
+        return self._match_exterior_wall(self.find_keywords(name))
+    
+    def is_exterior_opening(self, name):
+        return self._match_exterior_opening(self.find_keywords(name))
+    
+    def is_interior_floor(self, name):
+        return self._match_interior_floor(self.find_keywords(name))
+    
+    def is_interior_wall(self, name):
+        return self._match_interior_wall(self.find_keywords(name))
+    
+    def is_interior_opening(self, name):
+        return self._match_interior_opening(self.find_keywords(name))
+    
+    def is_ceiling(self, name):
+        return self._match_ceiling(self.find_keywords(name))
+    
+    def is_interior_misc(self, name):
+        return self._match_interior_misc(self.find_keywords(name))
+    
+    def is_excluded(self, name):
+        return self._match_excluded(self.find_keywords(name))
+    
+    def rules_signature(self):
+        """判定ルール（キーワード集合と優先順位）の指紋。変わった場合は差分判定で前回の結果を使わない"""
+        digest = hashlib.blake2b(digest_size=8)
+        for attr in sorted(dir(type(self))):
+            keywords = getattr(self, attr)
+            if attr.isupper() and isinstance(keywords, frozenset):
+                digest.update(repr((attr, sorted(keywords))).encode('utf-8'))
+        digest.update(repr(self.RULES).encode('utf-8'))
+        if self.neighbors is not None:
+            digest.update(self.neighbors.signature.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def cache_info(self):
+        """判定キャッシュの統計（hits, misses, maxsize, currsize）"""
+        return self._classify_cached.cache_info()
+    
+    @contextmanager
+    def counting(self, counter):
+        """with の間、このスレッドでの判定キャッシュの照会・ミスを counter（CacheCounter）に数える"""
+        previous = getattr(self._counting, 'counter', None)
+        self._counting.counter = counter
+        try:
+            yield counter
+        finally:
+            self._counting.counter = previous
+    
+    def cache_clear(self):
+        self._classify_cached.cache_clear()
+        self._neighbor_cached.cache_clear()
+    
+    def classify(self, name, work_category='', parent_category=''):
+        if not name or str(name).strip() == '':
+            return None
+        
+        key = self.store_key(name, work_category, parent_category)
+        # プロファイル時は判定ルールを計測するため永続ストアを照会しない
+        # （ストアの判定結果は process_workbook が判定の後で優先させる）
+        if self.store is not None and self.profile is None:
+            stored = self.store.get(key, self._store_rules)
+            if stored:
+                return stored
+        
+        if self.profile is not None:
+            return self._classify_profiled(*key)
+        
+        counter = getattr(self._counting, 'counter', None)
+        if counter is not None:
+            counter.lookups += 1
+        return self._classify_cached(*key)
+    
+    def store_key(self, name, work_category='', parent_category=''):
+        """判定キャッシュ・永続ストアのキー（正規化した (名称, 工事科目, 親カテゴリ)）"""
+        return (
+            self.normalize_text(name),
+            self.normalize_text(work_category),
+            self.normalize_text(parent_category)
+        )
+    
+    def lookup_stored(self, keys):
+        """永続ストアからキーの一覧の判定結果をまとめて読み込み、{キー: 判定結果} を返す（シート単位の先読み）"""
+        if self.store is None:
+            return {}
+        return self.store.prefetch(keys, self._store_rules)
+    
+    def store_results(self, entries):
+        """判定ルールで判定した (キー, 判定結果) を永続ストアに登録し、登録した件数を返す"""
+        if self.store is None:
+            return 0
+        return self.store.put_many(entries, SOURCE_RUN, self._store_rules)
+    
+    def _classify_counted(self, normalized, work_category, parent_normalized):
+        """判定キャッシュにない場合だけ呼ばれる（呼び出したスレッドのカウンターにミスを数える）"""
+        counter = getattr(self._counting, 'counter', None)
+        if counter is not None:
+            counter.misses += 1
+        return self._classify_normalized(normalized, work_category, parent_normalized)
+    
+    def _classify_normalized(self, normalized, work_category, parent_normalized):
+        # 親カテゴリが設備系の場合
+        if '設備工事' in parent_normalized:
+            if any(k in parent_normalized for k in self.PARENT_ELECTRIC_KEYWORDS):
+                return '電気設備'
+            elif any(k in parent_normalized for k in self.PARENT_HVAC_KEYWORDS):
+                return '空気調和設備'
+        
+        # 名称を1回だけ走査してヒット集合を得る
+        hits = self.matcher.find(normalized)
+        if not hits:
+            return self._neighbor_cached(normalized)
+        
+        # 判定優先順位
+        if self._match_electric_equipment(hits): return '電気設備'
+        if self._match_hvac_equipment(hits): return '空気調和設備'
+        if self._match_roof(hits): return '4.1 屋根'
+        if self._match_pile_foundation(hits): return '2.2 杭・基礎'
+        if '杭工事' in work_category and '施工費' in hits:
+            return '2.2 杭・基礎'
+        if self._match_concrete(hits): return '3.1 コンクリート'
+        if self._match_steel_frame(hits): return '3.3 鉄骨'
+        if self._match_rebar(hits): return '3.4 鉄筋'
+        if self._match_other_structure(hits): return '3.9 その他'
+        if self._match_exterior_wall(hits): return '4.2 外壁'
+        if self._match_exterior_opening(hits): return '4.3 外部開口部'
+        if self._match_interior_floor(hits): return '5.1 内部床'
+        if self._match_interior_wall(hits): return '5.2 内壁'
+        if self._match_interior_opening(hits): return '5.3 内部開口部'
+        if self._match_ceiling(hits): return '5.4 天井'
+        if self._match_interior_misc(hits): return '5.9 内部雑'
+        if self._match_excluded(hits): return '0.0 対象外'
+        return self._neighbor_cached(normalized)
+    
+    def _neighbor_category(self, normalized):
+        """どのルールにも該当しなかった名称の判定結果（近傍索引で確信度の高い近い名称があればその判定結果）"""
+        if self.neighbors is not None:
+            match = self.neighbors.query(normalized)
+            if match is not None:
+                return match.category
+        return '0.0 対象外'
+    
+    def similar_names(self, name):
+        """近傍索引で近い名称を探し、NeighborMatch（判定結果・確信度・近い名称）を返す（索引がない・近い名称がない場合は None）"""
+        if self.neighbors is None or not name or str(name).strip() == '':
+            return None
+        return self.neighbors.query(self.normalize_text(name))
+    
+    # 親カテゴリ・工事科目によるルール（プロファイル時に RULES の順で呼ばれる）
+    def _match_parent_electric(self, hits, work_category, parent_normalized):
+        return '設備工事' in parent_normalized and any(k in parent_normalized for k in self.PARENT_ELECTRIC_KEYWORDS)
+    
+    def _match_parent_hvac(self, hits, work_category, parent_normalized):
+        return '設備工事' in parent_normalized and any(k in parent_normalized for k in self.PARENT_HVAC_KEYWORDS)
+    
+    def _match_pile_work_category(self, hits, work_category, parent_normalized):
+        return '杭工事' in work_category and '施工費' in hits
+    
+    def _classify_profiled(self, normalized, work_category, parent_normalized):
+        """_classify_normalized と同じ判定を、ルールごとに計測しながら行う"""
+        profile = self.profile
+        perf_counter = time.perf_counter
+        profile.rows += 1
+        
+        start = perf_counter()
+        hits = self.matcher.find(normalized)
+        profile.calls[RuleProfile.SCAN] += 1
+        profile.seconds[RuleProfile.SCAN] += perf_counter() - start
+        
+        for name, category, match, uses_context in self._profiled_rules:
+            start = perf_counter()
+            if uses_context:
+                decided = match(hits, work_category, parent_normalized)
+            else:
+                decided = match(hits)
+            profile.calls[name] += 1
+            profile.seconds[name] += perf_counter() - start
+            if decided:
+                profile.decided[name] += 1
+                return category
+        
+        if self.neighbors is not None:
+            start = perf_counter()
+            category = self._neighbor_category(normalized)
+            profile.calls[RuleProfile.NEIGHBOR] += 1
+            profile.seconds[RuleProfile.NEIGHBOR] += perf_counter() - start
+            if category != '0.0 対象外':
+                profile.decided[RuleProfile.NEIGHBOR] += 1
+                return category
+        
+        profile.calls[RuleProfile.DEFAULT] += 1
+        profile.decided[RuleProfile.DEFAULT] += 1
+        return '0.0 対象外'
+    
+    def classify_frame(self, df, name_col=FRAME_NAME_COL,
+                       work_category_col=FRAME_WORK_CATEGORY_COL, parent_col=FRAME_PARENT_COL):
+        """DataFrameの全行を列単位のマスク演算でまとめて判定する
+        
+        判定結果は classify と同じで、名称が空（欠損値を含む）の行は None になる。
+        永続ストアがあれば、classify と同じくストアの判定結果（手修正など）を判定ルールより優先する。
+        """
+        import numpy as np
+        import pandas as pd
+        
+        # 重複を除いた値だけを正規化し、マスクも一意な値に対してだけ計算する
+        # （欠損値は末尾に追加した空欄に対応させる）
+        def factorize(column):
+            codes, uniques = pd.factorize(df[column].to_numpy(dtype=object))
+            return codes, pd.Series([self.normalize_text(v) for v in uniques] + [''])
+        
+        names = factorize(name_col)
+        work_categories = factorize(work_category_col) if work_category_col in df else None
+        parents = factorize(parent_col) if parent_col in df else None
+        
+        # キーワード集合ごとの一致マスク（同じ集合は1回だけ計算する）
+        masks = {}
+        def has(keywords, column=names):
+            key = (id(column), keywords)
+            if key not in masks:
+                codes, uniques = column
+                pattern = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+                masks[key] = uniques.str.contains(pattern, regex=True).to_numpy(dtype=bool)[codes]
+            return masks[key]
+        
+        def has_one(keyword, column=names):
+            return has(frozenset([keyword]), column)
+        
+        nothing = np.zeros(len(df), dtype=bool)
+        if parents is not None:
+            equipment_parent = has_one('設備工事', parents)
+            parent_electric = equipment_parent & has(self.PARENT_ELECTRIC_KEYWORDS, parents)
+            parent_hvac = equipment_parent & ~parent_electric & has(self.PARENT_HVAC_KEYWORDS, parents)
+        else:
+            parent_electric = parent_hvac = nothing
+        if work_categories is not None:
+            pile_work = has_one('杭工事', work_categories) & has(self.PILE_WORK_KEYWORDS)
+        else:
+            pile_work = nothing
+        
+        # 判定優先順位（classify と同じ順序）
+        rules = [
+            ('電気設備', parent_electric),
+            ('空気調和設備', parent_hvac),
+            ('電気設備', has(self.ELECTRIC_KEYWORDS)),
+            ('空気調和設備', has(self.HVAC_KEYWORDS)),
+            ('4.1 屋根', ~has(self.ROOF_EXCLUDE) & (
+                (has(self.ROOF_POSITIONS) & (has(self.ROOF_FINISHES) | has(self.WATERPROOF_KEYWORDS)))
+                | has(self.ROOF_PARTS))),
+            ('2.2 杭・基礎', ~has(self.PILE_EXCLUDE) & has(self.PILE_KEYWORDS)),
+            ('2.2 杭・基礎', pile_work),
+            ('3.1 コンクリート', ~has(self.CONCRETE_EXCLUDE)
+                & ~(has(self.CONCRETE_ROOF_POSITIONS) & has(self.CONCRETE_ROOF_FINISHES))
+                & has(self.CONCRETE_KEYWORDS)),
+            ('3.3 鉄骨', ~has(self.STEEL_EXCLUDE) & has(self.STEEL_KEYWORDS)),
+            ('3.4 鉄筋', ~has(self.REBAR_EXCLUDE)
+                & ~(has(self.REBAR_CAST_IN_PLACE) & has_one('鉄筋'))
+                & has(self.REBAR_KEYWORDS)),
+            ('3.9 その他', has(self.OTHER_STRUCTURE_KEYWORDS)),
+            ('4.2 外壁', ~has(self.EXTERIOR_WALL_EXCLUDE) & has(self.EXTERIOR_WALL_KEYWORDS)),
+            ('4.3 外部開口部', (has_one('巾木') & has(self.EXTERIOR_BASEBOARD_POSITIONS))
+                | has(self.EXTERIOR_OPENING_KEYWORDS)),
+            ('5.1 内部床', ~has(self.INTERIOR_FLOOR_EXCLUDE)
+                & ~(has(self.INTERIOR_FLOOR_ROOF_POSITIONS) & has(self.INTERIOR_FLOOR_ROOF_FINISHES))
+                & has(self.INTERIOR_FLOOR_KEYWORDS)),
+            ('5.2 内壁', ~has(self.INTERIOR_WALL_EXCLUDE) & has(self.INTERIOR_WALL_KEYWORDS)),
+            ('5.3 内部開口部', has(self.INTERIOR_OPENING_KEYWORDS)),
+            ('5.4 天井', has_one('天井') | has(self.CEILING_KEYWORDS)),
+            ('5.9 内部雑', has(self.INTERIOR_MISC_KEYWORDS)),
+        ]
+        
+        labels = np.select(
+            [mask for _, mask in rules],
+            [category for category, _ in rules],
+            default='0.0 対象外'
+        ).astype(object)
+        codes, uniques = names
+        empty = (uniques == '').to_numpy()[codes]
+        if self.neighbors is not None:
+            # どのルールにも該当しない行（除外キーワードに該当する行を除く）は近傍索引で判定する（名称ごとに1回）
+            unmatched = ~np.logical_or.reduce([mask for _, mask in rules]) & ~empty
+            unmatched &= ~(has(self.EXCLUDED_EXCLUDE) | has(self.EXCLUDED_KEYWORDS))
+            fallback = {code: self._neighbor_cached(uniques.iloc[code]) for code in np.unique(codes[unmatched])}
+            labels[unmatched] = [fallback[code] for code in codes[unmatched]]
+        if self.store is not None:
+            # 永続ストアの判定結果で上書きする（キーは store_key と同じ正規化済みの値、照会は重複を除いて1回）
+            def normalized(column):
+                if column is None:
+                    return np.full(len(df), '', dtype=object)
+                return column[1].to_numpy(dtype=object)[column[0]]
+            keys = list(zip(normalized(names), normalized(work_categories), normalized(parents)))
+            stored = self.lookup_stored(set(keys))
+            if stored:
+                found = np.array([stored.get(key) for key in keys], dtype=object)
+                hit = np.array([value is not None for value in found], dtype=bool) & ~empty
+                labels[hit] = found[hit]
+        labels[empty] = None
+        return pd.Series(labels, index=df.index, name='判定結果', dtype=object)
+
+# 最上位明細シートのレイアウト（行・列は0始まり、Excel上は+1）
+TARGET_SHEET = '最上位明細'
+HEADER_ROW = 6
+DATA_START_ROW = 7
+WORK_CATEGORY_COL = 1
+NAME_COL = 2
+CLASSIFICATION_COL = 12
+
+# 明細シートのレイアウト（行・列は0始まり、明細は見出し行の次の行から。工事科目列がない場合は None）
+SheetLayout = namedtuple('SheetLayout', ['header_row', 'work_category_col', 'name_col', 'classification_col'])
+DEFAULT_LAYOUT = SheetLayout(HEADER_ROW, WORK_CATEGORY_COL, NAME_COL, CLASSIFICATION_COL)
+
+# レイアウトの自動検出（先頭から LAYOUT_SCAN_ROWS 行の中で「名称」の列見出しがある行を見出し行とする）
+LAYOUT_SCAN_ROWS = 30
+NAME_HEADERS = frozenset(['名称', '品名', '名称・規格'])
+WORK_CATEGORY_HEADERS = frozenset(['工事科目', '科目'])
+CLASSIFICATION_HEADERS = frozenset(['判定結果', '工事細目', '細目', '分類'])
+
+# 差分判定用の指紋を保存する非表示シート（1行目はルールの指紋、2行目以降は行の指紋）
+FINGERPRINT_SHEET = '_判定指紋'
+
+def detect_layout(ws):
+    """列見出しからシートのレイアウトを推定する（見出し行が見つからない場合は None）
+    
+    判定結果列は「判定結果」などの見出しがあればその列、なければ既定の列（M列）、
+    既定の列が見出しで使われている場合は最後の見出しの次の列とする。
+    """
+    rows = ws.iter_rows(min_row=1, max_row=LAYOUT_SCAN_ROWS, values_only=True)
+    for header_row, values in enumerate(rows):
+        headers = [canonicalize(str(value)) if value is not None else '' for value in values]
+        
+        def find(candidates):
+            return next((col for col, header in enumerate(headers) if header in candidates), None)
+        
+        name_col = find(NAME_HEADERS)
+        if name_col is None:
+            continue
+        classification_col = find(CLASSIFICATION_HEADERS)
+        if classification_col is None:
+            last_col = max(col for col, header in enumerate(headers) if header)
+            classification_col = CLASSIFICATION_COL if last_col < CLASSIFICATION_COL else last_col + 1
+        return SheetLayout(header_row, find(WORK_CATEGORY_HEADERS), name_col, classification_col)
+    return None
+
+def iter_detail_rows(ws, with_classification=False, layout=DEFAULT_LAYOUT):
+    """明細行の (Excel行番号, 工事科目, 名称) を順に返す
+    
+    工事科目・名称の2列だけを iter_rows(values_only=True) で読むので、
+    read_only モードのワークシートでも1セルずつ参照せずに済む。
+    with_classification=True の場合は判定結果列の値を加えた4要素で返す。
+    layout（SheetLayout）で見出し行・列の位置を指定する（既定は最上位明細シートのレイアウト）。
+    """
+    first_row = layout.header_row + 2
+    columns = [col for col in (layout.work_category_col, layout.name_col) if col is not None]
+    if with_classification and ws.parent.read_only:
+        # read_only モードでは判定結果列までまとめて1回で読む
+        columns.append(layout.classification_col)
+    first_col = min(columns)
+    last_col = max(columns)
+    
+    name_idx = layout.name_col - first_col
+    work_category_idx = None if layout.work_category_col is None else layout.work_category_col - first_col
+    rows = ws.iter_rows(min_row=first_row, min_col=first_col + 1, max_col=last_col + 1, values_only=True)
+    
+    if not with_classification:
+        for excel_row, values in enumerate(rows, start=first_row):
+            yield excel_row, values[work_category_idx] if work_category_idx is not None else None, values[name_idx]
+        return
+    
+    if ws.parent.read_only:
+        classification_idx = layout.classification_col - first_col
+        for excel_row, values in enumerate(rows, start=first_row):
+            work_category = values[work_category_idx] if work_category_idx is not None else None
+            yield excel_row, work_category, values[name_idx], values[classification_idx]
+        return
+    
+    # 通常モードでは判定結果列を別に読む（間の列まで読むと空セルが作られてしまう）
+    classifications = ws.iter_rows(min_row=first_row, min_col=layout.classification_col + 1,
+                                   max_col=layout.classification_col + 1, values_only=True)
+    for excel_row, (values, (classification,)) in enumerate(zip(rows, classifications), start=first_row):
+        work_category = values[work_category_idx] if work_category_idx is not None else None
+        yield excel_row, work_category, values[name_idx], classification
+
+def classify_detail_rows(rows, classifier, on_progress=None, initial_parent=''):
+    """明細行を順に判定し、(Excel行番号, 判定結果) の組を ClassifiedRows で返す
+    
+    名称に「設備工事」を含む行を親カテゴリとして後続の行へ引き継ぐ。
+    initial_parent は先頭行の時点で有効な親カテゴリ（途中から判定する場合に使う）。
+    on_progress には100行ごとに処理済み行数が渡される。
+    """
+    results = ClassifiedRows(classifier.categories)
+    current_parent = initial_parent
+    
+    for index, (excel_row, work_category, name) in enumerate(rows):
+        # 進捗更新
+        if on_progress and index % 100 == 0:
+            on_progress(index)
+        
+        # 親カテゴリの更新
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        
+        # 判定実行
+        if name and str(name).strip() != '':
+            classification = classifier.classify(name, work_category or '', current_parent)
+            if classification:
+                results.append(excel_row, classification)
+    
+    return results
+
+def detail_row_keys(rows, classifier):
+    """明細行ごとの (Excel行番号, 永続ストアのキー) を順に返す（名称が空の行は含めない）"""
+    current_parent = ''
+    for excel_row, work_category, name in rows:
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        if name and str(name).strip() != '':
+            yield excel_row, classifier.store_key(name, work_category or '', current_parent)
+
+class ClassifiedRows:
+    """判定結果の行（Excel行番号と判定結果の組）の並び
+    
+    判定結果は categories の添字（カテゴリコード）として array('B') に、行番号は array('I') に詰めて持つ。
+    1行あたり5バイトで済み、プロセス間の受け渡しや結合も配列のまま行える。
+    文字列に戻すのはシート・画面に書き出すとき（labels・counts・反復）だけにする。
+    categories にない判定結果（判定結果列から引き継いだ値など）は、その都度末尾にコードを追加する。
+    反復すると (Excel行番号, 判定結果) の組を順に返す。
+    """
+    
+    __slots__ = ('categories', 'rows', 'codes', '_codes')
+    
+    def __init__(self, categories=ConstructionItemClassifier.CATEGORIES, pairs=()):
+        self.categories = list(categories)
+        self._codes = {category: code for code, category in enumerate(self.categories)}
+        self.rows = array('I')
+        self.codes = array('B')
+        for excel_row, category in pairs:
+            self.append(excel_row, category)
+    
+    def code(self, category):
+        """判定結果のカテゴリコード（categories にない値は追加する）"""
+        code = self._codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            if code > 0xFF and self.codes.typecode == 'B':
+                self.codes = array('H', self.codes)
+            self.categories.append(category)
+            self._codes[category] = code
+        return code
+    
+    def append(self, excel_row, category):
+        code = self.code(category)  # コードの配列を広げることがあるので先に求める
+        self.rows.append(excel_row)
+        self.codes.append(code)
+    
+    def extend(self, other):
+        """別の ClassifiedRows を後ろに連結する（カテゴリの並びが揃っていればコードの配列をそのまま連結する）"""
+        self.rows.extend(other.rows)
+        if (other.codes.typecode == self.codes.typecode
+                and other.categories == self.categories[:len(other.categories)]):
+            self.codes.extend(other.codes)
+        else:
+            codes = [self.code(category) for category in other.categories]
+            self.codes.extend(codes[code] for code in other.codes)
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def __iter__(self):
+        return zip(self.rows, map(self.categories.__getitem__, self.codes))
+    
+    def __eq__(self, other):
+        if not isinstance(other, ClassifiedRows):
+            return NotImplemented
+        return self.rows == other.rows and list(self) == list(other)
+    
+    def labels(self):
+        """{Excel行番号: 判定結果}（シートへの書き込み用）"""
+        return dict(self)
+    
+    def counts(self):
+        """カテゴリ別件数（categories の順に、0件のカテゴリも含む）
+        
+        コードの配列をまとめて数えるので、行ごとに辞書を更新するより速い。
+        """
+        if self.codes.typecode == 'B':
+            data = self.codes.tobytes()
+            counts = [data.count(code) for code in range(len(self.categories))]
+        else:
+            counter = Counter(self.codes)
+            counts = [counter[code] for code in range(len(self.categories))]
+        return dict(zip(self.categories, counts))
+
+# 判定キャッシュ統計（並列判定時はワーカー全体の合計）と、永続ストアの判定結果を使った行数
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'maxsize', 'currsize', 'store_hits'], defaults=(0,))
+
+# 差分判定の統計（前回の判定結果を使った行数, 判定し直した行数）
+ReuseStats = namedtuple('ReuseStats', ['reused', 'recomputed'])
+
+def row_fingerprint(classifier, name, work_category, parent_category):
+    """行の指紋（正規化した名称・工事科目・有効な親カテゴリのハッシュ値）"""
+    key = '\x1f'.join((
+        classifier.normalize_text(name),
+        classifier.normalize_text(work_category),
+        classifier.normalize_text(parent_category)
+    ))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+def labelled_fingerprint(fingerprint, classification):
+    """行の指紋と、その行の判定結果列に書いた値を合わせた指紋（指紋シートにはこれを保存する）
+    
+    名称を別の行と同じ内容に書き換えた行は、行の指紋が前回のどれかの行と一致しても、
+    判定結果列の値がその内容に対して書いた値と違えば一致しない（古い判定結果を使い回さない）。
+    """
+    key = f"{fingerprint}\x1f{classification}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+def stored_fingerprints(wb, classifier):
+    """前回の差分判定で保存した指紋（labelled_fingerprint）の集合を返す
+    
+    指紋シートがない場合や、判定ルールが変わっている場合は None
+    """
+    if FINGERPRINT_SHEET not in wb.sheetnames:
+        return None
+    values = [row[0] for row in wb[FINGERPRINT_SHEET].iter_rows(max_col=1, values_only=True)]
+    if not values or values[0] != classifier.rules_signature():
+        return None
+    return set(values[1:])
+
+def load_reusable_results(wb, classifier):
+    """判定済みのワークブックから {行の指紋: 判定結果} を作る
+    
+    指紋シートがあれば、前回の判定時から内容・判定結果列の値がどちらも変わっていない行だけを使う。
+    指紋シートがない場合（以前の版で判定したファイル）は判定結果列をそのまま信用する。
+    """
+    if TARGET_SHEET not in wb.sheetnames:
+        raise ValueError(f"前回の判定結果にシート「{TARGET_SHEET}」が見つかりません")
+    
+    known = stored_fingerprints(wb, classifier)
+    if known is None and FINGERPRINT_SHEET in wb.sheetnames:
+        return {}  # 判定ルールが変わっている
+    
+    reusable = {}
+    current_parent = ''
+    for _, work_category, name, classification in iter_detail_rows(wb[TARGET_SHEET], with_classification=True):
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        if not classification or not name or str(name).strip() == '':
+            continue
+        fingerprint = row_fingerprint(classifier, name, work_category or '', current_parent)
+        if known is None or labelled_fingerprint(fingerprint, classification) in known:
+            reusable[fingerprint] = classification
+    return reusable
+
+def classify_detail_rows_incremental(rows, classifier, known=None, reusable=None, on_progress=None):
+    """前回から変わった行だけを判定する（差分判定）
+    
+    rows は iter_detail_rows(ws, with_classification=True) の4要素の行。
+    行の指紋と判定結果列の値の組（labelled_fingerprint）が known に含まれていれば判定結果列の値を、
+    行の指紋が reusable にあればその判定結果を使い、どちらにもない行だけを classifier で判定する。
+    戻り値は ((Excel行番号, 判定結果) の ClassifiedRows, 全行の指紋（labelled_fingerprint）の集合, 差分判定の統計)
+    """
+    known = known or set()
+    reusable = reusable or {}
+    results = ClassifiedRows(classifier.categories)
+    fingerprints = set()
+    reused = recomputed = 0
+    current_parent = ''
+    
+    for index, (excel_row, work_category, name, existing) in enumerate(rows):
+        if on_progress and index % 100 == 0:
+            on_progress(index)
+        
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        
+        if not name or str(name).strip() == '':
+            continue
+        
+        fingerprint = row_fingerprint(classifier, name, work_category or '', current_parent)
+        if existing and labelled_fingerprint(fingerprint, existing) in known:
+            classification = existing
+            reused += 1
+        elif fingerprint in reusable:
+            classification = reusable[fingerprint]
+            reused += 1
+        else:
+            classification = classifier.classify(name, work_category or '', current_parent)
+            recomputed += 1
+        if classification:
+            results.append(excel_row, classification)
+            fingerprints.add(labelled_fingerprint(fingerprint, classification))
+    
+    return results, fingerprints, ReuseStats(reused, recomputed)
+
+def fingerprint_sheet_values(classifier, fingerprints):
+    """指紋シートのA列の値（1行目はルールの指紋）"""
+    return [classifier.rules_signature()] + sorted(fingerprints)
+
+def write_fingerprints(wb, classifier, fingerprints):
+    """行の指紋を非表示シートに保存する（次回の差分判定で使う）"""
+    if FINGERPRINT_SHEET in wb.sheetnames:
+        del wb[FINGERPRINT_SHEET]
+    ws = wb.create_sheet(FINGERPRINT_SHEET)
+    ws.sheet_state = 'veryHidden'
+    for value in fingerprint_sheet_values(classifier, fingerprints):
+        ws.append([value])
+
+def chunk_start_parents(rows, chunk_size):
+    """各チャンクの先頭行の時点で有効な親カテゴリを返す（逐次判定と同じ引き継ぎ規則）"""
+    parents = []
+    current_parent = ''
+    for index, (_, _, name) in enumerate(rows):
+        if index % chunk_size == 0:
+            parents.append(current_parent)
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+    return parents
+
+def process_pool(workers, **options):
+    """fork を使わずにワーカープロセスを起動する ProcessPoolExecutor を返す（options は ProcessPoolExecutor に渡す）"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    available = multiprocessing.get_all_start_methods()
+    method = next(method for method in PROCESS_START_METHODS if method in available)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method), **options)
+
+# ワーカープロセスごとの分類器（チャンクをまたいでキャッシュを使い回す）と近傍索引（プール作成時に1回だけ渡す）
+_worker_classifier = None
+_worker_neighbors = None
+
+def _init_worker(neighbors):
+    global _worker_neighbors
+    _worker_neighbors = neighbors
+
+def _classify_chunk(chunk, initial_parent, cache_size):
+    global _worker_classifier
+    if _worker_classifier is None or _worker_classifier.cache_size != cache_size:
+        _worker_classifier = ConstructionItemClassifier(cache_size=cache_size, neighbors=_worker_neighbors)
+    
+    with _worker_classifier.counting(CacheCounter()) as counter:
+        results = classify_detail_rows(chunk, _worker_classifier, initial_parent=initial_parent)
+    return results, os.getpid(), counter.hits, counter.misses, _worker_classifier.cache_info().currsize
+
+def classify_detail_rows_parallel(rows, workers=CLASSIFY_WORKERS, chunk_size=PARALLEL_CHUNK_SIZE,
+                                  cache_size=CLASSIFY_CACHE_SIZE, on_progress=None, neighbors=None):
+    """明細行をチャンクに分けてプロセスプールで並列に判定する
+    
+    先に親カテゴリだけを走査して各チャンクの開始時点の親カテゴリを求めるので、
+    結果は classify_detail_rows の逐次判定と一致する。
+    neighbors（NeighborIndex）を渡すと各ワーカーの分類器で近傍検索を使う。
+    戻り値は ((Excel行番号, 判定結果) の ClassifiedRows, 判定キャッシュ統計)
+    """
+    sheet_results, cache_info = classify_sheets_parallel(
+        {None: rows}, workers=workers, chunk_size=chunk_size, cache_size=cache_size, on_progress=on_progress,
+        neighbors=neighbors
+    )
+    return sheet_results[None], cache_info
+
+def classify_sheets_parallel(sheet_rows, workers=CLASSIFY_WORKERS, chunk_size=PARALLEL_CHUNK_SIZE,
+                             cache_size=CLASSIFY_CACHE_SIZE, on_progress=None, neighbors=None):
+    """複数シートの明細行 {シート名: 明細行} をまとめてチャンクに分け、プロセスプールで並列に判定する
+    
+    シート単位ではなくチャンク単位で分散するので、シートの数や大きさの偏りによらずワーカー数だけ並列になる。
+    親カテゴリはシートごとに先頭から引き継ぐ（シートをまたがない）。neighbors は classify_detail_rows_parallel と同じ。
+    ワーカーからはカテゴリコードの配列（ClassifiedRows）で受け取り、チャンクの順に配列のまま連結する。
+    戻り値は ({シート名: (Excel行番号, 判定結果) の ClassifiedRows}, 判定キャッシュ統計)
+    """
+    from concurrent.futures import as_completed
+    
+    tasks = []  # (シート名, チャンク, 開始時点の親カテゴリ)
+    for sheet, rows in sheet_rows.items():
+        rows = list(rows)
+        chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+        tasks.extend((sheet, chunk, parent) for chunk, parent in zip(chunks, chunk_start_parents(rows, chunk_size)))
+    
+    chunk_results = [None] * len(tasks)
+    hits = misses = 0
+    cache_sizes = {}
+    done = 0
+    
+    with process_pool(workers, initializer=_init_worker, initargs=(neighbors,)) as executor:
+        futures = {
+            executor.submit(_classify_chunk, chunk, parent, cache_size): index
+            for index, (_, chunk, parent) in enumerate(tasks)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            results, pid, chunk_hits, chunk_misses, currsize = future.result()
+            chunk_results[index] = results
+            hits += chunk_hits
+            misses += chunk_misses
+            cache_sizes[pid] = currsize
+            
+            done += len(tasks[index][1])
+            if on_progress:
+                on_progress(done)
+    
+    sheet_results = {sheet: ClassifiedRows() for sheet in sheet_rows}
+    for (sheet, _, _), results in zip(tasks, chunk_results):
+        sheet_results[sheet].extend(results)
+    return sheet_results, CacheStats(hits, misses, cache_size, sum(cache_sizes.values()))
+
+# 分析用エクスポート（CSV / Parquet）の列と形式
+EXPORT_ROW_COL = '行番号'
+EXPORT_CLASSIFICATION_COL = '判定結果'
+EXPORT_COLUMNS = [EXPORT_ROW_COL, FRAME_NAME_COL, FRAME_WORK_CATEGORY_COL, FRAME_PARENT_COL, EXPORT_CLASSIFICATION_COL]
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_BATCH_SIZE = 10000  # Parquet の書き込み単位（行数）
+
+def available_export_formats():
+    """この環境で書き出せるエクスポート形式（Parquet は pyarrow が読み込める場合だけ）"""
+    import importlib.util
+    
+    return tuple(
+        export_format for export_format in EXPORT_FORMATS
+        if export_format != 'parquet' or importlib.util.find_spec('pyarrow') is not None
+    )
+
+def iter_export_records(rows, classifier=None, results=None):
+    """明細行から (Excel行番号, 名称, 工事科目, 親カテゴリ, 判定結果) を順に返す
+    
+    results（{Excel行番号: 判定結果}）を渡すとその値を使い、渡さない場合は classifier でその場で判定する。
+    名称が空の行は含めない。
+    """
+    current_parent = ''
+    for excel_row, work_category, name in rows:
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        if not name or str(name).strip() == '':
+            continue
+        work_category = '' if work_category is None else str(work_category)
+        if results is None:
+            classification = classifier.classify(name, work_category, current_parent)
+        else:
+            classification = results.get(excel_row)
+        yield excel_row, str(name), work_category, current_parent, classification or ''
+
+def write_export(records, output, export_format='csv'):
+    """判定結果のレコードを CSV（Excelで開けるよう BOM 付き UTF-8）か Parquet でバイナリストリームに書き出す
+    
+    records は逐次書き出すので、全件をメモリに持たずに済む。戻り値は書き出した行数。
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"未対応のエクスポート形式です: {export_format}")
+    
+    count = 0
+    if export_format == 'csv':
+        import csv
+        from io import TextIOWrapper
+        
+        text = TextIOWrapper(output, encoding='utf-8-sig', newline='')
+        try:
+            writer = csv.writer(text)
+            writer.writerow(EXPORT_COLUMNS)
+            for record in records:
+                writer.writerow(record)
+                count += 1
+            text.flush()
+        finally:
+            text.detach()
+        return count
+    
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet で出力するには pyarrow が必要です（pip install pyarrow）") from None
+    
+    schema = pa.schema(
+        [(EXPORT_ROW_COL, pa.int32())] + [(col, pa.string()) for col in EXPORT_COLUMNS[1:]]
+    )
+    
+    def flush(batch):
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)],
+            schema=schema
+        ))
+    
+    with pq.ParquetWriter(output, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                flush(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            flush(batch)
+            count += len(batch)
+    return count
+
+def process_workbook(source, cache_size=CLASSIFY_CACHE_SIZE, workers=CLASSIFY_WORKERS, on_progress=None,
+                     classifier=None, incremental=False, previous=None, writer=WORKBOOK_WRITER,
+                     export=None, export_format='csv', telemetry=None):
+    """Excelファイルを判定して結果を書き込む（Streamlitに依存しない本体）
+    
+    工事科目・名称列を流し読みで全行読み込んで判定してから、判定結果をまとめて書き込む。
+    workers が2以上で行数が PARALLEL_MIN_ROWS 以上の場合は判定を並列に行う。
+    classifier を渡すとその分類器（と判定キャッシュ）を使い回す。
+    incremental=True の場合は差分判定を行い、前回の差分判定から変わっていない行は判定結果列の値を、
+    previous（判定済みの旧版ファイル）に同じ内容の行があればその判定結果を使う。
+    差分判定では行の指紋を非表示シートに保存し、判定は逐次で行う。
+    writer は保存方法（WORKBOOK_WRITER を参照）。'patch' では読み込みも read_only モードで行う。
+    classifier に永続ストアがあれば、判定の前にシート全体をまとめて照会し、判定ルールの結果を登録する。
+    export（バイナリストリーム）を渡すと、同じ判定結果を分析用に export_format（'csv' / 'parquet'）でも書き出す。
+    書き出しに失敗した場合は判定結果の保存を続け、理由を telemetry の export_error に記録する。
+    telemetry（RunTelemetry）を渡すと段階別の所要時間・行数・キャッシュ統計などを記録する。
+    on_progress には (進捗率0-100, メッセージ) が渡される。
+    戻り値は (出力BytesIO, カテゴリ別件数, 今回の処理分の判定キャッシュ統計, 差分判定の統計)
+    """
+    import openpyxl
+    
+    if telemetry is None:
+        telemetry = RunTelemetry()
+    telemetry.update(file_bytes=_source_size(source), sheets=1, incremental=incremental, workers=workers)
+    
+    def report(percent, message):
+        if on_progress:
+            with telemetry.stage('progress'):
+                on_progress(percent, message)
+    
+    # ファイルを読み込み（patch では値だけを流し読みし、openpyxl では書式保持のため通常モードで読み込む）
+    report(10, "📂 ファイルを読み込み中...")
+    
+    with telemetry.stage('load'):
+        wb = openpyxl.load_workbook(source, read_only=(writer == 'patch'))
+    
+    if TARGET_SHEET not in wb.sheetnames:
+        wb.close()
+        raise ValueError(f"シート「{TARGET_SHEET}」が見つかりません")
+    
+    ws = wb[TARGET_SHEET]
+    
+    # 分類器の初期化
+    if classifier is None:
+        classifier = ConstructionItemClassifier(cache_size=cache_size)
+    
+    # 明細行をすべて読み込む（read_only モードでは使用範囲の記録がないと max_row が分からないので、
+    # 並列判定の要否と進捗は読み込んだ行数で決める）
+    with telemetry.stage('read'):
+        rows = list(iter_detail_rows(ws, with_classification=incremental))
+    total_rows = max(len(rows), 1)
+    
+    # 永続ストアはシート全体のキーを判定の前にまとめて照会する
+    row_keys = {}
+    stored = {}
+    if classifier.store is not None:
+        with telemetry.stage('store'):
+            row_keys = dict(detail_row_keys((row[:3] for row in rows), classifier))
+            stored = classifier.lookup_stored(row_keys.values())
+    
+    report(20, f"🔍 判定を実行中... (0 / {total_rows})")
+    
+    def on_rows(done):
+        report(20 + int(min(done / total_rows, 1.0) * 60), f"🔍 判定を実行中... ({done} / {total_rows})")
+    
+    # 判定フェーズ（セルへの書き込みはまだ行わない）
+    # 差分判定・プロファイル有効時は逐次で判定する
+    fingerprints = None
+    counter = CacheCounter()  # 同じ分類器で並行して動くほかのジョブの照会を含めないよう、この処理の分だけ数える
+    parallel = workers > 1 and total_rows >= PARALLEL_MIN_ROWS and classifier.profile is None and not incremental
+    if parallel:
+        with telemetry.stage('classify'):
+            results, cache_info = classify_detail_rows_parallel(
+                rows, workers=workers, chunk_size=PARALLEL_CHUNK_SIZE, cache_size=cache_size, on_progress=on_rows,
+                neighbors=classifier.neighbors
+            )
+        reuse_info = ReuseStats(0, len(results))
+    else:
+        if incremental:
+            reusable = {}
+            if previous is not None:
+                with telemetry.stage('load_previous'):
+                    previous_wb = openpyxl.load_workbook(previous, read_only=True)
+                    try:
+                        reusable = load_reusable_results(previous_wb, classifier)
+                    finally:
+                        previous_wb.close()
+            with telemetry.stage('classify'), classifier.counting(counter):
+                results, fingerprints, reuse_info = classify_detail_rows_incremental(
+                    rows, classifier,
+                    known=stored_fingerprints(wb, classifier), reusable=reusable, on_progress=on_rows
+                )
+        else:
+            with telemetry.stage('classify'), classifier.counting(counter):
+                results = classify_detail_rows(rows, classifier, on_rows)
+            reuse_info = ReuseStats(0, len(results))
+        cache_after = classifier.cache_info()
+        cache_info = CacheStats(counter.hits, counter.misses, cache_after.maxsize, cache_after.currsize)
+    
+    if classifier.store is not None:
+        cache_info = cache_info._replace(store_hits=sum(1 for key in row_keys.values() if key in stored))
+        with telemetry.stage('store'):
+            # 並列判定のワーカー・プロファイル時の分類器は永続ストアを参照しないので、ここで永続ストアの結果を優先させる
+            results = ClassifiedRows(classifier.categories, (
+                (excel_row, stored.get(row_keys[excel_row], classification)) for excel_row, classification in results
+            ))
+            # 判定ルールで判定した結果を登録する（差分判定で判定結果列から引き継いだ値は手修正の可能性があるので除く）
+            if not incremental:
+                classifier.store_results(
+                    (row_keys[excel_row], classification) for excel_row, classification in results
+                    if row_keys[excel_row] not in stored
+                )
+    
+    # 統計情報（カテゴリコードをまとめて数える）
+    stats = results.counts()
+    
+    if export is not None:
+        # 分析用データを書き出せなくても（pyarrow がないなど）判定結果のExcelは返す
+        try:
+            with telemetry.stage('export'):
+                write_export(
+                    iter_export_records((row[:3] for row in rows), results=results.labels()), export, export_format
+                )
+        except ValueError as e:
+            telemetry.update(export_error=str(e))
+    
+    # 判定結果をまとめて書き込む
+    report(80, "✍️ 判定結果を書き込み中...")
+    
+    output = None
+    if writer == 'patch':
+        wb.close()
+        hidden_sheets = {}
+        if fingerprints is not None:
+            hidden_sheets[FINGERPRINT_SHEET] = fingerprint_sheet_values(classifier, fingerprints)
+        output = BytesIO()
+        try:
+            with telemetry.stage('write'):
+                _rewind(source)
+                patch_xlsx(source, output, TARGET_SHEET, CLASSIFICATION_COL + 1, results.labels(), hidden_sheets)
+        except XlsxPatchError:
+            # 書き換えに対応していない構造（判定結果列の数式など）は通常の保存に切り替える
+            with telemetry.stage('load'):
+                _rewind(source)
+                wb = openpyxl.load_workbook(source)
+            output = None
+    
+    if output is None:
+        with telemetry.stage('write'):
+            ws = wb[TARGET_SHEET]
+            for excel_row, classification in results:
+                ws.cell(row=excel_row, column=CLASSIFICATION_COL + 1, value=classification)
+            if fingerprints is not None:
+                write_fingerprints(wb, classifier, fingerprints)
+        
+        report(90, "💾 ファイルを保存中...")
+        
+        # Excelファイルをバイトストリームに保存
+        with telemetry.stage('save'):
+            output = BytesIO()
+            wb.save(output)
+        writer = 'openpyxl'
+    
+    output.seek(0)
+    
+    report(100, "✅ 処理完了！")
+    
+    telemetry.update(
+        writer=writer, parallel=parallel, rows=len(results), output_bytes=output.getbuffer().nbytes,
+        cache_hits=cache_info.hits, cache_misses=cache_info.misses, store_hits=cache_info.store_hits,
+        reused_rows=reuse_info.reused, stored_rows=len(stored)
+    )
+    return output, stats, cache_info, reuse_info
+
+def resolve_sheet_layouts(wb, sheets=None, layouts=None):
+    """判定するシートとレイアウトを決めて {シート名: SheetLayout} を返す
+    
+    sheets を省略すると、列見出しからレイアウトを検出できたシートをすべて対象にする。
+    layouts {シート名: SheetLayout} で指定したシートは検出せずにそのレイアウトを使う。
+    最上位明細シートは（指定がなければ）単一シートの判定と同じ既定のレイアウトとする。
+    """
+    layouts = layouts or {}
+    names = list(sheets) if sheets is not None else [name for name in wb.sheetnames if name != FINGERPRINT_SHEET]
+    resolved = {}
+    for name in names:
+        if name not in wb.sheetnames:
+            raise ValueError(f"シート「{name}」が見つかりません")
+        layout = layouts.get(name)
+        if layout is None:
+            layout = DEFAULT_LAYOUT if name == TARGET_SHEET else detect_layout(wb[name])
+        if layout is None:
+            if sheets is not None:
+                raise ValueError(f"シート「{name}」の列見出し（名称）が見つかりません")
+            continue
+        resolved[name] = layout
+    if not resolved:
+        raise ValueError("判定できるシートが見つかりません")
+    return resolved
+
+def process_workbook_sheets(source, sheets=None, layouts=None, cache_size=CLASSIFY_CACHE_SIZE,
+                            workers=CLASSIFY_WORKERS, on_progress=None, classifier=None, writer=WORKBOOK_WRITER,
+                            telemetry=None):
+    """複数のシートを判定して結果を書き込む
+    
+    対象シートとレイアウトは resolve_sheet_layouts で決める。
+    workers が2以上で全シートの合計行数が PARALLEL_MIN_ROWS 以上の場合は、全シートの明細行をまとめて
+    チャンクに分けて並列に判定する（シートの数ではなくワーカー数だけ並列になる）。
+    classifier・writer・telemetry は process_workbook と同じ（差分判定・エクスポートには対応しない）。
+    on_progress には (進捗率0-100, メッセージ) が渡される。
+    戻り値は (出力BytesIO, カテゴリ別件数（全シート合計）, シート名→カテゴリ別件数, 判定キャッシュ統計)
+    """
+    import openpyxl
+    
+    if telemetry is None:
+        telemetry = RunTelemetry()
+    telemetry.update(file_bytes=_source_size(source), incremental=False, workers=workers)
+    
+    def report(percent, message):
+        if on_progress:
+            with telemetry.stage('progress'):
+                on_progress(percent, message)
+    
+    report(10, "📂 ファイルを読み込み中...")
+    
+    with telemetry.stage('load'):
+        wb = openpyxl.load_workbook(source, read_only=(writer == 'patch'))
+    try:
+        sheet_layouts = resolve_sheet_layouts(wb, sheets, layouts)
+    except ValueError:
+        wb.close()
+        raise
+    
+    if classifier is None:
+        classifier = ConstructionItemClassifier(cache_size=cache_size)
+    
+    # 明細行をシートごとに読み込み、永続ストアがあればシートごとにまとめて照会する
+    sheet_rows = {}
+    row_keys = {}
+    stored = {}
+    with telemetry.stage('read'):
+        for name, layout in sheet_layouts.items():
+            rows = list(iter_detail_rows(wb[name], layout=layout))
+            sheet_rows[name] = rows
+            if classifier.store is not None:
+                row_keys[name] = dict(detail_row_keys(rows, classifier))
+                stored[name] = classifier.lookup_stored(row_keys[name].values())
+    total_rows = max(sum(len(rows) for rows in sheet_rows.values()), 1)
+    
+    report(20, f"🔍 {len(sheet_rows)}シートの判定を実行中... (0 / {total_rows})")
+    
+    def on_rows(done):
+        report(20 + int(min(done / total_rows, 1.0) * 60), f"🔍 判定を実行中... ({done} / {total_rows})")
+    
+    parallel = workers > 1 and total_rows >= PARALLEL_MIN_ROWS and classifier.profile is None
+    if parallel:
+        with telemetry.stage('classify'):
+            sheet_results, cache_info = classify_sheets_parallel(
+                sheet_rows, workers=workers, chunk_size=PARALLEL_CHUNK_SIZE, cache_size=cache_size, on_progress=on_rows,
+                neighbors=classifier.neighbors
+            )
+    else:
+        sheet_results = {}
+        done = 0
+        with telemetry.stage('classify'), classifier.counting(CacheCounter()) as counter:
+            for name, rows in sheet_rows.items():
+                sheet_results[name] = classify_detail_rows(rows, classifier, lambda index: on_rows(done + index))
+                done += len(rows)
+        cache_after = classifier.cache_info()
+        cache_info = CacheStats(counter.hits, counter.misses, cache_after.maxsize, cache_after.currsize)
+    
+    if classifier.store is not None:
+        cache_info = cache_info._replace(store_hits=sum(
+            1 for name, keys in row_keys.items() for key in keys.values() if key in stored[name]
+        ))
+        with telemetry.stage('store'):
+            # 並列判定のワーカー・プロファイル時の分類器は永続ストアを参照しないので、ここで永続ストアの結果を優先させる
+            for name, results in sheet_results.items():
+                keys = row_keys[name]
+                sheet_results[name] = ClassifiedRows(classifier.categories, (
+                    (excel_row, stored[name].get(keys[excel_row], classification))
+                    for excel_row, classification in results
+                ))
+                classifier.store_results(
+                    (keys[excel_row], classification) for excel_row, classification in results
+                    if keys[excel_row] not in stored[name]
+                )
+    
+    # 統計情報（シート別はカテゴリコードをまとめて数え、全シート合計はその和）
+    stats = dict.fromkeys(classifier.categories, 0)
+    sheet_stats = {}
+    for name, results in sheet_results.items():
+        sheet_stats[name] = results.counts()
+        for category, count in sheet_stats[name].items():
+            stats[category] = stats.get(category, 0) + count
+    
+    report(80, "✍️ 判定結果を書き込み中...")
+    
+    output = None
+    if writer == 'patch':
+        wb.close()
+        output = BytesIO()
+        patches = {
+            name: (sheet_layouts[name].classification_col + 1, results.labels())
+            for name, results in sheet_results.items()
+        }
+        try:
+            with telemetry.stage('write'):
+                _rewind(source)
+                patch_xlsx_sheets(source, output, patches)
+        except XlsxPatchError:
+            # 書き換えに対応していない構造（判定結果列の数式など）は通常の保存に切り替える
+            with telemetry.stage('load'):
+                _rewind(source)
+                wb = openpyxl.load_workbook(source)
+            output = None
+    
+    if output is None:
+        with telemetry.stage('write'):
+            for name, results in sheet_results.items():
+                ws = wb[name]
+                column = sheet_layouts[name].classification_col + 1
+                for excel_row, classification in results:
+                    ws.cell(row=excel_row, column=column, value=classification)
+        
+        report(90, "💾 ファイルを保存中...")
+        
+        with telemetry.stage('save'):
+            output = BytesIO()
+            wb.save(output)
+        writer = 'openpyxl'
+    
+    output.seek(0)
+    
+    report(100, "✅ 処理完了！")
+    
+    telemetry.update(
+        writer=writer, parallel=parallel, sheets=len(sheet_results),
+        rows=sum(len(results) for results in sheet_results.values()), output_bytes=output.getbuffer().nbytes,
+        cache_hits=cache_info.hits, cache_misses=cache_info.misses, store_hits=cache_info.store_hits,
+        stored_rows=sum(len(found) for found in stored.values())
+    )
+    return output, stats, sheet_stats, cache_info
+
+def export_classification(source, output, export_format='csv', cache_size=CLASSIFY_CACHE_SIZE, classifier=None):
+    """Excelファイルを判定し、結果をブックを作らずに分析用の CSV / Parquet へ直接書き出す
+    
+    明細行を read_only モードで流し読みし、判定しながら1行ずつ書き出す。
+    戻り値は (書き出した行数, カテゴリ別件数)
+    """
+    import openpyxl
+    
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"未対応のエクスポート形式です: {export_format}")
+    
+    wb = openpyxl.load_workbook(source, read_only=True)
+    try:
+        if TARGET_SHEET not in wb.sheetnames:
+            raise ValueError(f"シート「{TARGET_SHEET}」が見つかりません")
+        if classifier is None:
+            classifier = ConstructionItemClassifier(cache_size=cache_size)
+        
+        stats = dict.fromkeys(classifier.categories, 0)
+        
+        def counted(records):
+            for record in records:
+                if record[-1]:
+                    stats[record[-1]] = stats.get(record[-1], 0) + 1
+                yield record
+        
+        count = write_export(
+            counted(iter_export_records(iter_detail_rows(wb[TARGET_SHEET]), classifier)), output, export_format
+        )
+    finally:
+        wb.close()
+    return count, stats
+
+def learn_corrections(source, store, cache_size=CLASSIFY_CACHE_SIZE):
+    """手で修正した判定済みファイルから、判定ルールの結果と違う判定結果を永続ストアに登録する
+    
+    同じキー（正規化した名称・工事科目・親カテゴリ）の行が複数ある場合は、行の順によらず
+    判定ルールの結果と違う判定結果がある行を修正として扱う。違う判定結果が行によって食い違う場合は登録せず、
+    食い違いとして返す。すべての行が判定ルールの結果と同じキーは、以前の修正を元に戻したものとして登録を取り消す。
+    カテゴリ一覧にない値（入力ミスなど）は使わない。
+    戻り値は (登録した件数, 取り消した件数, 食い違った (名称, 判定結果のタプル) のリスト)
+    """
+    import openpyxl
+    
+    classifier = ConstructionItemClassifier(cache_size=cache_size)  # 永続ストアを使わず判定ルールだけで判定する
+    wb = openpyxl.load_workbook(source, read_only=True)
+    try:
+        if TARGET_SHEET not in wb.sheetnames:
+            raise ValueError(f"シート「{TARGET_SHEET}」が見つかりません")
+        
+        corrected = {}  # キー -> 判定ルールの結果と違う判定結果の集合（すべて同じなら空集合）
+        names = {}
+        current_parent = ''
+        for _, work_category, name, classification in iter_detail_rows(wb[TARGET_SHEET], with_classification=True):
+            if name and '設備工事' in str(name):
+                current_parent = str(name)
+            if not name or str(name).strip() == '' or classification not in classifier.categories:
+                continue
+            key = classifier.store_key(name, work_category or '', current_parent)
+            labels = corrected.setdefault(key, set())
+            names.setdefault(key, str(name))
+            if classification != classifier.classify(*key):
+                labels.add(classification)
+    finally:
+        wb.close()
+    
+    added = store.put_many(
+        ((key, next(iter(labels))) for key, labels in corrected.items() if len(labels) == 1), SOURCE_MANUAL
+    )
+    removed = store.remove_manual(key for key, labels in corrected.items() if not labels)
+    conflicts = [(names[key], tuple(sorted(labels))) for key, labels in corrected.items() if len(labels) > 1]
+    return added, removed, conflicts
+
+def labelled_names(source):
+    """判定済みファイルの最上位明細から (正規化した名称, 判定結果) を順に返す
+    
+    親カテゴリ（電気・空調の設備工事）や工事科目（杭工事）で判定が決まる行は、名称と判定結果が結びつかないので使わない。
+    カテゴリ一覧にない値（入力ミスなど）も使わない。
+    """
+    import openpyxl
+    
+    classifier = ConstructionItemClassifier(cache_size=0)
+    wb = openpyxl.load_workbook(source, read_only=True)
+    try:
+        if TARGET_SHEET not in wb.sheetnames:
+            raise ValueError(f"シート「{TARGET_SHEET}」が見つかりません")
+        parent = ''
+        for _, work_category, name, classification in iter_detail_rows(wb[TARGET_SHEET], with_classification=True):
+            if name and '設備工事' in str(name):
+                parent = classifier.normalize_text(name)
+            if not name or str(name).strip() == '' or classification not in classifier.categories:
+                continue
+            normalized = classifier.normalize_text(name)
+            work_category = classifier.normalize_text(work_category)
+            hits = classifier.matcher.find(normalized)
+            if (classifier._match_parent_electric(hits, work_category, parent)
+                    or classifier._match_parent_hvac(hits, work_category, parent)
+                    or classifier._match_pile_work_category(hits, work_category, parent)):
+                continue
+            yield normalized, classification
+    finally:
+        wb.close()
+
+def build_neighbor_index(sources, **options):
+    """判定済みファイル（パスまたはファイルオブジェクトの一覧）から近傍索引を作る（options は NeighborIndex の引数）"""
+    return NeighborIndex((pair for source in sources for pair in labelled_names(source)), **options)
+
+# 版の比較（差分）の変更の種類と、差分表の列
+DIFF_ADDED = '追加'
+DIFF_REMOVED = '削除'
+DIFF_RECLASSIFIED = '判定変更'
+DIFF_COLUMNS = [
+    '変更', FRAME_NAME_COL, FRAME_WORK_CATEGORY_COL, FRAME_PARENT_COL, '旧行番号', '新行番号', '旧判定結果', '新判定結果'
+]
+
+# 差分表の1行（追加の行は旧版の、削除の行は新版の行番号・判定結果が None）
+DiffRow = namedtuple('DiffRow', [
+    'change', 'name', 'work_category', 'parent', 'old_row', 'new_row', 'old_classification', 'new_classification'
+])
+
+def stream_detail_rows(source, sheet_name=TARGET_SHEET, layout=DEFAULT_LAYOUT):
+    """シートの明細行を (Excel行番号, 工事科目, 名称, 判定結果) で順に流し読みする
+    
+    openpyxl でワークブックを開かずにシートXMLから必要な列だけを読むので、読むだけの処理（版の比較など）に向く。
+    iter_detail_rows と違い、値がすべて空の行は含めない。
+    流し読みに対応していない構造の場合は、openpyxl（read_only）で読んでいない行から続ける。シートがない場合は ValueError。
+    """
+    import openpyxl
+    
+    columns = [layout.name_col, layout.classification_col]
+    if layout.work_category_col is not None:
+        columns.append(layout.work_category_col)
+    last_row = 0
+    try:
+        for excel_row, values in iter_sheet_values(
+                source, sheet_name, [col + 1 for col in columns], min_row=layout.header_row + 2):
+            work_category = values[2] if layout.work_category_col is not None else None
+            yield excel_row, work_category, values[0], values[1]
+            last_row = excel_row
+        return
+    except XlsxPatchError:
+        pass
+    
+    _rewind(source)
+    wb = openpyxl.load_workbook(source, read_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"シート「{sheet_name}」が見つかりません")
+        for row in iter_detail_rows(wb[sheet_name], with_classification=True, layout=layout):
+            if row[0] > last_row:
+                yield row
+    finally:
+        wb.close()
+
+def labelled_detail_rows(source, classifier):
+    """最上位明細の明細行を (キー, Excel行番号, 名称, 工事科目, 親カテゴリ, 判定結果) で順に返す
+    
+    キーは正規化した (名称, 工事科目, 親カテゴリ)。判定結果列が空の行（判定していない版）は classifier で判定する。
+    """
+    current_parent = ''
+    for excel_row, work_category, name, classification in stream_detail_rows(source):
+        if name and '設備工事' in str(name):
+            current_parent = str(name)
+        if not name or str(name).strip() == '':
+            continue
+        work_category = '' if work_category is None else str(work_category)
+        if classification is None or str(classification).strip() == '':
+            classification = classifier.classify(name, work_category, current_parent)
+        key = classifier.store_key(name, work_category, current_parent)
+        yield key, excel_row, str(name), work_category, current_parent, str(classification)
+
+def compare_workbooks(old_source, new_source, classifier=None, cache_size=CLASSIFY_CACHE_SIZE):
+    """2つの版の見積書の最上位明細を比べ、(差分表の行 DiffRow のリスト, カテゴリ→(旧版の件数, 新版の件数)) を返す
+    
+    行は正規化した (名称, 工事科目, 親カテゴリ) のハッシュ索引で対応付ける（同じキーの行は出現順に組にする）ので、
+    行の挿入・並べ替えがあっても全体で線形時間で比べられる。判定結果の同じ組は差分表に含めない。
+    差分表は新版の順（判定変更・追加）に、旧版にしかない行（削除）を旧版の順で続ける。
+    """
+    if classifier is None:
+        classifier = ConstructionItemClassifier(cache_size=cache_size)
+    
+    # 旧版の索引: キー -> (Excel行番号, 判定結果) の出現順のキュー
+    old_rows = {}
+    old_display = {}
+    counts = {}
+    for key, excel_row, name, work_category, parent, classification in labelled_detail_rows(old_source, classifier):
+        old_rows.setdefault(key, deque()).append((excel_row, classification))
+        old_display.setdefault(key, (name, work_category, parent))
+        old_count, new_count = counts.get(classification, (0, 0))
+        counts[classification] = (old_count + 1, new_count)
+    
+    diff = []
+    for key, excel_row, name, work_category, parent, classification in labelled_detail_rows(new_source, classifier):
+        old_count, new_count = counts.get(classification, (0, 0))
+        counts[classification] = (old_count, new_count + 1)
+        matches = old_rows.get(key)
+        if not matches:
+            diff.append(DiffRow(DIFF_ADDED, name, work_category, parent, None, excel_row, None, classification))
+            continue
+        old_row, old_classification = matches.popleft()
+        if old_classification != classification:
+            diff.append(DiffRow(
+                DIFF_RECLASSIFIED, name, work_category, parent, old_row, excel_row, old_classification, classification
+            ))
+    
+    removed = [
+        DiffRow(DIFF_REMOVED, *old_display[key], old_row, None, old_classification, None)
+        for key, matches in old_rows.items() for old_row, old_classification in matches
+    ]
+    removed.sort(key=lambda row: row.old_row)
+    
+    # カテゴリ一覧の順に並べる（一覧にない値は後ろに回す）
+    order = {category: index for index, category in enumerate(classifier.categories)}
+    deltas = dict(sorted(counts.items(), key=lambda item: (order.get(item[0], len(order)), item[0])))
+    return diff + removed, deltas
+
+def write_diff(rows, output):
+    """差分表を CSV（Excelで開けるよう BOM 付き UTF-8）でバイナリストリームに書き出し、書き出した行数を返す"""
+    import csv
+    from io import TextIOWrapper
+    
+    text = TextIOWrapper(output, encoding='utf-8-sig', newline='')
+    try:
+        writer = csv.writer(text)
+        writer.writerow(DIFF_COLUMNS)
+        writer.writerows(rows)
+        text.flush()
+    finally:
+        text.detach()
+    return len(rows)
+
+def _source_size(source):
+    """入力ファイル（パスまたはファイルオブジェクト）のバイト数"""
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer().nbytes
+    if hasattr(source, 'seek'):
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END)
+        source.seek(position)
+        return size
+    return os.path.getsize(source)
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def store_classifier(store_path=None, cache_size=CLASSIFY_CACHE_SIZE, neighbors=None):
+    """永続ストア（store_path を指定した場合）・近傍索引を使う分類器を作る（プロセスプールのワーカー用）"""
+    store = CategoryStore(store_path) if store_path else None
+    return ConstructionItemClassifier(cache_size=cache_size, store=store, neighbors=neighbors)
+
+def classify_workbook_bytes(data, cache_size=CLASSIFY_CACHE_SIZE, incremental=False, store_path=None, workers=1,
+                            telemetry=None, neighbors=None):
+    """バイト列のExcelファイルを判定し、(出力バイト列, カテゴリ別件数) を返す（プロセスプール用）"""
+    output, stats, _, _ = process_workbook(
+        BytesIO(data), cache_size=cache_size, incremental=incremental,
+        classifier=store_classifier(store_path, cache_size, neighbors), workers=workers, telemetry=telemetry
+    )
+    return output.getvalue(), stats
+
+def classify_workbook_sheets_bytes(data, sheets=None, layouts=None, cache_size=CLASSIFY_CACHE_SIZE, store_path=None,
+                                   workers=1, telemetry=None, neighbors=None):
+    """バイト列のExcelファイルの複数シートを判定し、(出力バイト列, カテゴリ別件数, シート名→カテゴリ別件数) を返す"""
+    output, stats, sheet_stats, _ = process_workbook_sheets(
+        BytesIO(data), sheets=sheets, layouts=layouts, cache_size=cache_size,
+        classifier=store_classifier(store_path, cache_size, neighbors), workers=workers, telemetry=telemetry
+    )
+    return output.getvalue(), stats, sheet_stats
+
+class ResultCache:
+    """内容のハッシュ値をキーにした処理結果のキャッシュ（スレッドセーフ）
+    
+    件数・合計バイト数・有効期限（秒）で上限を設け、古いものから捨てる。
+    同じキーを同時に計算しようとした場合は先の計算の完了を待って結果を共有する。
+    """
+    
+    def __init__(self, max_entries=20, max_bytes=512 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (登録時刻, バイト数, 値)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+    
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic(), size, value)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def get_or_compute(self, key, compute, size_of=len):
+        """キャッシュにあれば返し、なければ compute() の結果を登録して返す
+        
+        戻り値は (値, キャッシュから返したかどうか)
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value, True
+        
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self.get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return value, True
+            
+            with self._lock:
+                self.misses += 1
+            try:
+                value = compute()
+                self.put(key, value, size_of(value))
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value, False
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+    
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+class JobQueueFull(RuntimeError):
+    """待機中のジョブ数が上限に達している"""
+
+class Job:
+    """バックグラウンドで処理するジョブの状態（JobPool が更新する）"""
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    def __init__(self, job_id, name=''):
+        self.id = job_id
+        self.name = name
+        self.status = Job.QUEUED
+        self.progress = 0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+    
+    def update(self, percent, message):
+        """進捗の更新（on_progress としてジョブの関数に渡される）"""
+        self.progress = percent
+        self.message = message
+    
+    @property
+    def finished(self):
+        return self.status in (Job.DONE, Job.FAILED)
+    
+    @property
+    def wait_seconds(self):
+        """待ち行列での待ち時間（秒）"""
+        return (self.started_at or time.monotonic()) - self.submitted_at
+    
+    @property
+    def run_seconds(self):
+        """実行時間（秒）。開始前は None"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+class JobPool:
+    """サーバー全体で共有するバックグラウンド処理用のワーカープール（スレッドセーフ）
+    
+    同時に実行するジョブ数を max_workers、待機中のジョブ数を max_queue で制限する。
+    終了したジョブは keep_seconds の間（最大 max_finished 件）結果を保持する。
+    結果を受け取った側が保持する場合は release でプールから外し、結果を二重に持たないようにする。
+    ジョブの関数には on_progress キーワード引数で進捗の通知先が渡される。
+    """
+    
+    def __init__(self, max_workers=2, max_queue=8, keep_seconds=3600, max_finished=50):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.keep_seconds = keep_seconds
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()  # ジョブID -> Job（投入順）
+        self._timings = deque(maxlen=max_finished)  # 終了したジョブの (待ち時間, 実行時間)
+        self._lock = threading.Lock()
+    
+    def submit(self, fn, *args, name='', **kwargs):
+        """ジョブを投入して Job を返す（待ち行列が満杯なら JobQueueFull）"""
+        with self._lock:
+            self._prune()
+            queued = sum(1 for job in self._jobs.values() if job.status == Job.QUEUED)
+            if queued >= self.max_queue:
+                raise JobQueueFull(f"処理待ちのジョブが上限（{self.max_queue}件）に達しています")
+            job = Job(uuid.uuid4().hex, name)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+    
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def release(self, job_id):
+        """ジョブをプールから外す（実行中のジョブは最後まで実行されるが、結果はプールに残らない）"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+    
+    def queue_position(self, job):
+        """待機中のジョブが何番目に実行されるか（1始まり、待機中でなければ0）"""
+        if job.status != Job.QUEUED:
+            return 0
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.status == Job.QUEUED]
+        return queued.index(job) + 1 if job in queued else 0
+    
+    def stats(self):
+        """実行中・待機中の件数と、直近に終了したジョブ（release したものも含む）の平均待ち時間・平均実行時間（秒）"""
+        with self._lock:
+            self._prune()
+            jobs = list(self._jobs.values())
+            timings = list(self._timings)
+        return {
+            'running': sum(1 for job in jobs if job.status == Job.RUNNING),
+            'queued': sum(1 for job in jobs if job.status == Job.QUEUED),
+            'finished': len(timings),
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'avg_wait_seconds': sum(wait for wait, _ in timings) / len(timings) if timings else 0.0,
+            'avg_run_seconds': sum(run for _, run in timings) / len(timings) if timings else 0.0,
+        }
+    
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+    
+    def _run(self, job, fn, args, kwargs):
+        job.started_at = time.monotonic()
+        job.status = Job.RUNNING
+        # 終了時刻を先に記録してから状態を変える（finished なら finished_at がある）
+        try:
+            result = fn(*args, on_progress=job.update, **kwargs)
+        except Exception as e:
+            job.error = e
+            job.traceback = traceback.format_exc()
+            job.finished_at = time.monotonic()
+            job.status = Job.FAILED
+        else:
+            job.result = result
+            job.finished_at = time.monotonic()
+            job.status = Job.DONE
+        with self._lock:
+            self._timings.append((job.wait_seconds, job.run_seconds))
+    
+    def _prune(self):
+        # 保持期間を過ぎたもの・件数の上限を超えたものから、終了済みのジョブを捨てる
+        now = time.monotonic()
+        finished = [job for job in self._jobs.values() if job.finished]
+        for index, job in enumerate(finished):
+            if now - job.finished_at > self.keep_seconds or len(finished) - index > self.max_finished:
+                del self._jobs[job.id]
+
+# 一括判定の対象拡張子
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+def find_excel_files(paths):
+    """ファイル・フォルダの指定からExcelファイルの一覧を返す（フォルダは再帰的に探す）"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith('~$'):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+def output_path_for(path, output_dir=None, ext='.xlsx'):
+    """判定結果の保存先（既定は入力ファイルと同じフォルダ）"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir or os.path.dirname(path), f"{stem}_分類結果{ext}")
+
+def parse_layout(text):
+    """「シート名=見出し行,工事科目列,名称列,判定結果列」（Excel上の行番号・列名）を (シート名, SheetLayout) にする
+    
+    工事科目列は空にできる（例: 内訳明細=7,B,C,M / 棟別=5,,B,H）。
+    """
+    from xlsx_patch import column_index
+    
+    name, sep, spec = text.rpartition('=')
+    fields = [field.strip() for field in spec.split(',')]
+    if not sep or not name or len(fields) != 4 or not fields[0].isdigit() or not fields[2] or not fields[3]:
+        raise ValueError(f"レイアウトの指定が正しくありません: {text}（例: 内訳明細=7,B,C,M）")
+    header_row, work_category, name_col, classification = fields
+    return name, SheetLayout(
+        int(header_row) - 1,
+        column_index(work_category.upper()) - 1 if work_category else None,
+        column_index(name_col.upper()) - 1,
+        column_index(classification.upper()) - 1
+    )
+
+def _classify_file(path, output_path, cache_size, incremental=False, export_format=None, store_path=None,
+                   sheets=None, layouts=None, workers=1, neighbors=None):
+    """1ファイルを判定して保存し、(カテゴリ別件数, シート名→カテゴリ別件数（複数シート判定の場合）, 計測結果) を返す
+    
+    計測結果はログに書き出す1行分（ログへの書き込みはワーカーではなく呼び出し元のプロセスでまとめて行う）。
+    """
+    telemetry = RunTelemetry(file=os.path.basename(path), mode='cli')
+    if export_format:
+        telemetry.update(file_bytes=os.path.getsize(path), export_format=export_format)
+        with open(output_path, 'wb') as f, telemetry.stage('export'):
+            rows, stats = export_classification(
+                path, f, export_format, classifier=store_classifier(store_path, cache_size, neighbors)
+            )
+        telemetry.update(rows=rows)
+        return stats, None, telemetry.record()
+    with open(path, 'rb') as f:
+        data = f.read()
+    if sheets is not None or layouts:
+        data, stats, sheet_stats = classify_workbook_sheets_bytes(
+            data, sheets=sheets or None, layouts=layouts, cache_size=cache_size, store_path=store_path,
+            workers=workers, telemetry=telemetry, neighbors=neighbors
+        )
+    else:
+        data, stats = classify_workbook_bytes(
+            data, cache_size=cache_size, incremental=incremental, store_path=store_path, workers=workers,
+            telemetry=telemetry, neighbors=neighbors
+        )
+        sheet_stats = None
+    with open(output_path, 'wb') as f, telemetry.stage('output'):
+        f.write(data)
+    return stats, sheet_stats, telemetry.record()
+
+def _compare_files(old_path, new_path, output_dir, classifier):
+    """2つの版を比べて差分表を CSV で保存し、件数とカテゴリ別の増減を表示する"""
+    start_time = time.time()
+    try:
+        rows, deltas = compare_workbooks(old_path, new_path, classifier=classifier)
+    except Exception as e:
+        print(f"❌ {old_path} → {new_path}: {e}", file=sys.stderr)
+        return 1
+    
+    stem = os.path.splitext(os.path.basename(new_path))[0]
+    output_path = os.path.join(output_dir or os.path.dirname(new_path), f"{stem}_差分.csv")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, 'wb') as f:
+        write_diff(rows, f)
+    
+    changes = {change: 0 for change in (DIFF_ADDED, DIFF_REMOVED, DIFF_RECLASSIFIED)}
+    for row in rows:
+        changes[row.change] += 1
+    summary = ' / '.join(f"{change} {count:,}件" for change, count in changes.items())
+    print(f"✅ {old_path} → {new_path}: {summary} → {output_path}（{time.time() - start_time:.2f}秒）")
+    for category, (old_count, new_count) in deltas.items():
+        if old_count != new_count:
+            print(f"  {category}: {old_count:,} → {new_count:,}（{new_count - old_count:+,}）")
+    return 0
+
+def main(argv=None):
+    """コマンドラインからの一括判定"""
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    parser = argparse.ArgumentParser(description='請負契約見積書の工事細目を一括判定します')
+    parser.add_argument('paths', nargs='+', help='Excelファイルまたはフォルダ')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='ワーカープロセス数（ファイル数より多い分は1ファイル内の判定の並列化に使う）')
+    parser.add_argument('--output-dir', help='結果の保存先フォルダ（省略時は入力ファイルと同じフォルダ）')
+    parser.add_argument('--cache-size', type=int, default=CLASSIFY_CACHE_SIZE, help='判定キャッシュの容量（件数）')
+    parser.add_argument('--incremental', action='store_true',
+                        help='前回の差分判定から変わった行だけを判定する（判定済みファイルを再判定する場合）')
+    parser.add_argument('--export', choices=EXPORT_FORMATS,
+                        help='Excelファイルの代わりに判定結果を分析用の CSV / Parquet で保存する')
+    parser.add_argument('--store', help='名称→判定結果の永続ストア（SQLiteファイル）。判定ルールより先に照会する')
+    parser.add_argument('--learn', action='store_true',
+                        help='判定はせず、手で修正した判定済みファイルの修正内容を --store に登録する')
+    parser.add_argument('--sheets', nargs='*', metavar='SHEET',
+                        help='複数のシートを判定する（シート名を省略すると列見出しを検出できたシートすべて）')
+    parser.add_argument('--layout', action='append', default=[], metavar='SHEET=ROW,COL,COL,COL',
+                        help='シートのレイアウトを指定する（見出し行,工事科目列,名称列,判定結果列。例: 内訳明細=7,B,C,M）')
+    parser.add_argument('--compare', action='store_true',
+                        help='判定はせず、2つのファイル（旧版 新版の順）の明細を比べて追加・削除・判定変更の差分表を保存する')
+    parser.add_argument('--neighbors', nargs='+', metavar='PATH',
+                        help='判定済みファイル（またはフォルダ）から近傍索引を作り、どのルールにも該当しない名称を近い名称の判定結果で判定する')
+    parser.add_argument('--telemetry', metavar='PATH',
+                        help='ファイルごとの段階別の所要時間・メモリなどを JSON Lines のログに追記する（ローテーションあり）')
+    args = parser.parse_args(argv)
+    if args.learn and not args.store:
+        parser.error('--learn には --store が必要です')
+    if args.incremental and args.export:
+        parser.error('--incremental は --export と同時に指定できません（分析用データの書き出しは全行を判定する）')
+    try:
+        layouts = dict(parse_layout(text) for text in args.layout)
+    except ValueError as e:
+        parser.error(str(e))
+    sheets = args.sheets
+    if layouts and sheets is None:
+        sheets = list(layouts)
+    if sheets is not None and (args.incremental or args.export):
+        parser.error('--sheets・--layout は --incremental・--export と同時に指定できません')
+    if args.compare and (len(args.paths) != 2 or sheets is not None or args.incremental or args.export or args.learn):
+        parser.error('--compare には旧版・新版の2ファイルを指定してください（--sheets・--incremental・--export・--learn とは併用できません）')
+    
+    files = find_excel_files(args.paths)
+    if not files:
+        print("処理対象のExcelファイルが見つかりません", file=sys.stderr)
+        return 1
+    
+    if args.learn:
+        store = CategoryStore(args.store)
+        failed = 0
+        for path in files:
+            try:
+                added, removed, conflicts = learn_corrections(path, store, cache_size=args.cache_size)
+            except Exception as e:
+                failed += 1
+                print(f"❌ {path}: {e}", file=sys.stderr)
+                continue
+            print(f"✅ {path}: 修正 {added:,}件を登録 / {removed:,}件を取り消し")
+            for name, labels in conflicts:
+                print(f"⚠️ {path}: 「{name}」は行によって修正後の判定結果が違うため登録しませんでした（{' / '.join(labels)}）",
+                      file=sys.stderr)
+        return 1 if failed else 0
+    
+    neighbors = None
+    if args.neighbors:
+        labelled_files = find_excel_files(args.neighbors)
+        try:
+            neighbors = build_neighbor_index(labelled_files)
+        except Exception as e:
+            print(f"❌ 近傍索引を作れませんでした: {e}", file=sys.stderr)
+            return 1
+        print(f"🔎 近傍索引: {len(labelled_files)}ファイル・{len(neighbors):,}名称")
+    
+    if args.compare:
+        return _compare_files(*args.paths, args.output_dir, store_classifier(args.store, args.cache_size, neighbors))
+    
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    
+    # 保存先が重なる場合は連番を付けて区別する
+    output_paths = {}
+    for path in files:
+        output_path = output_path_for(path, args.output_dir, f".{args.export}" if args.export else '.xlsx')
+        base, ext = os.path.splitext(output_path)
+        suffix = 2
+        while output_path in output_paths.values():
+            output_path = f"{base}_{suffix}{ext}"
+            suffix += 1
+        output_paths[path] = output_path
+    
+    start_time = time.time()
+    total_stats = {}
+    failed = 0
+    telemetry_log = TelemetryLog(args.telemetry) if args.telemetry else None
+    
+    # ファイル単位で並列にし、余ったワーカーは各ファイルの判定（チャンク単位）の並列化に回す
+    file_workers = max(min(args.workers, len(files)), 1)
+    classify_workers = max(args.workers // file_workers, 1)
+    
+    with ProcessPoolExecutor(max_workers=file_workers) as executor:
+        futures = {
+            executor.submit(
+                _classify_file, path, output_path, args.cache_size, args.incremental, args.export, args.store,
+                sheets, layouts, classify_workers, neighbors
+            ): path
+            for path, output_path in output_paths.items()
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                stats, sheet_stats, record = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {path}: {e}", file=sys.stderr)
+                continue
+            if telemetry_log is not None:
+                telemetry_log.write(record)
+            for cat, count in stats.items():
+                total_stats[cat] = total_stats.get(cat, 0) + count
+            print(f"✅ {path}: {sum(stats.values()):,}件 → {output_paths[path]}")
+            for sheet, counts in (sheet_stats or {}).items():
+                print(f"    {sheet}: {sum(counts.values()):,}件")
+    
+    if telemetry_log is not None:
+        telemetry_log.close()
+    
+    # カテゴリ別内訳
+    print(f"\n{len(files) - failed}/{len(files)}ファイル処理完了（{time.time() - start_time:.2f}秒）")
+    for cat, count in sorted(total_stats.items(), key=lambda x: x[1], reverse=True):
+        if count > 0:
+            print(f"  {cat}: {count:,}")
+    
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+判定済みの名称の近傍検索（文字 n-gram の転置索引）
+どのキーワードにも該当せず「0.0 対象外」に落ちる名称について、過去の判定済みファイルから
+表記の近い名称を探し、その判定結果の多数決（と確信度）を返す。
+
+名称は正規化済み（canonicalize 済み）の文字列を渡すこと。
+索引は構築後に配列（array）へ詰め直してメモリ上に保持し、プロセスプールにはそのまま pickle で渡せる。
+標準ライブラリだけで動く。
+"""
+
+import bisect
+import hashlib
+import heapq
+from array import array
+from collections import Counter, namedtuple
+
+# 文字 n-gram の長さ（名称の前後に境界記号を付けるので1文字の名称も照合できる）
+NGRAM_SIZE = 2
+_BOUNDARY = '\x02'
+
+# 近傍の数・類似度（Dice 係数）と確信度の下限
+NEIGHBOR_TOP_K = 5
+NEIGHBOR_MIN_SIMILARITY = 0.5
+NEIGHBOR_MIN_CONFIDENCE = 0.5
+
+# 多くの名称に出てくる n-gram（「工事」など）は照合に使わない（この件数を超える転置リストは飛ばす）
+NEIGHBOR_MAX_POSTINGS = 2000
+
+# 類似度を計算し直す候補の数（共通 n-gram 数の多い順に top_k のこの倍数だけ取る）
+CANDIDATE_FACTOR = 4
+
+# 近傍検索の結果（判定結果, 確信度 0-1, (名称, 判定結果, 類似度) の近い順のタプル）
+NeighborMatch = namedtuple('NeighborMatch', ['category', 'confidence', 'neighbors'])
+
+def ngrams(name, size=NGRAM_SIZE):
+    """名称の文字 n-gram の集合"""
+    padded = _BOUNDARY + name + _BOUNDARY
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+class NeighborIndex:
+    """判定済みの名称の転置索引
+    
+    同じ名称に複数の判定結果がある場合は多数決で1つにまとめる。
+    query は同じ名称があればその判定結果（確信度 1.0）を返し、なければ類似度の高い top_k 件の判定結果を類似度で重み付けして多数決をとり、
+    確信度（多数派の重みの割合 × 多数派の最大類似度）が min_confidence 未満なら None を返す。
+    """
+    
+    def __init__(self, labelled, top_k=NEIGHBOR_TOP_K, min_similarity=NEIGHBOR_MIN_SIMILARITY,
+                 min_confidence=NEIGHBOR_MIN_CONFIDENCE, max_postings=NEIGHBOR_MAX_POSTINGS):
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.max_postings = max_postings
+        
+        votes = {}
+        for name, category in labelled:
+            if name and category:
+                votes.setdefault(name, Counter())[category] += 1
+        
+        self.categories = sorted({category for counter in votes.values() for category in counter})
+        codes = {category: code for code, category in enumerate(self.categories)}
+        self.names = sorted(votes)
+        self._labels = array('B', (codes[votes[name].most_common(1)[0][0]] for name in self.names))
+        self._sizes = array('H')
+        postings = {}
+        for name_id, name in enumerate(self.names):
+            grams = ngrams(name)
+            self._sizes.append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+        self._postings = {gram: array('I', ids) for gram, ids in postings.items()}
+        
+        # 索引の内容の指紋（判定ルールの指紋に含め、索引が変わったら差分判定・永続ストアの結果を使わない）
+        digest = hashlib.blake2b(digest_size=8)
+        for name, code in zip(self.names, self._labels):
+            digest.update(f"{name}\x1f{self.categories[code]}\x1e".encode('utf-8'))
+        digest.update(repr((NGRAM_SIZE, top_k, min_similarity, min_confidence, max_postings)).encode('utf-8'))
+        self.signature = digest.hexdigest()
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def query(self, name):
+        """近い名称の判定結果の多数決を NeighborMatch で返す（近い名称がない・確信度が低い場合は None）"""
+        position = bisect.bisect_left(self.names, name)
+        if position < len(self.names) and self.names[position] == name:
+            category = self.categories[self._labels[position]]
+            return NeighborMatch(category, 1.0, ((name, category, 1.0),))
+        
+        grams = ngrams(name)
+        shared = Counter()
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if ids is not None and len(ids) <= self.max_postings:
+                shared.update(ids)
+        if not shared:
+            return None
+        
+        size = len(grams)
+        sizes = self._sizes
+        candidates = shared.most_common(self.top_k * CANDIDATE_FACTOR)
+        scored = heapq.nlargest(
+            self.top_k,
+            ((2 * count / (size + sizes[name_id]), name_id) for name_id, count in candidates)
+        )
+        scored = [(similarity, name_id) for similarity, name_id in scored if similarity >= self.min_similarity]
+        if not scored:
+            return None
+        
+        weights = {}
+        best = {}
+        for similarity, name_id in scored:
+            code = self._labels[name_id]
+            weights[code] = weights.get(code, 0.0) + similarity
+            best[code] = max(best.get(code, 0.0), similarity)
+        code = max(weights, key=lambda c: (weights[c], best[c]))
+        confidence = weights[code] / sum(weights.values()) * best[code]
+        if confidence < self.min_confidence:
+            return None
+        neighbors = tuple(
+            (self.names[name_id], self.categories[self._labels[name_id]], similarity) for similarity, name_id in scored
+        )
+        return NeighborMatch(self.categories[code], confidence, neighbors)
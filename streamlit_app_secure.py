@@ -5,11 +5,43 @@
 
 import streamlit as st
 import pandas as pd
-import openpyxl
 from io import BytesIO
-import time
 from datetime import datetime
 import hashlib
+from concurrent.futures import wait, FIRST_COMPLETED
+import os
+import zipfile
+
+from construction_classifier import (
+    CLASSIFY_CACHE_SIZE,
+    CLASSIFY_WORKERS,
+    EXCEL_EXTENSIONS,
+    FINGERPRINT_SHEET,
+    PARALLEL_MIN_ROWS,
+    TARGET_SHEET,
+    CategoryStore,
+    DIFF_ADDED,
+    DIFF_COLUMNS,
+    DIFF_RECLASSIFIED,
+    DIFF_REMOVED,
+    ConstructionItemClassifier,
+    Job,
+    JobPool,
+    JobQueueFull,
+    ResultCache,
+    available_export_formats,
+    build_neighbor_index,
+    classify_workbook_bytes,
+    compare_workbooks,
+    find_excel_files,
+    learn_corrections,
+    process_pool,
+    process_workbook,
+    process_workbook_sheets,
+    write_diff,
+)
+from telemetry import RunTelemetry, TelemetryLog, percentile, read_telemetry, summarize_telemetry
+from xlsx_patch import sheet_parts
 
 # ページ設定
 st.set_page_config(
@@ -104,327 +136,553 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 判定クラスを直接定義（インポート不要にする）
-class ConstructionItemClassifier:
-    """工事細目自動判定クラス"""
-    
-    def __init__(self):
-        self.categories = [
-            '電気設備', '空気調和設備', '4.1 屋根', '2.2 杭・基礎',
-            '3.1 コンクリート', '3.3 鉄骨', '3.4 鉄筋', '3.9 その他',
-            '4.2 外壁', '4.3 外部開口部', '5.1 内部床', '5.2 内壁',
-            '5.3 内部開口部', '5.4 天井', '5.9 内部雑', '0.0 対象外'
-        ]
-    
-    def normalize_text(self, text):
-        if not text or text is None:
-            return ''
-        return str(text).strip()
-    
-    def contains_any(self, text, keywords):
-        normalized = self.normalize_text(text)
-        return any(keyword in normalized for keyword in keywords)
-    
-    def is_electric_equipment(self, name):
-        keywords = [
-            '電気設備', '電力引込設備', '幹線動力設備', '共用電灯コンセント設備',
-            '専有部電灯コンセント設備', '共用照明器具設備', '専有部照明器具設備',
-            '電話配管設備', 'インターネット設備', 'テレビ共聴設備',
-            'インターホン設備', 'ITV設備', 'ＩＴＶ設備', '自動火災報知設備', '避雷針設備',
-            '電線', '電線管', 'ライニング鋼管', 'ケーブル',
-            '高圧キャビネット', 'キャビネット', '分電盤', '照明器具',
-            '接地端子盤', 'ＵＧＳ', '埋設標示シート', 'コンセント'
-        ]
-        return self.contains_any(name, keywords)
-    
-    def is_hvac_equipment(self, name):
-        keywords = [
-            '給排水衛生設備', '給水設備', '給湯設備', '排水設備', '衛生器具設備',
-            '都市ガス設備', '消火設備', '空調設備',
-            '増圧直結給水ポンプ', '量水器', '止水栓', '給水栓',
-            '大便器', '小便器', '洗面器', '流し',
-            '水道用ポリエチレン管', '架橋ポリエチレン管', '排水管', '通気管', 'ガス管',
-            'サヤ管', 'サ ヤ 管', '継手類', '防食塗装',
-            '雑排水', '汚水', '雨水', '消火栓', 'スプリンクラー',
-            '屋外埋設', '散水栓'
-        ]
-        return self.contains_any(name, keywords)
-    
-    def is_roof(self, name):
-        normalized = self.normalize_text(name)
-        if 'EVピット' in normalized or '消火水槽' in normalized:
-            return False
-        
-        roof_positions = ['屋上', '屋根', 'ルーフバルコニー', '勾配屋根', '階段屋根',
-                         'EV屋根', '庇', 'バルコニー', 'サービスバルコニー',
-                         '廊下', 'マリオン', 'パラペット']
-        waterproof = ['防水', 'アスファルト防水', 'ウレタン系塗膜防水', '塗膜防水',
-                     '露出防水', '断熱防水', 'シート防水', '防水仕舞',
-                     'アスファルトシングル葺', '脱気装置']
-        roof_parts = ['立上り', '笠木', '防水押え金物', '化粧防水押え金物',
-                     '軒先水切', '水上水切', 'ケラバ水切', '雪止め金具',
-                     '排水溝', '成型緩衝材', '伸縮目地', 'コーナーキャント', '通気立上り']
-        
-        has_roof = self.contains_any(name, roof_positions)
-        if has_roof and 'コンクリート金鏝押え' in normalized:
-            return True
-        if has_roof and '打放し補修' in normalized:
-            return True
-        if has_roof and self.contains_any(name, waterproof):
-            return True
-        if self.contains_any(name, roof_parts):
-            return True
-        return False
-    
-    def is_pile_foundation(self, name):
-        normalized = self.normalize_text(name)
-        if 'クレーン基礎杭費' in normalized or 'ｸﾚｰﾝ基礎杭費' in normalized or '杭間浚い' in normalized:
-            return False
-        keywords = ['杭', '場所打ち杭', '既製杭', '杭頭', '補強リング', '水中コンクリート', '試験堀', '継手材料']
-        return self.contains_any(name, keywords)
-    
-    def is_concrete(self, name):
-        normalized = self.normalize_text(name)
-        if '型枠' in normalized or 'コンクリート足場' in normalized or 'ｺﾝｸﾘｰﾄ足場' in normalized:
-            return False
-        roof_pos = ['屋上', 'ルーフバルコニー', 'バルコニー', '廊下', '庇', 'EV屋根']
-        if self.contains_any(name, roof_pos) and 'コンクリート金鏝押え' in normalized:
-            return False
-        keywords = ['コンクリート', 'ｺﾝｸﾘｰﾄ', 'こんくりーと', '捨コン', '捨ｺﾝ',
-                   '土間コンクリート', '土間ｺﾝｸﾘｰﾄ', '基礎コンクリート', '基礎ｺﾝｸﾘｰﾄ',
-                   '耐圧コンクリート', '耐圧ｺﾝｸﾘｰﾄ', 'スラブコンクリート', 'ｽﾗﾌﾞｺﾝｸﾘｰﾄ',
-                   '躯体コンクリート', '躯体ｺﾝｸﾘｰﾄ', '増打用コンクリート', '増打用ｺﾝｸﾘｰﾄ',
-                   '防水押えコンクリート', '防水押えｺﾝｸﾘｰﾄ', '浮床コンクリート', '浮床ｺﾝｸﾘｰﾄ',
-                   '構造体強度補正', '打設費', '圧送費', '圧送料', 'ポンプ車', 'ﾎﾟﾝﾌﾟ車',
-                   'ポンプ用モルタル', 'ﾎﾟﾝﾌﾟ用ﾓﾙﾀﾙ', '垂直打継処理', '配管費', '金鏝']
-        return self.contains_any(name, keywords)
-    
-    def is_steel_frame(self, name):
-        normalized = self.normalize_text(name)
-        if '軽量鉄骨' in normalized or 'LGS' in normalized:
-            return False
-        keywords = ['定着板', '下地鉄骨', '縞鋼板', '柱型', '大梁', '小梁', 'ブレース', '吊ボルト']
-        return self.contains_any(name, keywords)
-    
-    def is_rebar(self, name):
-        normalized = self.normalize_text(name)
-        if '鉄筋足場' in normalized:
-            return False
-        if ('場所打ち' in normalized or '場所打' in normalized) and '鉄筋' in normalized:
-            return False
-        keywords = ['鉄筋', '溶接閉鎖型鉄筋', '高強度せん断補強筋', '鉄筋加工費', '鉄筋組立費',
-                   '鉄筋小運搬費', '鉄筋圧接費', '鉄筋切断費', 'スペーサーブロック', 'ｽﾍﾟｰｻｰﾌﾞﾛｯｸ',
-                   'D10', 'D13', 'テストピース', 'ﾃｽﾄﾋﾟｰｽ', 'スリット連結筋', 'ｽﾘｯﾄ連結筋',
-                   '溶接金網', '人通孔補強', '梁貫通スリーブ補強', '梁貫通ｽﾘｰﾌﾞ補強',
-                   'ダメ穴補強', 'ﾀﾞﾒ穴補強']
-        return self.contains_any(name, keywords)
-    
-    def is_other_structure(self, name):
-        keywords = ['型枠', '基礎型枠', '普通型枠', '打放型枠', '捨コン用型枠', '捨ｺﾝ用型枠',
-                   'スラブ段差型枠', 'ｽﾗﾌﾞ段差型枠', '勾配型枠', '上蓋型枠',
-                   '止水板', '構造スリット', '構造ｽﾘｯﾄ', '階段構造ｽﾘｯﾄ']
-        return self.contains_any(name, keywords)
-    
-    def is_exterior_wall(self, name):
-        if self.contains_any(name, ['手摺', '窓', 'サッシ', '巾木']):
-            return False
-        keywords = ['外壁', 'ALC版', 'カーテンウォール', 'タイル', '磁器質タイル',
-                   '二丁掛', '役物', 'タイルクリーニング', '超高圧洗浄']
-        return self.contains_any(name, keywords)
-    
-    def is_exterior_opening(self, name):
-        normalized = self.normalize_text(name)
-        keywords = ['手摺', '手摺足元', '手摺壁', '進入防止竪格子', '防風スクリーン',
-                   '仕上見切金物', '巾木', 'ボーダー', '壁付手摺', '養生目的ガード',
-                   '膳板', '吊りフック', '窓', 'AW', 'FIX', '引違い', '片引き', 'サッシ',
-                   '面格子', '雨戸', 'シャッター', '玄関扉', 'ED']
-        if '巾木' in normalized and self.contains_any(name, ['廊下', 'バルコニー', '防水']):
-            return True
-        return self.contains_any(name, keywords)
-    
-    def is_interior_floor(self, name):
-        normalized = self.normalize_text(name)
-        if '天井' in normalized or '壁' in normalized:
-            return False
-        roof_pos = ['屋上', 'ルーフバルコニー', 'バルコニー', 'サービスバルコニー', '廊下']
-        if self.contains_any(name, roof_pos) and self.contains_any(name, ['防水', 'コンクリート金鏝押え']):
-            return False
-        if '床' in normalized:
-            return True
-        return False
-    
-    def is_interior_wall(self, name):
-        normalized = self.normalize_text(name)
-        if '天井' in normalized or self.contains_any(name, ['額縁', 'SD', '開口']):
-            return False
-        keywords = ['間仕切', '壁', '木下地', '取付下地', '固定棚取付下地',
-                   '軽量鉄骨壁下地', 'LGS', 'ボード下地', 'プラスターボード',
-                   '石膏ボード', 'クロス下地', 'カーテンボックス', 'ウォールドア', '壁補強']
-        return self.contains_any(name, keywords)
-    
-    def is_interior_opening(self, name):
-        keywords = ['額縁', 'ユニットバス額縁', '玄関額縁', '掃出し窓下枠', '見切縁',
-                   '開口枠', '開口上枠', 'SD', '片開き', '両開き', 'フラッシュ戸',
-                   '戸袋付', '点検口', '集中購買品', '電気錠']
-        return self.contains_any(name, keywords)
-    
-    def is_ceiling(self, name):
-        normalized = self.normalize_text(name)
-        if '天井' in normalized:
-            return True
-        keywords = ['下り天井', '段裏', '軽量天井下地', '軽量鉄骨天井下地',
-                   '天井開口補強', 'プラスターボード', '化粧石膏ボード',
-                   'ステンレスパネル', '廻縁', '廻り縁', 'コーナービート',
-                   '天井インサート', '天井打放し補修']
-        return self.contains_any(name, keywords)
-    
-    def is_interior_misc(self, name):
-        keywords = ['カウンター', '固定棚', '玄関カウンター', '洗面室カウンター',
-                   'カウンター天板', 'FAMCL', 'WICL', 'SICL', '集成材', '人工大理石',
-                   'ポスト', '宅配ボックス', '宅配BOX', '集合郵便受', '掲示板']
-        return self.contains_any(name, keywords)
-    
-    def is_excluded(self, name):
-        normalized = self.normalize_text(name)
-        if '鉄筋足場' in normalized or 'コンクリート足場' in normalized or 'ｺﾝｸﾘｰﾄ足場' in normalized:
-            return True
-        if 'クレーン基礎杭費' in normalized or 'ｸﾚｰﾝ基礎杭費' in normalized or '杭間浚い' in normalized:
-            return True
-        keywords = ['仮囲費', '仮設建物費', '仮設道路費', '借地費', '整地費', '共通費',
-                   '残材処分費', '遣り方', '墨だし', '外部足場', '内部足場', '朝顔',
-                   'ステージ', '跡片付清掃', '根切', '埋戻', '残土処分', '山留', '土留', '地盤改良']
-        return self.contains_any(name, keywords)
-    
-    def classify(self, name, work_category='', parent_category=''):
-        if not name or str(name).strip() == '':
-            return None
-        
-        normalized = self.normalize_text(name)
-        parent_normalized = self.normalize_text(parent_category)
-        
-        # 親カテゴリが設備系の場合
-        if '設備工事' in parent_normalized:
-            if any(k in parent_normalized for k in ['電気', '電力', '電灯', '照明', '電話', 'インターネット', 'テレビ', 'インターホン', 'ITV', 'ＩＴＶ', '火災報知', '避雷']):
-                return '電気設備'
-            elif any(k in parent_normalized for k in ['給排水', '給水', '給湯', '排水', '衛生器具', 'ガス', '消火', '空調']):
-                return '空気調和設備'
-        
-        # 判定優先順位
-        if self.is_electric_equipment(name): return '電気設備'
-        if self.is_hvac_equipment(name): return '空気調和設備'
-        if self.is_roof(name): return '4.1 屋根'
-        if self.is_pile_foundation(name): return '2.2 杭・基礎'
-        if '杭工事' in str(work_category) and '施工費' in normalized:
-            return '2.2 杭・基礎'
-        if self.is_concrete(name): return '3.1 コンクリート'
-        if self.is_steel_frame(name): return '3.3 鉄骨'
-        if self.is_rebar(name): return '3.4 鉄筋'
-        if self.is_other_structure(name): return '3.9 その他'
-        if self.is_exterior_wall(name): return '4.2 外壁'
-        if self.is_exterior_opening(name): return '4.3 外部開口部'
-        if self.is_interior_floor(name): return '5.1 内部床'
-        if self.is_interior_wall(name): return '5.2 内壁'
-        if self.is_interior_opening(name): return '5.3 内部開口部'
-        if self.is_ceiling(name): return '5.4 天井'
-        if self.is_interior_misc(name): return '5.9 内部雑'
-        if self.is_excluded(name): return '0.0 対象外'
-        return '0.0 対象外'
-
-def process_excel_streamlit(uploaded_file):
-    """Streamlit用のExcel処理関数"""
-    
-    # プログレスバーとステータス
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+# 一括処理で同時に処理するファイル数
+BATCH_WORKERS = 2
+
+# 名称→判定結果の永続ストア（SQLite、サーバー全体・実行をまたいで共有。環境変数 CLASSIFY_STORE_PATH で変更できる）
+CATEGORY_STORE_PATH = os.environ.get('CLASSIFY_STORE_PATH', 'category_store.sqlite3')
+
+# 近傍索引を作る判定済みファイル（またはフォルダ）。環境変数 CLASSIFY_NEIGHBOR_PATHS に os.pathsep 区切りで指定する
+# 指定した場合は、どのキーワードにも該当しない名称を判定済みの近い名称の判定結果で判定する
+NEIGHBOR_SOURCE_PATHS = [path for path in os.environ.get('CLASSIFY_NEIGHBOR_PATHS', '').split(os.pathsep) if path]
+
+# 処理結果キャッシュ（アップロード内容のSHA-256単位、サーバー全体で共有）
+RESULT_CACHE_TTL = 60 * 60
+RESULT_CACHE_MAX_ENTRIES = 20
+RESULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# バックグラウンド処理（サーバー全体で同時に実行するジョブ数・待機できるジョブ数）
+# サーバーの規模に合わせて環境変数 CLASSIFY_JOB_WORKERS / CLASSIFY_JOB_QUEUE_DEPTH で変更できる
+JOB_WORKERS = int(os.environ.get('CLASSIFY_JOB_WORKERS', 2))
+JOB_QUEUE_DEPTH = int(os.environ.get('CLASSIFY_JOB_QUEUE_DEPTH', 8))
+JOB_POLL_INTERVAL = 1.0
+
+# 判定1回ごとの段階別の計測結果を追記するログ（JSON Lines、ローテーションあり。環境変数 CLASSIFY_TELEMETRY_PATH で変更できる）
+TELEMETRY_LOG_PATH = os.environ.get('CLASSIFY_TELEMETRY_PATH', 'classify_telemetry.jsonl')
+
+# 分析用データのダウンロード形式
+EXPORT_MIME_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+@st.cache_resource
+def get_category_store():
+    """サーバー全体で共有する名称→判定結果の永続ストア"""
+    return CategoryStore(CATEGORY_STORE_PATH)
+
+@st.cache_resource
+def get_neighbor_index():
+    """サーバー全体で共有する近傍索引（起動後に1回だけ作る。判定済みファイルを指定していない場合は None）"""
+    if not NEIGHBOR_SOURCE_PATHS:
+        return None
+    return build_neighbor_index(find_excel_files(NEIGHBOR_SOURCE_PATHS))
+
+@st.cache_resource
+def get_classifier():
+    """サーバー全体で共有する分類器（判定キャッシュ・永続ストア・近傍索引も共有される）"""
+    return ConstructionItemClassifier(store=get_category_store(), neighbors=get_neighbor_index())
+
+@st.cache_resource
+def get_result_cache():
+    """サーバー全体で共有する処理結果キャッシュ"""
+    return ResultCache(
+        max_entries=RESULT_CACHE_MAX_ENTRIES,
+        max_bytes=RESULT_CACHE_MAX_BYTES,
+        ttl=RESULT_CACHE_TTL
+    )
+
+@st.cache_resource
+def get_telemetry_log():
+    """サーバー全体で共有する計測結果のログ（ローテーションを1か所で行うため共有する）"""
+    return TelemetryLog(TELEMETRY_LOG_PATH)
+
+@st.cache_resource
+def get_job_pool():
+    """サーバー全体で共有するジョブのワーカープール（終了したジョブは結果キャッシュと同じ期間保持する）"""
+    return JobPool(max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_DEPTH, keep_seconds=RESULT_CACHE_TTL)
+
+def classify_upload(data, classifier, result_cache=None, workers=CLASSIFY_WORKERS,
+                    incremental=False, previous_data=None, export_format='csv', sheets=None, telemetry_log=None,
+                    on_progress=None):
+    """アップロードされたExcelファイルを判定する（ジョブとしてワーカースレッドで実行する）
+    
+    result_cache を渡すと、同じ内容のファイルは判定済みの結果を再利用する（全ユーザー共通）。
+    プロファイル計測など、毎回判定したい場合は result_cache を渡さない。
+    incremental=True の場合は差分判定を行う（previous_data は判定済みの旧版ファイル）。
+    同じ判定結果を分析用データとして export_format（'csv' / 'parquet'）でも書き出す。
+    sheets（シート名のリスト）を渡すと複数シートを判定する（差分判定・分析用データには対応しない）。
+    telemetry_log（TelemetryLog）を渡すと、判定した場合に段階別の計測結果を1行書き出す（結果キャッシュから返した場合は書かない）。
+    Streamlit の要素には触れない。
+    戻り値は (出力バイト列, 分析用データのバイト列, カテゴリ別件数, 判定キャッシュ統計, 差分判定の統計,
+    シート名→カテゴリ別件数, 結果キャッシュから返したか)。複数シートでない場合のシート別件数、
+    複数シートの場合と書き出しに失敗した場合の分析用データ、複数シートの場合の差分判定の統計は None
+    """
+    def compute():
+        telemetry = RunTelemetry(mode='app', profile=classifier.profile is not None)
+        if sheets is not None:
+            output, stats, sheet_stats, cache_info = process_workbook_sheets(
+                BytesIO(data), sheets=sheets, classifier=classifier, workers=workers, on_progress=on_progress,
+                telemetry=telemetry
+            )
+            result = output.getvalue(), None, stats, cache_info, None, sheet_stats
+        else:
+            export = BytesIO()
+            output, stats, cache_info, reuse_info = process_workbook(
+                BytesIO(data), classifier=classifier, workers=workers, on_progress=on_progress,
+                incremental=incremental, previous=BytesIO(previous_data) if previous_data else None,
+                export=export, export_format=export_format, telemetry=telemetry
+            )
+            telemetry.update(export_format=export_format)
+            # 分析用データを書き出せなかった場合も判定結果のExcelは返す
+            export_data = None if 'export_error' in telemetry.fields else export.getvalue()
+            result = output.getvalue(), export_data, stats, cache_info, reuse_info, None
+        if telemetry_log is not None:
+            telemetry_log.write(telemetry.record())
+        return result
+    
+    if result_cache is None:
+        return compute() + (False,)
+    
+    # 差分判定の結果は旧版ファイルにも依存するのでキーに含める
+    content_hash = hashlib.sha256(data).hexdigest() + ':' + export_format
+    if incremental:
+        content_hash += ':incremental:' + (hashlib.sha256(previous_data).hexdigest() if previous_data else '')
+    if sheets is not None:
+        content_hash += ':sheets:' + '\x1f'.join(sheets)
+    result, cached = result_cache.get_or_compute(
+        content_hash, compute, size_of=lambda result: len(result[0]) + len(result[1] or b'')
+    )
+    if cached and on_progress:
+        on_progress(100, "♻️ 同じファイルの判定結果を再利用しました")
+    return result + (cached,)
+
+def workbook_sheet_names(data):
+    """アップロードされたファイルのシート名の一覧（ワークブック全体は読み込まない。読めない場合は空）"""
+    try:
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            return [name for name in sheet_parts(archive) if name != FINGERPRINT_SHEET]
+    except Exception:
+        return []
+
+def submit_job(entry, name, fn, *args, **kwargs):
+    """ジョブをワーカープールに投入し、このセッションのジョブ一覧に加える
     
+    entry は結果の表示に使う情報（'kind' に 'single'・'batch'・'compare' のいずれか）で、ジョブを加えて保存する。
+    待ち行列が満杯の場合は警告を表示して None を返す。
+    """
     try:
-        # ファイルを読み込み
-        status_text.text("📂 ファイルを読み込み中...")
-        progress_bar.progress(10)
-        
-        wb = openpyxl.load_workbook(uploaded_file)
-        
-        if '最上位明細' not in wb.sheetnames:
-            st.error("❌ シート「最上位明細」が見つかりません")
-            return None, None
-        
-        ws = wb['最上位明細']
-        
-        # 設定
-        header_row = 6
-        data_start_row = 7
-        name_col = 2
-        classification_col = 12
-        work_category_col = 1
-        
-        # 分類器の初期化
-        classifier = ConstructionItemClassifier()
-        
-        # 統計情報
-        stats = {}
-        for cat in classifier.categories:
-            stats[cat] = 0
-        
-        classified_count = 0
-        current_parent = ''
-        
-        # 最終行を取得
-        max_row = ws.max_row
-        total_rows = max_row - data_start_row
-        
-        status_text.text(f"🔍 判定を実行中... (0 / {total_rows})")
-        progress_bar.progress(20)
+        job = get_job_pool().submit(fn, *args, name=name, **kwargs)
+    except JobQueueFull as e:
+        st.warning(f"⚠️ {str(e)}。しばらく待ってから実行してください")
+        return None
+    st.session_state.setdefault('jobs', []).append(dict(entry, id=job.id, job=job))
+    return job
+
+def session_jobs(kind):
+    """このセッションで投入した kind 種別の (entry, Job) の一覧（新しい順）
+    
+    終わったジョブはプールから外し、結果はこのセッションだけが保持する（evict_results で捨てるまで）。
+    再実行やダウンロードでは保持している結果をそのまま表示し、判定し直さない。
+    """
+    pool = get_job_pool()
+    jobs = []
+    for entry in st.session_state.get('jobs', []):
+        job = entry['job']
+        if job.finished:
+            pool.release(job.id)
+        if entry['kind'] == kind:
+            jobs.append((entry, job))
+    return jobs[::-1]
+
+def evict_results(kind=None, finished_only=True):
+    """このセッションが保持しているジョブの結果を捨てる（新しいファイルのアップロード時・ログアウト時）
+    
+    kind を指定するとその種別だけ、finished_only=False の場合は実行中・待機中のジョブも捨てる
+    （実行は続くが結果は誰も参照しないので、終わった時点で解放される）。
+    """
+    pool = get_job_pool()
+    kept = []
+    for entry in st.session_state.get('jobs', []):
+        job = entry['job']
+        if (kind is None or entry['kind'] == kind) and (job.finished or not finished_only):
+            pool.release(job.id)
+        else:
+            kept.append(entry)
+    st.session_state['jobs'] = kept
+
+def render_job_error(job):
+    """失敗したジョブのエラー表示"""
+    if isinstance(job.error, ValueError):
+        st.error(f"❌ {job.name}: {str(job.error)}")
+    else:
+        st.error(f"❌ {job.name}: エラーが発生しました: {str(job.error)}")
+        st.code(job.traceback)
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_active_jobs(kind):
+    """実行中・待機中のジョブの進捗（一定間隔でこの部分だけ再実行して更新する）"""
+    pool = get_job_pool()
+    active = [job for _, job in session_jobs(kind) if not job.finished]
+    if not active:
+        # すべて終わったら画面全体を再実行して結果を表示する
+        st.rerun()
+    
+    for job in active:
+        if job.status == Job.QUEUED:
+            st.info(f"⏳ {job.name}: 待機中（{pool.queue_position(job)}番目、待ち時間 {job.wait_seconds:.1f}秒）")
+        else:
+            st.progress(job.progress, text=f"{job.name}: {job.message}")
+            st.caption(f"待ち時間 {job.wait_seconds:.1f}秒 / 実行時間 {job.run_seconds:.1f}秒")
+
+def render_job_history(jobs):
+    """このセッションのジョブの待ち時間・実行時間の一覧（jobs は session_jobs の戻り値）"""
+    labels = {Job.QUEUED: '待機中', Job.RUNNING: '処理中', Job.DONE: '完了', Job.FAILED: 'エラー'}
+    history = pd.DataFrame([
+        {
+            "ファイル": job.name,
+            "状態": labels[job.status],
+            "待ち時間(秒)": round(job.wait_seconds, 1),
+            "実行時間(秒)": round(job.run_seconds, 1) if job.run_seconds is not None else None,
+        }
+        for _, job in jobs
+    ])
+    with st.expander(f"🗂️ ジョブ履歴（{len(jobs)}件）"):
+        st.dataframe(history, use_container_width=True, hide_index=True)
+
+def extract_excel_files(uploaded_files):
+    """アップロードされたExcelファイル・ZIPを (ファイル名, バイト列) のリストに展開する"""
+    files = []
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith('.zip'):
+            with zipfile.ZipFile(uploaded) as archive:
+                for info in archive.infolist():
+                    # UTF-8フラグのないファイル名はWindows（cp932）で作られたものとして扱う
+                    filename = info.filename
+                    if not info.flag_bits & 0x800:
+                        try:
+                            filename = filename.encode('cp437').decode('cp932')
+                        except UnicodeError:
+                            pass
+                    basename = filename.rsplit('/', 1)[-1]
+                    if info.is_dir() or filename.startswith('__MACOSX/') or basename.startswith('~$'):
+                        continue
+                    if basename.lower().endswith(EXCEL_EXTENSIONS):
+                        files.append((basename, archive.read(info)))
+        elif uploaded.name.lower().endswith(EXCEL_EXTENSIONS):
+            files.append((uploaded.name, uploaded.getvalue()))
+    return files
+
+def combine_stats(file_stats):
+    """ファイル別のカテゴリ件数を、カテゴリ×ファイルの表（合計列付き）にまとめる"""
+    combined = pd.DataFrame(file_stats).fillna(0).astype(int)
+    combined.index.name = 'カテゴリ'
+    combined.insert(0, '合計', combined.sum(axis=1))
+    return combined[combined['合計'] > 0].sort_values('合計', ascending=False)
+
+def classify_batch(files, workers=BATCH_WORKERS, cache_size=CLASSIFY_CACHE_SIZE, store_path=CATEGORY_STORE_PATH,
+                   neighbors=None, on_progress=None):
+    """複数のExcelファイルをプロセスプールで並列に処理する（ジョブとしてワーカースレッドで実行する）
+    
+    files は (ファイル名, バイト列) のリスト。neighbors（近傍索引）を渡すと各ワーカーの判定で使う。
+    戻り値は (結果ZIPのバイト列, ファイル名→カテゴリ別件数, ファイル名→エラーメッセージ)
+    """
+    def report(message):
+        if on_progress:
+            on_progress(int((len(files) - len(pending)) / len(files) * 100), message)
+    
+    file_stats = {}
+    errors = {}
+    output = BytesIO()
+    used_names = set()
+    
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive, \
+            process_pool(workers) as executor:
+        pending = {
+            executor.submit(classify_workbook_bytes, data, cache_size, store_path=store_path, neighbors=neighbors): name
+            for name, data in files
+        }
+        report(f"🔍 {len(files)}ファイルを処理中...")
         
-        # データ行を処理
-        for i in range(data_start_row, max_row + 1):
-            excel_row = i + 1
-            
-            # 進捗更新
-            if (i - data_start_row) % 100 == 0:
-                progress = 20 + int(((i - data_start_row) / total_rows) * 70)
-                progress_bar.progress(progress)
-                status_text.text(f"🔍 判定を実行中... ({i - data_start_row} / {total_rows})")
-            
-            # 名称を取得
-            name_cell = ws.cell(row=excel_row, column=name_col + 1)
-            name = name_cell.value
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
             
-            # 工事科目を取得
-            work_category_cell = ws.cell(row=excel_row, column=work_category_col + 1)
-            work_category = work_category_cell.value if work_category_cell.value else ''
-            
-            # 親カテゴリの更新
-            if name and '設備工事' in str(name):
-                current_parent = str(name)
-            
-            # 判定実行
-            if name and str(name).strip() != '':
-                classification = classifier.classify(name, work_category, current_parent)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    data, stats = future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+                    report(f"❌ {name}: {str(e)}")
+                    continue
                 
-                if classification:
-                    # セルに書き込み
-                    ws.cell(row=excel_row, column=classification_col + 1, value=classification)
-                    classified_count += 1
-                    stats[classification] = stats.get(classification, 0) + 1
-        
-        progress_bar.progress(90)
-        status_text.text("💾 ファイルを保存中...")
-        
-        # Excelファイルをバイトストリームに保存
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+                # 同名ファイルは連番を付けて区別する
+                stem = name.rsplit('.', 1)[0]
+                output_name = f"{stem}_分類結果.xlsx"
+                suffix = 2
+                while output_name in used_names:
+                    output_name = f"{stem}_分類結果_{suffix}.xlsx"
+                    suffix += 1
+                used_names.add(output_name)
+                
+                archive.writestr(output_name, data)
+                file_stats[output_name] = stats
+                report(f"✅ {name}: 完了（{sum(stats.values()):,}件） {len(files) - len(pending)} / {len(files)}ファイル")
         
-        progress_bar.progress(100)
-        status_text.text("✅ 処理完了！")
+        # 全ファイルの集計をCSVとして同梱する
+        if file_stats:
+            archive.writestr('カテゴリ別集計.csv', combine_stats(file_stats).to_csv().encode('utf-8-sig'))
+    
+    return output.getvalue(), file_stats, errors
+
+def render_batch_mode(batch_workers):
+    """一括処理モードの画面"""
+    uploaded_files = st.file_uploader(
+        "Excelファイル（複数可）またはZIPファイルを選択してください",
+        type=['xlsx', 'xls', 'zip'],
+        accept_multiple_files=True,
+        help="ZIPファイル内のExcelファイルもまとめて処理します",
+        on_change=evict_results,
+        args=('batch',)
+    )
+    
+    if uploaded_files:
+        files = extract_excel_files(uploaded_files)
+        total_size = sum(len(data) for _, data in files)
+        st.markdown(f"""
+        <div class="info-box">
+            <strong>📄 対象ファイル数:</strong> {len(files)}件<br>
+            <strong>📊 合計サイズ:</strong> {total_size / 1024:.2f} KB
+        </div>
+        """, unsafe_allow_html=True)
         
-        return output, stats
+        if not files:
+            st.warning("⚠️ 処理対象のExcelファイルが見つかりません")
+        elif st.button("🚀 一括判定を実行", type="primary"):
+            submit_job({'kind': 'batch'}, f"{len(files)}ファイル", classify_batch, files, workers=batch_workers,
+                       neighbors=get_neighbor_index())
+    
+    render_jobs('batch', render_batch_result)
+
+def compare_uploads(old_data, new_data, classifier, on_progress=None):
+    """2つの版の見積書を比べる（ジョブとしてワーカースレッドで実行する）
+    
+    戻り値は (差分表の行のリスト, カテゴリ→(旧版の件数, 新版の件数), 差分表CSVのバイト列)
+    """
+    if on_progress:
+        on_progress(10, "📖 2つの版を読み込み・比較中...")
+    rows, deltas = compare_workbooks(BytesIO(old_data), BytesIO(new_data), classifier)
+    if on_progress:
+        on_progress(90, "💾 差分表を作成中...")
+    output = BytesIO()
+    write_diff(rows, output)
+    return rows, deltas, output.getvalue()
+
+def render_compare_mode():
+    """版の比較モードの画面"""
+    upload_cols = st.columns(2)
+    with upload_cols[0]:
+        old_file = st.file_uploader(
+            "旧版のExcelファイル",
+            type=['xlsx'],
+            help="判定結果列が空の行はその場で判定します",
+            on_change=evict_results,
+            args=('compare',)
+        )
+    with upload_cols[1]:
+        new_file = st.file_uploader(
+            "新版のExcelファイル",
+            type=['xlsx'],
+            help="判定結果列が空の行はその場で判定します",
+            on_change=evict_results,
+            args=('compare',)
+        )
+    
+    if st.button("🔍 比較を実行", type="primary", disabled=old_file is None or new_file is None):
+        submit_job(
+            {'kind': 'compare', 'old_name': old_file.name},
+            new_file.name,
+            compare_uploads,
+            old_file.getvalue(),
+            new_file.getvalue(),
+            get_classifier()
+        )
+    
+    render_jobs('compare', render_compare_result)
+
+def render_jobs(kind, render_result):
+    """このセッションのジョブの進捗と、最後に終わったジョブの結果を表示する"""
+    jobs = session_jobs(kind)
+    if not jobs:
+        return
+    
+    if any(not job.finished for _, job in jobs):
+        render_active_jobs(kind)
+    
+    # 最後に終わったジョブの結果を表示し、それ以前の結果は折りたたんでおく
+    finished = [(entry, job) for entry, job in jobs if job.finished]
+    for index, (entry, job) in enumerate(finished):
+        if index == 0:
+            render_job_result(entry, job, render_result)
+        else:
+            with st.expander(f"📄 以前の結果: {job.name}"):
+                render_job_result(entry, job, render_result)
+    
+    render_job_history(jobs)
+
+def render_job_result(entry, job, render_result):
+    if job.status == Job.FAILED:
+        render_job_error(job)
+    else:
+        render_result(entry, job)
+
+def render_batch_result(entry, job):
+    """一括処理ジョブの結果"""
+    output, file_stats, errors = job.result
+    
+    st.markdown(f"""
+    <div class="success-box">
+        <h3>✅ 一括処理完了！</h3>
+        <p><strong>処理時間:</strong> {job.run_seconds:.2f}秒（待ち時間 {job.wait_seconds:.2f}秒）</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    metric_cols = st.columns(3)
+    with metric_cols[0]:
+        st.metric("処理ファイル数", f"{len(file_stats):,}")
+    with metric_cols[1]:
+        st.metric("総件数", f"{sum(sum(stats.values()) for stats in file_stats.values()):,}")
+    with metric_cols[2]:
+        st.metric("エラー", f"{len(errors):,}")
+    
+    for name, message in errors.items():
+        st.error(f"❌ {name}: {message}")
+    
+    if file_stats:
+        st.subheader("📈 カテゴリ別内訳（全ファイル合計）")
+        st.dataframe(combine_stats(file_stats), use_container_width=True)
         
-    except Exception as e:
-        st.error(f"❌ エラーが発生しました: {str(e)}")
-        import traceback
-        st.code(traceback.format_exc())
-        return None, None
+        st.subheader("💾 結果をダウンロード")
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        st.download_button(
+            label="📥 結果ZIPをダウンロード",
+            data=output,
+            file_name=f"分類結果_{timestamp}.zip",
+            mime="application/zip",
+            type="primary",
+            key=f"download_{job.id}",
+            on_click="ignore"
+        )
+
+def render_compare_result(entry, job):
+    """版の比較ジョブの結果"""
+    rows, deltas, output = job.result
+    
+    st.markdown(f"""
+    <div class="success-box">
+        <h3>✅ 比較完了！</h3>
+        <p><strong>旧版:</strong> {entry['old_name']}<br>
+        <strong>新版:</strong> {job.name}<br>
+        <strong>処理時間:</strong> {job.run_seconds:.2f}秒（待ち時間 {job.wait_seconds:.2f}秒）</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    changes = pd.Series([row.change for row in rows], dtype=object).value_counts()
+    metric_cols = st.columns(3)
+    for col, change in zip(metric_cols, [DIFF_ADDED, DIFF_REMOVED, DIFF_RECLASSIFIED]):
+        with col:
+            st.metric(change, f"{int(changes.get(change, 0)):,}")
+    
+    st.subheader("📈 カテゴリ別の件数の変化")
+    deltas_df = pd.DataFrame([
+        {"カテゴリ": category, "旧版": old_count, "新版": new_count, "増減": new_count - old_count}
+        for category, (old_count, new_count) in deltas.items()
+        if old_count != new_count
+    ])
+    if deltas_df.empty:
+        st.info("カテゴリ別の件数に変化はありません")
+    else:
+        st.dataframe(deltas_df, use_container_width=True, hide_index=True)
+    
+    st.subheader("📝 差分表")
+    if not rows:
+        st.info("判定結果の変わった行・追加・削除された行はありません")
+        return
+    st.dataframe(pd.DataFrame(rows, columns=DIFF_COLUMNS), use_container_width=True, hide_index=True)
+    
+    st.download_button(
+        label="📥 差分表（CSV）をダウンロード",
+        data=output,
+        file_name=f"{job.name.rsplit('.', 1)[0]}_差分.csv",
+        mime="text/csv",
+        type="primary",
+        key=f"download_{job.id}",
+        on_click="ignore"
+    )
+
+def render_rule_profile(profile, key=None):
+    """ルール別プロファイルの表とJSON出力"""
+    st.subheader("⏱️ ルール別プロファイル")
+    
+    profile_df = pd.DataFrame(profile.to_records())
+    profile_df['seconds'] = profile_df['seconds'] * 1000
+    profile_df['decided_ratio'] = profile_df['decided_ratio'] * 100
+    profile_df = profile_df.rename(columns={
+        'rule': 'ルール',
+        'category': 'カテゴリ',
+        'calls': '呼び出し回数',
+        'seconds': '時間(ms)',
+        'decided': '判定件数',
+        'decided_ratio': '判定率(%)',
+    })
+    st.dataframe(profile_df.round(2), use_container_width=True, hide_index=True)
+    st.caption(f"判定行数: {profile.rows:,}件（default はどのルールにも該当せず「0.0 対象外」になった行）")
+    
+    st.download_button(
+        label="📥 プロファイルをJSONでダウンロード",
+        data=profile.to_json().encode('utf-8'),
+        file_name=f"rule_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json",
+        key=f"profile_{key}" if key else None,
+        on_click="ignore"
+    )
+
+def render_learning():
+    """手で修正した判定済みファイルを永続ストアに登録する（次回から判定ルールより優先される）"""
+    store = get_category_store()
+    counts = store.counts()
+    st.caption(f"登録済み: 手修正 {counts['manual']:,}件 / 判定結果 {counts['run']:,}件")
+    
+    corrected_file = st.file_uploader(
+        "修正済みの判定結果ファイル",
+        type=['xlsx'],
+        help="判定結果列を手で修正したファイルを登録すると、同じ名称・工事科目・親カテゴリの行は次回から修正後の値になります",
+        key="corrected_file"
+    )
+    if corrected_file is not None and st.button("📚 修正内容を登録"):
+        try:
+            added, removed, conflicts = learn_corrections(BytesIO(corrected_file.getvalue()), store)
+        except Exception as e:
+            st.error(f"❌ 登録できませんでした: {str(e)}")
+            return
+        # 登録前の判定結果を再利用しないようにする
+        get_result_cache().clear()
+        st.success(f"✅ 修正 {added:,}件を登録しました（元に戻した {removed:,}件を取り消しました）")
+        for name, labels in conflicts:
+            st.warning(f"⚠️ 「{name}」は行によって修正後の判定結果が違うため登録しませんでした（{' / '.join(labels)}）")
+
+def render_telemetry():
+    """計測結果のログを段階別に集計して表示する（ログ全体を読むのでボタンを押した時だけ集計する）"""
+    if not st.button("📈 集計する"):
+        st.caption("判定1回ごとの段階別の所要時間を集計します")
+        return
+    records = read_telemetry(TELEMETRY_LOG_PATH)
+    if not records:
+        st.caption("まだ記録がありません")
+        return
+    rows = [record.get('rows', 0) for record in records]
+    st.caption(f"直近{len(records):,}回 / 明細行数 p50 {percentile(rows, 0.5):,}行・p95 {percentile(rows, 0.95):,}行")
+    summary = pd.DataFrame(summarize_telemetry(records)).rename(columns={
+        'stage': '段階', 'count': '回数', 'p50_seconds': 'p50（秒）', 'p95_seconds': 'p95（秒）', 'mean_seconds': '平均（秒）'
+    })
+    st.dataframe(summary, use_container_width=True, hide_index=True)
 
 # メインアプリ
 def main():
@@ -436,6 +694,7 @@ def main():
     col1, col2, col3 = st.columns([4, 1, 1])
     with col3:
         if st.button("🚪 ログアウト"):
+            evict_results(finished_only=False)
             st.session_state.authenticated = False
             st.rerun()
     
@@ -509,14 +768,68 @@ def main():
             """)
         
         st.success("✅ **書式完全保持**  \nセルの色、罫線、列幅など全て維持されます")
+        
+        with st.expander("⚙️ 処理設定"):
+            workers = st.number_input(
+                "並列ワーカー数",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=min(CLASSIFY_WORKERS, os.cpu_count() or 1),
+                help=f"{PARALLEL_MIN_ROWS:,}行以上のシートで判定を複数プロセスに分散します"
+            )
+            batch_workers = st.number_input(
+                "一括処理の同時処理ファイル数",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=min(BATCH_WORKERS, os.cpu_count() or 1),
+                help="一括処理モードで同時に処理するファイル数の上限です"
+            )
+            profile_rules = st.checkbox(
+                "ルール別プロファイルを記録",
+                help="判定ルールごとの呼び出し回数・所要時間・判定件数を記録します（結果キャッシュ・並列判定は使いません）"
+            )
+            export_format = st.selectbox(
+                "分析用データの形式",
+                available_export_formats(),
+                format_func=str.upper,
+                help="判定結果（行番号・名称・工事科目・親カテゴリ・判定結果）を分析用にダウンロードする形式です"
+            )
+            neighbors = get_neighbor_index()
+            if neighbors is not None:
+                st.caption(f"🔎 近傍索引: 判定済みの名称 {len(neighbors):,}件（キーワードに該当しない名称に使います）")
+        
+        with st.expander("🖥️ サーバーの処理状況"):
+            pool_stats = get_job_pool().stats()
+            st.write(f"""
+            - 実行中: {pool_stats['running']} / {pool_stats['max_workers']}件
+            - 待機中: {pool_stats['queued']} / {pool_stats['max_queue']}件
+            - 平均待ち時間: {pool_stats['avg_wait_seconds']:.1f}秒
+            - 平均処理時間: {pool_stats['avg_run_seconds']:.1f}秒（直近{pool_stats['finished']}件）
+            """)
+        
+        with st.expander("⏱️ 処理時間の内訳"):
+            render_telemetry()
+        
+        with st.expander("📚 修正内容の登録"):
+            render_learning()
     
     # メインコンテンツ
     st.header("📤 ファイルアップロード")
     
+    mode = st.radio("処理モード", ["単一ファイル", "一括処理（複数ファイル / ZIP）", "版の比較"], horizontal=True)
+    if mode == "版の比較":
+        render_compare_mode()
+        return
+    if mode != "単一ファイル":
+        render_batch_mode(batch_workers)
+        return
+    
     uploaded_file = st.file_uploader(
         "Excelファイルを選択してください",
         type=['xlsx', 'xls'],
-        help="請負契約見積書のExcelファイルをアップロードしてください"
+        help="請負契約見積書のExcelファイルをアップロードしてください",
+        on_change=evict_results,
+        args=('single',)
     )
     
     if uploaded_file is not None:
@@ -527,62 +840,140 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        if st.button("🚀 判定を実行", type="primary"):
-            start_time = time.time()
-            
-            # 処理実行
-            output, stats = process_excel_streamlit(uploaded_file)
-            
-            if output and stats:
-                processing_time = time.time() - start_time
-                
-                # 成功メッセージ
-                st.markdown(f"""
-                <div class="success-box">
-                    <h3>✅ 処理完了！</h3>
-                    <p><strong>処理時間:</strong> {processing_time:.2f}秒</p>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # 統計情報を表示
-                st.subheader("📊 判定結果")
-                
-                # メトリクス表示
-                metric_cols = st.columns(3)
-                total_items = sum(stats.values())
-                
-                with metric_cols[0]:
-                    st.metric("総件数", f"{total_items:,}")
-                with metric_cols[1]:
-                    st.metric("判定完了", f"{total_items:,}")
-                with metric_cols[2]:
-                    st.metric("処理時間", f"{processing_time:.2f}秒")
-                
-                # カテゴリ別内訳
-                st.subheader("📈 カテゴリ別内訳")
-                
-                # データフレームとして表示
-                stats_df = pd.DataFrame([
-                    {"カテゴリ": cat, "件数": count}
-                    for cat, count in sorted(stats.items(), key=lambda x: x[1], reverse=True)
-                    if count > 0
-                ])
-                
-                st.dataframe(stats_df, use_container_width=True)
-                
-                # ダウンロードボタン
-                st.subheader("💾 結果をダウンロード")
-                
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                output_filename = f"{uploaded_file.name.rsplit('.', 1)[0]}_分類結果_{timestamp}.xlsx"
-                
-                st.download_button(
-                    label="📥 結果ファイルをダウンロード",
-                    data=output.getvalue(),
-                    file_name=output_filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    type="primary"
-                )
+        # 最上位明細以外のシートも選ぶと複数シートの判定になる（列の位置は列見出しから検出する）
+        sheet_names = workbook_sheet_names(uploaded_file.getvalue())
+        selected_sheets = st.multiselect(
+            "判定するシート",
+            sheet_names,
+            default=[TARGET_SHEET] if TARGET_SHEET in sheet_names else None,
+            help="最上位明細以外のシートは列見出し（名称・工事科目・判定結果）から列の位置を検出します"
+        )
+        sheets = None if selected_sheets == [TARGET_SHEET] else selected_sheets
+        
+        incremental = st.checkbox(
+            "差分判定（変更された行だけ判定）",
+            help="前回差分判定した結果ファイルを再アップロードした場合、内容が変わっていない行は判定結果列の値をそのまま使います",
+            disabled=sheets is not None
+        ) and sheets is None
+        previous_file = None
+        if incremental:
+            previous_file = st.file_uploader(
+                "前回の判定結果ファイル（任意）",
+                type=['xlsx'],
+                help="旧版の判定済みファイルを指定すると、同じ内容の行はその判定結果を使います"
+            )
+        
+        if st.button("🚀 判定を実行", type="primary", disabled=sheets == []):
+            # 判定はワーカープールで実行し、画面は進捗の表示だけを行う
+            classifier = ConstructionItemClassifier(
+                profile=True, store=get_category_store(), neighbors=get_neighbor_index()
+            ) if profile_rules else None
+            submit_job(
+                {'kind': 'single', 'incremental': incremental, 'classifier': classifier, 'export_format': export_format,
+                 'sheets': sheets},
+                uploaded_file.name,
+                classify_upload,
+                uploaded_file.getvalue(),
+                classifier or get_classifier(),
+                result_cache=None if classifier is not None else get_result_cache(),
+                workers=workers,
+                incremental=incremental,
+                previous_data=previous_file.getvalue() if incremental and previous_file is not None else None,
+                export_format=export_format,
+                sheets=sheets,
+                telemetry_log=get_telemetry_log()
+            )
+    
+    render_jobs('single', render_single_result)
+
+def render_single_result(entry, job):
+    """単一ファイルのジョブの結果"""
+    output, export, stats, cache_info, reuse_info, sheet_stats, cached = job.result
+    processing_time = job.run_seconds
+    
+    # 成功メッセージ
+    st.markdown(f"""
+    <div class="success-box">
+        <h3>✅ 処理完了！{'（♻️ 同じファイルの判定結果を再利用しました）' if cached else ''}</h3>
+        <p><strong>ファイル:</strong> {job.name}<br>
+        <strong>処理時間:</strong> {processing_time:.2f}秒（待ち時間 {job.wait_seconds:.2f}秒）</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # 統計情報を表示
+    st.subheader("📊 判定結果")
+    
+    # メトリクス表示
+    metric_cols = st.columns(4)
+    total_items = sum(stats.values())
+    cache_lookups = cache_info.hits + cache_info.misses
+    cache_hit_ratio = cache_info.hits / cache_lookups if cache_lookups else 0.0
+    
+    with metric_cols[0]:
+        st.metric("総件数", f"{total_items:,}")
+    with metric_cols[1]:
+        st.metric("判定完了", f"{total_items:,}")
+    with metric_cols[2]:
+        st.metric("処理時間", f"{processing_time:.2f}秒")
+    with metric_cols[3]:
+        st.metric("キャッシュヒット率", f"{cache_hit_ratio:.1%}")
+    
+    st.caption(
+        f"判定キャッシュ: ヒット {cache_info.hits:,}件 / ミス {cache_info.misses:,}件"
+        f"（容量 {cache_info.maxsize:,}件、使用 {cache_info.currsize:,}件）"
+        f" / 永続ストアの判定結果を使用 {cache_info.store_hits:,}件"
+    )
+    if entry['incremental']:
+        st.caption(f"差分判定: 再利用 {reuse_info.reused:,}件 / 再判定 {reuse_info.recomputed:,}件")
+    
+    # カテゴリ別内訳
+    st.subheader("📈 カテゴリ別内訳")
+    
+    # データフレームとして表示
+    stats_df = pd.DataFrame([
+        {"カテゴリ": cat, "件数": count}
+        for cat, count in sorted(stats.items(), key=lambda x: x[1], reverse=True)
+        if count > 0
+    ])
+    
+    st.dataframe(stats_df, use_container_width=True)
+    
+    if sheet_stats is not None:
+        st.subheader("📑 シート別内訳")
+        st.dataframe(combine_stats(sheet_stats), use_container_width=True)
+    
+    if entry['classifier'] is not None:
+        render_rule_profile(entry['classifier'].profile, key=job.id)
+    
+    # ダウンロードボタン
+    st.subheader("💾 結果をダウンロード")
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_filename = f"{job.name.rsplit('.', 1)[0]}_分類結果_{timestamp}.xlsx"
+    
+    st.download_button(
+        label="📥 結果ファイルをダウンロード",
+        data=output,
+        file_name=output_filename,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        type="primary",
+        key=f"download_{job.id}",
+        on_click="ignore"
+    )
+    
+    export_format = entry['export_format']
+    if export is None:
+        if sheet_stats is None:
+            st.warning(f"⚠️ 分析用データ（{export_format.upper()}）を書き出せませんでした（判定結果のExcelはダウンロードできます）")
+        return
+    st.download_button(
+        label=f"📊 分析用データ（{export_format.upper()}）をダウンロード",
+        data=export,
+        file_name=f"{job.name.rsplit('.', 1)[0]}_分類結果_{timestamp}.{export_format}",
+        mime=EXPORT_MIME_TYPES[export_format],
+        key=f"export_{job.id}",
+        on_click="ignore"
+    )
 
 if __name__ == "__main__":
     main()
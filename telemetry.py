@@ -0,0 +1,150 @@
+"""
+処理の段階別計測（テレメトリ）
+1回の処理ごとに、段階別の所要時間・行数・ファイルサイズ・メモリ・キャッシュ統計を記録し、
+ローテーション付きの JSON Lines ファイルに1行ずつ書き出す。集計（段階別の p50 / p95）もここで行う。
+標準ライブラリだけで動く。
+"""
+
+import json
+import logging
+import logging.handlers
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ログファイルの既定の上限（これを超えたら .1, .2, ... に回す）
+TELEMETRY_MAX_BYTES = 10 * 1024 * 1024
+TELEMETRY_BACKUP_COUNT = 5
+
+def peak_rss_mb():
+    """このプロセスの最大常駐メモリ（MB。取得できない環境では None）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux はKB単位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def current_rss_mb():
+    """このプロセスの現在の常駐メモリ（MB。/proc がない環境では None）"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+class RunTelemetry:
+    """1回の処理の計測結果（record() が JSON Lines の1行になる）
+    
+    段階の所要時間は stage() で計り、同じ段階を複数回計った場合は合計する。
+    段階の終わりごとに常駐メモリを測り、その最大値を処理中のメモリとして記録する
+    （最大常駐メモリはプロセス全体の値なので、サーバーでは過去の処理の分も含む）。
+    """
+    
+    def __init__(self, **fields):
+        self.fields = dict(fields)
+        self.stages = {}
+        self.max_rss_mb = current_rss_mb()
+        self._started = time.perf_counter()
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+            self.sample_memory()
+    
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+    
+    def sample_memory(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.max_rss_mb is None or rss > self.max_rss_mb):
+            self.max_rss_mb = rss
+    
+    def update(self, **fields):
+        self.fields.update(fields)
+    
+    def record(self):
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            **self.fields,
+            'total_seconds': round(time.perf_counter() - self._started, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'max_rss_mb': round(self.max_rss_mb, 1) if self.max_rss_mb is not None else None,
+            'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+        }
+
+class TelemetryLog:
+    """計測結果を JSON Lines で書き出すローテーション付きのログ（スレッドセーフ）
+    
+    1ファイルが max_bytes を超えたら path.1, path.2, ... に回し、backup_count 世代まで残す。
+    複数のプロセスから同じファイルに書き込まないこと（ローテーションがプロセス間で調停されない）。
+    """
+    
+    def __init__(self, path, max_bytes=TELEMETRY_MAX_BYTES, backup_count=TELEMETRY_BACKUP_COUNT):
+        self.path = os.fspath(path)
+        self.backup_count = backup_count
+        self._handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        self._handler.handle(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO}))
+    
+    def close(self):
+        self._handler.close()
+
+def read_telemetry(path, backup_count=TELEMETRY_BACKUP_COUNT):
+    """ログ（ローテーションした古い世代も含む）の計測結果を古い順に返す（壊れた行は飛ばす）"""
+    records = []
+    paths = [f"{path}.{index}" for index in range(backup_count, 0, -1)] + [path]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+def percentile(values, ratio):
+    """最近傍順位法のパーセンタイル（values は空でないこと）"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(ratio * len(ordered)) - 1, 0)]
+
+def summarize_telemetry(records):
+    """段階別の件数・p50・p95・平均（秒）を、記録された順の段階のリスト（最後に全体の 'total'）で返す"""
+    durations = {}
+    totals = []
+    for record in records:
+        for name, seconds in record.get('stages', {}).items():
+            durations.setdefault(name, []).append(seconds)
+        if 'total_seconds' in record:
+            totals.append(record['total_seconds'])
+    if totals:
+        durations['total'] = totals
+    return [
+        {
+            'stage': name,
+            'count': len(values),
+            'p50_seconds': percentile(values, 0.5),
+            'p95_seconds': percentile(values, 0.95),
+            'mean_seconds': sum(values) / len(values),
+        }
+        for name, values in durations.items()
+    ]
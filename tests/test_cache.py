@@ -0,0 +1,32 @@
+"""
+判定キャッシュの統計の回帰テスト
+"""
+
+import threading
+
+from construction_classifier import CacheCounter, ConstructionItemClassifier, process_workbook
+from test_export import make_workbook
+
+def test_counting_ignores_other_threads():
+    classifier = ConstructionItemClassifier()
+    
+    def other_job():
+        for name in ['普通型枠', '鉄筋加工費', '普通型枠']:
+            classifier.classify(name)
+    
+    with classifier.counting(CacheCounter()) as counter:
+        classifier.classify('コンクリート打設')
+        thread = threading.Thread(target=other_job)
+        thread.start()
+        thread.join()
+        classifier.classify('コンクリート打設')
+    assert (counter.hits, counter.misses) == (1, 1)
+    assert classifier.cache_info().hits == 2
+
+def test_process_workbook_reports_its_own_run():
+    classifier = ConstructionItemClassifier()
+    names = ['コンクリート打設', '普通型枠', 'コンクリート打設']
+    _, _, first, _ = process_workbook(make_workbook(names), workers=1, classifier=classifier)
+    _, _, second, _ = process_workbook(make_workbook(names), workers=1, classifier=classifier)
+    assert (first.hits, first.misses) == (1, 2)
+    assert (second.hits, second.misses) == (3, 0)
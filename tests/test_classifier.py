@@ -0,0 +1,71 @@
+"""
+判定ルール（キーワード照合・判定優先順位）の回帰テスト
+
+期待値は書き換え前の分類器（名称ごとに is_* を順に評価していた実装）の判定結果。
+"""
+
+import pandas as pd
+import pytest
+
+from construction_classifier import (
+    FRAME_NAME_COL,
+    FRAME_PARENT_COL,
+    FRAME_WORK_CATEGORY_COL,
+    ConstructionItemClassifier,
+)
+
+# (名称, 工事科目, 親カテゴリ, 判定結果)
+CASES = [
+    ('幹線動力設備', '', '', '電気設備'),
+    ('ケーブル', '', '', '電気設備'),
+    ('配管', '', '電気設備工事', '電気設備'),
+    ('給水設備', '', '', '空気調和設備'),
+    ('配管', '', '給排水衛生設備工事', '空気調和設備'),
+    ('配管', '', '機械設備工事', '0.0 対象外'),
+    ('屋上アスファルト防水', '', '', '4.1 屋根'),
+    ('屋上 コンクリート金鏝押え', '', '', '4.1 屋根'),
+    ('バルコニー 床 防水', '', '', '4.1 屋根'),
+    ('EVピット防水', '', '', '0.0 対象外'),
+    ('場所打ち杭', '', '', '2.2 杭・基礎'),
+    ('場所打ち杭 鉄筋', '', '', '2.2 杭・基礎'),
+    ('施工費', '杭工事', '', '2.2 杭・基礎'),
+    ('施工費', '', '', '0.0 対象外'),
+    ('クレーン基礎杭費', '', '', '0.0 対象外'),
+    ('コンクリート打設', '', '', '3.1 コンクリート'),
+    ('ｺﾝｸﾘｰﾄ打設', '', '', '3.1 コンクリート'),
+    ('捨コン', '', '', '3.1 コンクリート'),
+    ('コンクリート足場', '', '', '0.0 対象外'),
+    ('大梁', '', '', '3.3 鉄骨'),
+    ('鉄筋加工費', '', '', '3.4 鉄筋'),
+    ('D13 SD295A', '', '', '3.4 鉄筋'),
+    ('鉄筋足場', '', '', '0.0 対象外'),
+    ('普通型枠', '', '', '3.9 その他'),
+    ('外壁タイル', '', '', '4.2 外壁'),
+    ('ALC版', '', '', '4.2 外壁'),
+    ('手摺', '', '', '4.3 外部開口部'),
+    ('廊下 巾木', '', '', '4.3 外部開口部'),
+    ('床 長尺シート', '', '', '5.1 内部床'),
+    ('間仕切壁', '', '', '5.2 内壁'),
+    ('プラスターボード', '', '', '5.2 内壁'),
+    ('ユニットバス額縁', '', '', '5.3 内部開口部'),
+    ('下り天井', '', '', '5.4 天井'),
+    ('軽量鉄骨天井下地', '', '', '5.4 天井'),
+    ('宅配ボックス', '', '', '5.9 内部雑'),
+    ('洗面室カウンター', '', '', '5.9 内部雑'),
+    ('外部足場', '', '', '0.0 対象外'),
+    ('諸経費', '', '', '0.0 対象外'),
+]
+
+@pytest.mark.parametrize('name, work_category, parent, expected', CASES)
+def test_classify(name, work_category, parent, expected):
+    assert ConstructionItemClassifier().classify(name, work_category, parent) == expected
+
+def test_empty_name_is_not_classified():
+    assert ConstructionItemClassifier().classify('  ') is None
+
+def test_classify_frame_agrees_with_classify():
+    classifier = ConstructionItemClassifier()
+    rows = [case[:3] for case in CASES] + [(None, '', ''), ('', '杭工事', '')]
+    df = pd.DataFrame(rows, columns=[FRAME_NAME_COL, FRAME_WORK_CATEGORY_COL, FRAME_PARENT_COL])
+    expected = [classifier.classify(*row) for row in rows]
+    assert classifier.classify_frame(df).tolist() == expected
@@ -0,0 +1,63 @@
+"""
+分析用エクスポート（CSV / Parquet）の回帰テスト
+"""
+
+import io
+import sys
+
+import openpyxl
+import pytest
+
+from construction_classifier import (
+    CLASSIFICATION_COL,
+    DATA_START_ROW,
+    NAME_COL,
+    TARGET_SHEET,
+    available_export_formats,
+    main,
+    process_workbook,
+)
+from telemetry import RunTelemetry
+
+def make_workbook(names):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = TARGET_SHEET
+    for offset, name in enumerate(names, start=1):
+        ws.cell(row=DATA_START_ROW + offset, column=NAME_COL + 1, value=name)
+    source = io.BytesIO()
+    wb.save(source)
+    source.seek(0)
+    return source
+
+def test_parquet_is_not_offered_without_pyarrow(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    assert available_export_formats() == ('csv',)
+
+def test_export_failure_keeps_the_workbook(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    telemetry = RunTelemetry()
+    output, stats, _, _ = process_workbook(
+        make_workbook(['コンクリート打設']), workers=1, export=io.BytesIO(), export_format='parquet',
+        telemetry=telemetry
+    )
+    assert 'pyarrow' in telemetry.record()['export_error']
+    ws = openpyxl.load_workbook(output)[TARGET_SHEET]
+    assert ws.cell(row=DATA_START_ROW + 1, column=CLASSIFICATION_COL + 1).value == '3.1 コンクリート'
+    assert stats['3.1 コンクリート'] == 1
+
+def test_csv_export_lists_classified_rows():
+    export = io.BytesIO()
+    process_workbook(make_workbook(['コンクリート打設']), workers=1, export=export, export_format='csv')
+    lines = export.getvalue().decode('utf-8-sig').splitlines()
+    assert lines[0].startswith('行番号,')
+    assert lines[1].endswith(',3.1 コンクリート')
+
+def test_cli_rejects_incremental_export(tmp_path, capsys):
+    path = tmp_path / '見積書.xlsx'
+    path.write_bytes(make_workbook(['コンクリート打設']).getvalue())
+    with pytest.raises(SystemExit) as exc:
+        main([str(path), '--incremental', '--export', 'csv'])
+    assert exc.value.code == 2
+    assert '--incremental' in capsys.readouterr().err
+    assert not list(tmp_path.glob('*.csv'))
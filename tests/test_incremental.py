@@ -0,0 +1,62 @@
+"""
+差分判定（判定結果列と指紋シートによる再利用）の回帰テスト
+"""
+
+import io
+
+import openpyxl
+
+from category_store import CategoryStore
+from construction_classifier import (
+    CLASSIFICATION_COL,
+    DATA_START_ROW,
+    NAME_COL,
+    TARGET_SHEET,
+    ConstructionItemClassifier,
+    process_workbook,
+)
+from test_export import make_workbook
+
+NAMES = ['コンクリート打設', '普通型枠', '鉄筋加工費', '外壁タイル', '諸経費']
+
+def run(source, store):
+    return process_workbook(
+        source, workers=1, incremental=True, classifier=ConstructionItemClassifier(store=store)
+    )
+
+def edit_name(source, offset, name):
+    wb = openpyxl.load_workbook(source)
+    wb[TARGET_SHEET].cell(row=DATA_START_ROW + offset, column=NAME_COL + 1, value=name)
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+def label(source, offset):
+    ws = openpyxl.load_workbook(source)[TARGET_SHEET]
+    return ws.cell(row=DATA_START_ROW + offset, column=CLASSIFICATION_COL + 1).value
+
+def test_unchanged_rows_are_reused_and_edited_rows_reclassified(tmp_path):
+    store = CategoryStore(tmp_path / 'store.sqlite3')
+    
+    first, _, _, reuse = run(make_workbook(NAMES), store)
+    assert (reuse.reused, reuse.recomputed) == (0, len(NAMES))
+    
+    second, _, _, reuse = run(io.BytesIO(first.getvalue()), store)
+    assert (reuse.reused, reuse.recomputed) == (len(NAMES), 0)
+    
+    # 名称を書き換えた行は判定結果列に前回の値が残っていても判定し直す
+    assert label(io.BytesIO(first.getvalue()), 2) == '3.9 その他'
+    edited, _, _, reuse = run(edit_name(io.BytesIO(first.getvalue()), 2, 'コンクリート打設'), store)
+    assert (reuse.reused, reuse.recomputed) == (len(NAMES) - 1, 1)
+    assert label(edited, 2) == '3.1 コンクリート'
+
+def test_rules_change_invalidates_previous_results(tmp_path, monkeypatch):
+    store = CategoryStore(tmp_path / 'store.sqlite3')
+    first, _, _, _ = run(make_workbook(NAMES), store)
+    
+    monkeypatch.setattr(
+        ConstructionItemClassifier, 'EXCLUDED_KEYWORDS', ConstructionItemClassifier.EXCLUDED_KEYWORDS | {'諸経費'}
+    )
+    _, _, _, reuse = run(io.BytesIO(first.getvalue()), store)
+    assert (reuse.reused, reuse.recomputed) == (0, len(NAMES))
@@ -0,0 +1,59 @@
+"""
+並列判定（チャンク分割とチャンク境界での親カテゴリの引き継ぎ）の回帰テスト
+"""
+
+import openpyxl
+
+import construction_classifier
+from construction_classifier import (
+    CLASSIFICATION_COL,
+    TARGET_SHEET,
+    ConstructionItemClassifier,
+    chunk_start_parents,
+    classify_detail_rows,
+    classify_detail_rows_parallel,
+    process_workbook,
+)
+from telemetry import RunTelemetry
+from test_export import make_workbook
+
+CHUNK_SIZE = 4
+
+# 親カテゴリ（設備工事の見出し行）がチャンクの末尾・先頭にかかる並び（空行も含む）
+NAMES = [
+    'コンクリート打設', '普通型枠', '鉄筋加工費', '電気設備工事',
+    '配管', '照明器具', None, '給排水衛生設備工事',
+    '配管', '保温', '衛生器具', '外壁タイル',
+    '諸経費', None, '空調設備工事', '配管',
+    'ダクト', '天井', '普通型枠',
+]
+
+def detail_rows(names):
+    return [(row, '', name) for row, name in enumerate(names, start=8)]
+
+def test_chunk_start_parents_follow_headings():
+    assert chunk_start_parents(detail_rows(NAMES), CHUNK_SIZE) == [
+        '', '電気設備工事', '給排水衛生設備工事', '給排水衛生設備工事', '空調設備工事'
+    ]
+
+def test_parallel_matches_sequential_across_chunk_boundaries():
+    rows = detail_rows(NAMES)
+    expected = classify_detail_rows(rows, ConstructionItemClassifier())
+    results, _ = classify_detail_rows_parallel(rows, workers=2, chunk_size=CHUNK_SIZE)
+    assert results == expected
+
+def classified_column(output):
+    ws = openpyxl.load_workbook(output)[TARGET_SHEET]
+    return [row[0] for row in ws.iter_rows(min_col=CLASSIFICATION_COL + 1, max_col=CLASSIFICATION_COL + 1,
+                                           values_only=True)]
+
+def test_process_workbook_parallel_matches_sequential(monkeypatch):
+    monkeypatch.setattr(construction_classifier, 'PARALLEL_MIN_ROWS', 1)
+    monkeypatch.setattr(construction_classifier, 'PARALLEL_CHUNK_SIZE', CHUNK_SIZE)
+    
+    sequential, sequential_stats, _, _ = process_workbook(make_workbook(NAMES), workers=1)
+    telemetry = RunTelemetry()
+    parallel, parallel_stats, _, _ = process_workbook(make_workbook(NAMES), workers=2, telemetry=telemetry)
+    assert telemetry.record()['parallel'] is True
+    assert classified_column(parallel) == classified_column(sequential)
+    assert parallel_stats == sequential_stats
@@ -0,0 +1,42 @@
+"""
+永続ストア（CategoryStore）を使った判定の回帰テスト
+"""
+
+import openpyxl
+
+from category_store import CategoryStore
+from construction_classifier import (
+    CLASSIFICATION_COL,
+    DATA_START_ROW,
+    TARGET_SHEET,
+    ConstructionItemClassifier,
+    process_workbook,
+)
+from test_export import make_workbook
+
+NAMES = ['コンクリート打設', '普通型枠', '鉄筋加工費', '普通型枠', '諸経費', 'コンクリート打設']
+
+def classified(output):
+    ws = openpyxl.load_workbook(output)[TARGET_SHEET]
+    return [ws.cell(row=DATA_START_ROW + offset, column=CLASSIFICATION_COL + 1).value
+            for offset in range(1, len(NAMES) + 1)]
+
+def test_second_run_counts_store_hits_and_profile_still_measures(tmp_path):
+    store = CategoryStore(tmp_path / 'store.sqlite3')
+    
+    output, _, first, _ = process_workbook(
+        make_workbook(NAMES), workers=1, classifier=ConstructionItemClassifier(store=store)
+    )
+    assert (first.hits, first.misses, first.store_hits) == (2, 4, 0)
+    expected = classified(output)
+    
+    output, _, second, _ = process_workbook(
+        make_workbook(NAMES), workers=1, classifier=ConstructionItemClassifier(store=store)
+    )
+    assert second.store_hits == len(NAMES)
+    assert classified(output) == expected
+    
+    profiled = ConstructionItemClassifier(profile=True, store=store)
+    output, _, _, _ = process_workbook(make_workbook(NAMES), workers=1, classifier=profiled)
+    assert profiled.profile.rows == len(NAMES)
+    assert classified(output) == expected
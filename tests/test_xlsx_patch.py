@@ -0,0 +1,164 @@
+"""
+xlsx_patch（シートXMLの部分書き換え・流し読み）の回帰テスト
+"""
+
+import io
+import re
+import zipfile
+
+import openpyxl
+import pytest
+from openpyxl.styles import Font
+
+from construction_classifier import CLASSIFICATION_COL, DATA_START_ROW, NAME_COL, TARGET_SHEET, process_workbook
+from telemetry import RunTelemetry
+from xlsx_patch import XlsxPatchError, iter_sheet_values, patch_xlsx, sheet_parts
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+def make_xlsx(sheet_data, shared_strings=None, dimension=None, sheet_name='Sheet1'):
+    """sheetData の中身（XML文字列）から最小構成の xlsx を作る（shared_strings は <si> 要素のリスト）"""
+    overrides = [
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>',
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>',
+    ]
+    rels = [f'<Relationship Id="rId1" Type="{REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>']
+    parts = {}
+    if shared_strings is not None:
+        overrides.append(
+            '<Override PartName="/xl/sharedStrings.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        )
+        rels.append(f'<Relationship Id="rId2" Type="{REL_NS}/sharedStrings" Target="sharedStrings.xml"/>')
+        parts['xl/sharedStrings.xml'] = (
+            f'<sst xmlns="{MAIN_NS}" count="{len(shared_strings)}" uniqueCount="{len(shared_strings)}">'
+            + ''.join(shared_strings) + '</sst>'
+        )
+    parts['[Content_Types].xml'] = (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>' + ''.join(overrides) + '</Types>'
+    )
+    parts['_rels/.rels'] = (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+    )
+    parts['xl/workbook.xml'] = (
+        f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+        f'<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    parts['xl/_rels/workbook.xml.rels'] = (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + ''.join(rels) + '</Relationships>'
+    )
+    dimension_xml = f'<dimension ref="{dimension}"/>' if dimension else ''
+    parts['xl/worksheets/sheet1.xml'] = (
+        f'<worksheet xmlns="{MAIN_NS}">{dimension_xml}<sheetData>{sheet_data}</sheetData></worksheet>'
+    )
+    
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts.items():
+            archive.writestr(name, data)
+    output.seek(0)
+    return output
+
+def sheet_xml(data, sheet_name='Sheet1'):
+    with zipfile.ZipFile(data) as archive:
+        return archive.read(sheet_parts(archive)[sheet_name]).decode('utf-8')
+
+def patched(source, values, column=13, sheet_name='Sheet1'):
+    output = io.BytesIO()
+    patch_xlsx(source, output, sheet_name, column, values)
+    output.seek(0)
+    return output
+
+def test_inserts_inline_strings_in_column_order():
+    source = make_xlsx(
+        '<row r="1"><c r="A1" t="inlineStr"><is><t>名称</t></is></c><c r="N1"><v>5</v></c></row>'
+        '<row r="2"/>'
+    )
+    output = patched(source, {1: '4.1 屋根', 2: 'A&B <仮>'})
+    
+    xml = sheet_xml(output)
+    assert re.search(r'<c r="A1".*</c><c r="M1" t="inlineStr">.*</c><c r="N1">', xml)
+    assert '<row r="2"><c r="M2" t="inlineStr"><is><t xml:space="preserve">A&amp;B &lt;仮&gt;</t></is></c></row>' in xml
+    
+    ws = openpyxl.load_workbook(output).active
+    assert [ws['A1'].value, ws['M1'].value, ws['N1'].value, ws['M2'].value] == ['名称', '4.1 屋根', 5, 'A&B <仮>']
+
+def test_keeps_the_style_of_an_existing_cell():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws['A1'] = '名称'
+    ws['M1'] = '旧判定'
+    ws['M1'].font = Font(bold=True, color='FF0000')
+    source = io.BytesIO()
+    wb.save(source)
+    source.seek(0)
+    
+    ws = openpyxl.load_workbook(patched(source, {1: '5.4 天井'}, sheet_name=ws.title)).active
+    assert ws['M1'].value == '5.4 天井'
+    assert ws['M1'].font.b
+    assert ws['M1'].font.color.rgb.endswith('FF0000')
+
+def test_formula_in_target_column_raises():
+    source = make_xlsx('<row r="1"><c r="M1"><f>1+1</f><v>2</v></c></row>')
+    with pytest.raises(XlsxPatchError):
+        patch_xlsx(source, io.BytesIO(), 'Sheet1', 13, {1: '0.0 対象外'})
+
+def test_process_workbook_falls_back_to_openpyxl_on_formula():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = TARGET_SHEET
+    ws.cell(row=DATA_START_ROW + 1, column=NAME_COL + 1, value='コンクリート打設')
+    ws.cell(row=DATA_START_ROW + 1, column=CLASSIFICATION_COL + 1, value='="旧"')
+    source = io.BytesIO()
+    wb.save(source)
+    source.seek(0)
+    
+    telemetry = RunTelemetry()
+    output, stats, _, _ = process_workbook(source, workers=1, writer='patch', telemetry=telemetry)
+    assert telemetry.record()['writer'] == 'openpyxl'
+    ws = openpyxl.load_workbook(output)[TARGET_SHEET]
+    assert ws.cell(row=DATA_START_ROW + 1, column=CLASSIFICATION_COL + 1).value == '3.1 コンクリート'
+    assert stats['3.1 コンクリート'] == 1
+
+def test_widens_dimension_and_spans():
+    source = make_xlsx(
+        '<row r="1" spans="1:3"><c r="A1"><v>1</v></c><c r="C1"><v>3</v></c></row>'
+        '<row r="2" spans="1:3"><c r="A2"><v>1</v></c></row>',
+        dimension='A1:C2'
+    )
+    xml = sheet_xml(patched(source, {1: '3.3 鉄骨', 4: '3.4 鉄筋'}))
+    assert '<dimension ref="A1:M4"/>' in xml
+    assert '<row r="1" spans="1:13">' in xml
+    assert '<row r="2" spans="1:3">' in xml  # 書き換えない行はそのまま
+
+def test_reader_resolves_shared_strings():
+    source = make_xlsx(
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1"><v>2.5</v></c></row>'
+        '<row r="3"><c r="B3" t="s"><v>2</v></c><c r="C3" t="b"><v>1</v></c></row>',
+        shared_strings=[
+            '<si><t>名称</t></si>',
+            '<si><r><t>鉄筋</t></r><r><rPr><b/></rPr><t xml:space="preserve"> 加工 &amp; 組立</t></r>'
+            '<rPh sb="0" eb="2"><t>テッキン</t></rPh></si>',
+            '<si><t>天井</t><rPh sb="0" eb="2"><t>テンジョウ</t></rPh></si>',
+        ]
+    )
+    rows = list(iter_sheet_values(source, 'Sheet1', [2, 3, 1]))
+    assert rows == [(1, ['鉄筋 加工 & 組立', 2.5, '名称']), (3, ['天井', True, None])]
+    
+    source.seek(0)
+    expected = [
+        (row[0].row, [row[1].value, row[2].value, row[0].value])
+        for row in openpyxl.load_workbook(source).active.iter_rows()
+        if any(cell.value is not None for cell in row)
+    ]
+    assert rows == expected
+    
+    source.seek(0)
+    assert list(iter_sheet_values(source, 'Sheet1', [2], min_row=2)) == [(3, ['天井'])]
@@ -0,0 +1,553 @@
+"""
+XLSX の部分書き換え・読み込み（ストリーミング）
+ワークブック全体を読み込み直さずに、1つのシートの1列だけを書き換えて保存する。
+
+対象シート以外のパーツは内容を変えずに書き写し（zipfile に圧縮データをそのまま写す公開APIがないので、
+展開と再圧縮を流しながら行う）、対象シートのXMLは行単位で流しながら
+指定列のセルだけを差し込む（文字列はインライン文字列で書くので共有文字列表は変えない）。
+同じ要領で、シートの指定列の値だけをセルのオブジェクトを作らずに流し読みすることもできる。
+標準ライブラリだけで動く。
+"""
+
+import re
+import shutil
+import zipfile
+from posixpath import basename, dirname, join, normpath
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+# 対象シートのXMLを読み込む単位（バイト）
+CHUNK_SIZE = 1024 * 1024
+
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+
+_ROW_START = re.compile(rb'<(?:([A-Za-z_][\w.-]*):)?row[\s/>]')
+_CELL_START = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?c[\s/>]')
+_CELL_END = re.compile(rb'</(?:[A-Za-z_][\w.-]*:)?c>')
+_ATTRIBUTE = re.compile(rb'\s([\w:.-]+)\s*=\s*(["\'])(.*?)\2', re.S)
+_SHEET_DATA = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?sheetData[\s/>]')
+_DIMENSION = re.compile(rb'(<(?:[A-Za-z_][\w.-]*:)?dimension\s+ref\s*=\s*["\'])([^"\']*)(["\'])')
+_COL = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?col\s[^>]*>')
+_FORMULA = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?f[\s/>]')
+_CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+
+# 流し読み用（セル要素全体、セル参照・型の属性、値・文字列・ふりがな要素）
+# （セル参照は通常先頭の属性なので、先頭にあればセル要素の照合と一緒に取り出す）
+_CELL = re.compile(
+    rb'<(?:[A-Za-z_][\w.-]*:)?c(?=[\s/>])(?:\s+r\s*=\s*["\']([A-Z]+)(\d+)["\'])?([^>]*?)'
+    rb'(?:/>|>(.*?)</(?:[A-Za-z_][\w.-]*:)?c>)', re.S
+)
+_CELL_REF_ATTRIBUTE = re.compile(rb'\sr\s*=\s*["\']([A-Z]+)(\d+)["\']')
+_CELL_TYPE_ATTRIBUTE = re.compile(rb'\st\s*=\s*["\'](\w+)["\']')
+_FORMULA_TEXT = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?f(?:\s[^>]*)?>(.*?)</(?:[A-Za-z_][\w.-]*:)?f>', re.S)
+_VALUE = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?v(?:\s[^>]*)?>(.*?)</(?:[A-Za-z_][\w.-]*:)?v>', re.S)
+_TEXT = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?t(?:\s[^>]*)?>(.*?)</(?:[A-Za-z_][\w.-]*:)?t>', re.S)
+_PHONETIC = re.compile(rb'<((?:[A-Za-z_][\w.-]*:)?)rPh[\s>].*?</\1rPh>', re.S)
+_STRING_ITEM = re.compile(
+    rb'<(?:[A-Za-z_][\w.-]*:)?si(?:\s[^>]*)?>(.*?)</(?:[A-Za-z_][\w.-]*:)?si>|<(?:[A-Za-z_][\w.-]*:)?si\s*/>', re.S
+)
+_PREFIX = re.compile(rb'(?:[A-Za-z_][\w.-]*:)?')
+_ENTITY = re.compile(r'&(#x[0-9A-Fa-f]+|#\d+|amp|lt|gt|quot|apos);')
+_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+SHARED_STRINGS_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+
+class XlsxPatchError(Exception):
+    """ストリーミング書き換えに対応していない構造（呼び出し側で通常の保存に切り替える）"""
+
+def column_letter(index):
+    """列番号（1始まり）を列名に変換する（13 → 'M'）"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def column_index(letters):
+    """列名を列番号（1始まり）に変換する（'M' → 13）"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+def _attributes(tag):
+    return {name.split(b':')[-1]: value for name, _, value in _ATTRIBUTE.findall(tag)}
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _part_path(base, target):
+    """リレーションシップの Target をZIP内のパスにする"""
+    if target.startswith('/'):
+        return target[1:]
+    return normpath(join(base, target))
+
+def _rels_path(part):
+    return join(dirname(part), '_rels', basename(part) + '.rels')
+
+def workbook_part(archive):
+    """ワークブック本体（通常は xl/workbook.xml）のパス"""
+    rels = ElementTree.fromstring(archive.read('_rels/.rels'))
+    for rel in rels:
+        if rel.get('Type', '').endswith('/officeDocument'):
+            return _part_path('', rel.get('Target'))
+    raise XlsxPatchError("ワークブック本体のパーツが見つかりません")
+
+def sheet_parts(archive):
+    """シート名 → ZIP内のパーツのパス"""
+    workbook_path = workbook_part(archive)
+    workbook = ElementTree.fromstring(archive.read(workbook_path))
+    rels = ElementTree.fromstring(archive.read(_rels_path(workbook_path)))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels if _local_name(rel.tag) == 'Relationship'}
+    
+    parts = {}
+    for element in workbook.iter():
+        if _local_name(element.tag) != 'sheet':
+            continue
+        rel_id = next((value for key, value in element.attrib.items() if _local_name(key) == 'id'), None)
+        if rel_id in targets:
+            parts[element.get('name')] = _part_path(dirname(workbook_path), targets[rel_id])
+    return parts
+
+def _unescape(data):
+    """XMLのテキスト（バイト列）を文字列にする（文字参照・定義済み実体参照を戻す）"""
+    text = data.decode('utf-8')
+    if '&' not in text:
+        return text
+    
+    def replace(match):
+        entity = match.group(1)
+        if entity.startswith('#x'):
+            return chr(int(entity[2:], 16))
+        if entity.startswith('#'):
+            return chr(int(entity[1:]))
+        return _ENTITIES[entity]
+    
+    return _ENTITY.sub(replace, text)
+
+def _string_item_text(data):
+    """文字列要素（si・is）の中身からふりがなを除いた文字列"""
+    if b'rPh' in data:
+        data = _PHONETIC.sub(b'', data)
+    texts = _TEXT.findall(data)
+    if len(texts) == 1:
+        return _unescape(texts[0])
+    return ''.join(_unescape(text) for text in texts)
+
+def shared_strings(archive):
+    """共有文字列表（ふりがなを除いた文字列のリスト。表がなければ空）"""
+    workbook_path = workbook_part(archive)
+    rels = ElementTree.fromstring(archive.read(_rels_path(workbook_path)))
+    for rel in rels:
+        if rel.get('Type') == SHARED_STRINGS_REL_TYPE:
+            path = _part_path(dirname(workbook_path), rel.get('Target'))
+            break
+    else:
+        return []
+    return [_string_item_text(item) for item in _STRING_ITEM.findall(archive.read(path))]
+
+def _cell_value(cell_type, body, strings):
+    """セルの値（openpyxl の values_only と同じ型。数式は '=' で始まる式、日付はシリアル値のまま）"""
+    if body and _FORMULA.search(body):
+        formula = _FORMULA_TEXT.search(body)
+        if formula is None:
+            raise XlsxPatchError("共有数式のセルには対応していません")
+        return '=' + _unescape(formula.group(1))
+    if cell_type == b'inlineStr':
+        return _string_item_text(body) if body else None
+    match = _VALUE.search(body) if body else None
+    if match is None:
+        return None
+    value = match.group(1)
+    if cell_type == b's':
+        return strings[int(value)]
+    if cell_type in (b'str', b'e', b'd'):
+        return _unescape(value)
+    if cell_type == b'b':
+        return value.strip() == b'1'
+    if b'.' in value or b'E' in value or b'e' in value:
+        return float(value)
+    return int(value)
+
+def _complete_rows_end(buffer):
+    """バッファ中の最後の行の閉じタグの終わりの位置（閉じた行がなければ -1）"""
+    end = len(buffer)
+    while True:
+        index = buffer.rfind(b'row>', 0, end)
+        if index == -1:
+            return -1
+        start = buffer.rfind(b'</', 0, index)
+        # '<' はテキスト中では必ずエスケープされるので、'</' から 'row>' までが接頭辞だけなら閉じタグ
+        if start != -1 and _PREFIX.fullmatch(buffer, start + 2, index):
+            return index + len(b'row>')
+        end = index
+
+def iter_sheet_values(source, sheet_name, columns, min_row=1):
+    """シート sheet_name の columns 列（1始まりの列番号のリスト）の値だけを流し読みする
+    
+    (行番号, columns の順の値のリスト) を行番号の順に返す（指定列がすべて空の行は返さない）。
+    値は openpyxl の values_only（data_only=False）と同じ型（数式は '=' で始まる式。日付はシリアル値のまま）。
+    セル参照（r 属性）のないセル・共有数式など対応していない構造の場合は XlsxPatchError を送出する。
+    """
+    wanted = {column_letter(column).encode(): index for index, column in enumerate(columns)}
+    with zipfile.ZipFile(source) as archive:
+        parts = sheet_parts(archive)
+        if sheet_name not in parts:
+            raise XlsxPatchError(f"シート「{sheet_name}」のパーツが見つかりません")
+        strings = shared_strings(archive)
+        
+        with archive.open(parts[sheet_name]) as sheet:
+            buffer = b''
+            started = False
+            row = None
+            values = None
+            while True:
+                chunk = sheet.read(CHUNK_SIZE)
+                buffer += chunk
+                if not started:
+                    match = _SHEET_DATA.search(buffer)
+                    if match is None:
+                        if not chunk:
+                            return
+                        continue
+                    buffer = buffer[match.start():]
+                    started = True
+                end = len(buffer) if not chunk else _complete_rows_end(buffer)
+                if end == -1:
+                    continue
+                
+                for match in _CELL.finditer(buffer, 0, end):
+                    column, cell_row, attributes, body = match.groups()
+                    if column is None:
+                        ref = _CELL_REF_ATTRIBUTE.search(attributes)
+                        if ref is None:
+                            raise XlsxPatchError("セル参照（r 属性）のないセルには対応していません")
+                        column, cell_row = ref.groups()
+                    index = wanted.get(column)
+                    if index is None:
+                        continue
+                    cell_row = int(cell_row)
+                    if cell_row < min_row:
+                        continue
+                    cell_type = _CELL_TYPE_ATTRIBUTE.search(attributes)
+                    value = _cell_value(cell_type.group(1) if cell_type else b'n', body, strings)
+                    if value is None:
+                        continue
+                    if cell_row != row:
+                        if values is not None:
+                            yield row, values
+                        row = cell_row
+                        values = [None] * len(columns)
+                    values[index] = value
+                
+                buffer = buffer[end:]
+                if not chunk:
+                    break
+            if values is not None:
+                yield row, values
+
+def _inline_string_cell(prefix, ref, value, style):
+    style_attr = f' s="{style}"' if style else ''
+    text = escape(str(value))
+    return (f'<{prefix}c r="{ref}" t="inlineStr"{style_attr}><{prefix}is><{prefix}t xml:space="preserve">{text}'
+            f'</{prefix}t></{prefix}is></{prefix}c>').encode('utf-8')
+
+class _SheetPatcher:
+    """シートXMLの行要素に、指定列のセルを差し込む"""
+    
+    def __init__(self, column, values):
+        self.column = column
+        self.letter = column_letter(column)
+        self.values = values
+        self.column_style = None
+        self.row_number = 0
+    
+    def patch_head(self, head):
+        """sheetData より前（列の書式・使用範囲）の処理"""
+        for col in _COL.findall(head):
+            attrs = _attributes(col)
+            if b'style' in attrs and int(attrs.get(b'min', 0)) <= self.column <= int(attrs.get(b'max', 0)):
+                self.column_style = attrs[b'style'].decode()
+        
+        def widen(match):
+            ref = match.group(2).decode()
+            refs = _CELL_REF.findall(ref)
+            if not refs:
+                return match.group(0)
+            first_col, first_row = refs[0]
+            last_col, last_row = refs[-1]
+            last_row = max(int(last_row), max(self.values, default=0))
+            if column_index(last_col) < self.column:
+                last_col = self.letter
+            return match.group(1) + f'{first_col}{first_row}:{last_col}{last_row}'.encode() + match.group(3)
+        
+        return _DIMENSION.sub(widen, head, count=1)
+    
+    def patch_row(self, row, prefix):
+        """1行分のXML（<row ...>...</row> または <row .../>）を書き換える"""
+        tag_end = row.index(b'>') + 1
+        start_tag = row[:tag_end]
+        attrs = _attributes(start_tag)
+        self.row_number = int(attrs[b'r']) if b'r' in attrs else self.row_number + 1
+        
+        value = self.values.get(self.row_number)
+        if value is None:
+            return row
+        
+        # 新しいセルの書式は行の書式、なければ列の書式を引き継ぐ（Excelで入力した場合と同じ）
+        style = self.column_style
+        if attrs.get(b'customFormat') in (b'1', b'true') and b's' in attrs:
+            style = attrs[b's'].decode()
+        
+        prefix_str = (prefix + b':').decode() if prefix else ''
+        ref = f'{self.letter}{self.row_number}'
+        
+        if start_tag.endswith(b'/>'):
+            start_tag = start_tag[:-2].rstrip() + b'>'
+            cell = _inline_string_cell(prefix_str, ref, value, style)
+            return self._widen_spans(start_tag) + cell + f'</{prefix_str}row>'.encode()
+        
+        body_end = row.rindex(b'</')
+        body = row[tag_end:body_end]
+        
+        # 既存のセルを順に見て、差し込む位置（または置き換えるセル）を探す
+        column = 0
+        insert_at = None
+        last_cell_end = 0
+        position = 0
+        while True:
+            match = _CELL_START.search(body, position)
+            if not match:
+                break
+            cell_start = match.start()
+            cell_tag_end = body.index(b'>', cell_start) + 1
+            cell_tag = body[cell_start:cell_tag_end]
+            if cell_tag.endswith(b'/>'):
+                cell_end = cell_tag_end
+            else:
+                cell_end = _CELL_END.search(body, cell_tag_end).end()
+            
+            cell_attrs = _attributes(cell_tag)
+            ref_match = _CELL_REF.match(cell_attrs.get(b'r', b'').decode())
+            column = column_index(ref_match.group(1)) if ref_match else column + 1
+            
+            if column == self.column:
+                if _FORMULA.search(body, cell_tag_end, cell_end):
+                    raise XlsxPatchError(f"{ref} に数式があります")
+                if b's' in cell_attrs:
+                    style = cell_attrs[b's'].decode()
+                cell = _inline_string_cell(prefix_str, ref, value, style)
+                return start_tag + body[:cell_start] + cell + body[cell_end:] + row[body_end:]
+            if column > self.column:
+                insert_at = cell_start
+                break
+            last_cell_end = cell_end
+            position = cell_end
+        
+        if insert_at is None:
+            insert_at = last_cell_end
+        cell = _inline_string_cell(prefix_str, ref, value, style)
+        return self._widen_spans(start_tag) + body[:insert_at] + cell + body[insert_at:] + row[body_end:]
+    
+    def _widen_spans(self, start_tag):
+        def widen(match):
+            spans = match.group(3).split(b' ')
+            first, last = spans[-1].split(b':')
+            if int(last) < self.column:
+                spans[-1] = first + b':' + str(self.column).encode()
+            return match.group(1) + match.group(2) + b' '.join(spans) + match.group(2)
+        return re.sub(rb'(\sspans\s*=\s*)(["\'])(.*?)\2', widen, start_tag, count=1)
+
+class _BufferedWriter:
+    """小さな書き込みをまとめてから圧縮ストリームに渡す"""
+    
+    def __init__(self, target):
+        self.target = target
+        self.parts = []
+        self.size = 0
+    
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+    
+    def flush(self):
+        self.target.write(b''.join(self.parts))
+        self.parts = []
+        self.size = 0
+
+def _patch_sheet(source, target, patcher):
+    """シートXMLを CHUNK_SIZE ずつ読みながら書き換えて target に書き出す"""
+    out = _BufferedWriter(target)
+    buffer = source.read(CHUNK_SIZE)
+    eof = not buffer
+    
+    def fill(keep_from):
+        # 書き出し済みの部分を捨てて次のチャンクを足す
+        nonlocal buffer, eof
+        chunk = source.read(CHUNK_SIZE)
+        buffer = buffer[keep_from:] + chunk
+        eof = not chunk
+    
+    # sheetData より前（列の書式・使用範囲）
+    while not eof and not _SHEET_DATA.search(buffer):
+        fill(0)
+    match = _SHEET_DATA.search(buffer)
+    if not match:
+        out.write(buffer)
+        out.flush()
+        return
+    out.write(patcher.patch_head(buffer[:match.start()]))
+    
+    # 行単位で流す（position までは書き出し済み）
+    position = match.start()
+    while True:
+        match = _ROW_START.search(buffer, position)
+        if match is None:
+            if eof:
+                out.write(buffer[position:])
+                break
+            # タグの途中で切れている可能性があるので最後の '<' 以降は残す
+            keep = buffer.rfind(b'<', position)
+            keep = len(buffer) if keep == -1 else keep
+            out.write(buffer[position:keep])
+            fill(keep)
+            position = 0
+            continue
+        
+        prefix = match.group(1) or b''
+        start = match.start()
+        tag_end = buffer.find(b'>', start)
+        end = -1
+        if tag_end != -1 and buffer[tag_end - 1] == ord('/'):
+            end = tag_end + 1
+        elif tag_end != -1:
+            close = b'</' + (prefix + b':' if prefix else b'') + b'row>'
+            end = buffer.find(close, tag_end)
+            end = end + len(close) if end != -1 else -1
+        if end == -1:
+            if eof:
+                raise XlsxPatchError("シートXMLの行要素が閉じていません")
+            out.write(buffer[position:start])
+            fill(start)
+            position = 0
+            continue
+        
+        out.write(buffer[position:start])
+        out.write(patcher.patch_row(buffer[start:end], prefix))
+        position = end
+    out.flush()
+
+def _hidden_sheet_xml(values):
+    rows = ''.join(
+        f'<row r="{index}">{_inline_string_cell("", f"A{index}", value, None).decode()}</row>'
+        for index, value in enumerate(values, start=1)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            f'<sheetData>{rows}</sheetData></worksheet>').encode('utf-8')
+
+def _add_hidden_sheets(archive, names, sheet_part):
+    """非表示シートを追加するための workbook.xml・rels・[Content_Types].xml とシートのパスを返す"""
+    workbook_path = workbook_part(archive)
+    rels_path = _rels_path(workbook_path)
+    workbook = archive.read(workbook_path).decode('utf-8')
+    rels = archive.read(rels_path).decode('utf-8')
+    content_types = archive.read('[Content_Types].xml').decode('utf-8')
+    
+    # 既存の sheet 要素と同じ名前空間の接頭辞を使う
+    sheet_tag = re.search(r'<((?:[\w.-]+:)?)sheet\s[^>]*?(\w[\w.-]*):id\s*=', workbook)
+    if sheet_tag is None:
+        raise XlsxPatchError("workbook.xml の sheet 要素を解釈できません")
+    prefix, rel_prefix = sheet_tag.group(1), sheet_tag.group(2)
+    rel_type = re.search(rf'Type="([^"]*)"[^>]*Target="[^"]*{re.escape(sheet_part.rsplit("/", 1)[-1])}"', rels)
+    rel_type = rel_type.group(1) if rel_type else WORKSHEET_REL_TYPE
+    
+    sheet_ids = [int(v) for v in re.findall(r'\ssheetId\s*=\s*"(\d+)"', workbook)]
+    rel_ids = set(re.findall(r'\sId\s*=\s*"([^"]+)"', rels))
+    part_names = set(archive.namelist())
+    
+    paths = {}
+    sheet_elements = ''
+    relationships = ''
+    overrides = ''
+    for name in names:
+        sheet_id = max(sheet_ids, default=0) + 1
+        sheet_ids.append(sheet_id)
+        rel_number = len(rel_ids) + 1
+        while f'rId{rel_number}' in rel_ids:
+            rel_number += 1
+        rel_id = f'rId{rel_number}'
+        rel_ids.add(rel_id)
+        part_number = sheet_id
+        while join(dirname(workbook_path), f'worksheets/sheet{part_number}.xml') in part_names:
+            part_number += 1
+        path = join(dirname(workbook_path), f'worksheets/sheet{part_number}.xml')
+        part_names.add(path)
+        paths[name] = path
+        
+        quoted_name = escape(name, {'"': '&quot;'})
+        sheet_elements += (f'<{prefix}sheet name="{quoted_name}" sheetId="{sheet_id}" '
+                           f'state="veryHidden" {rel_prefix}:id="{rel_id}"/>')
+        relationships += f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="worksheets/sheet{part_number}.xml"/>'
+        overrides += f'<Override PartName="/{path}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>'
+    
+    workbook = workbook.replace(f'</{prefix}sheets>', sheet_elements + f'</{prefix}sheets>', 1)
+    rels = rels.replace('</Relationships>', relationships + '</Relationships>', 1)
+    content_types = content_types.replace('</Types>', overrides + '</Types>', 1)
+    return paths, {
+        workbook_path: workbook.encode('utf-8'),
+        rels_path: rels.encode('utf-8'),
+        '[Content_Types].xml': content_types.encode('utf-8'),
+    }
+
+def patch_xlsx(source, output, sheet_name, column, values, hidden_sheets=None):
+    """シート sheet_name の column 列（1始まり）に values {行番号: 文字列} を書き込んで output に保存する
+    
+    hidden_sheets {シート名: A列の値のリスト} は非表示（veryHidden）シートとして追加する
+    （同じ名前のシートがあれば内容を置き換える）。
+    対応していない構造の場合は XlsxPatchError を送出する（output には途中まで書かれている）。
+    """
+    patch_xlsx_sheets(source, output, {sheet_name: (column, values)}, hidden_sheets)
+
+def patch_xlsx_sheets(source, output, patches, hidden_sheets=None):
+    """複数のシートを書き換えて output に保存する（patches は {シート名: (列番号, {行番号: 文字列})}）
+    
+    hidden_sheets と例外は patch_xlsx と同じ。
+    """
+    hidden_sheets = hidden_sheets or {}
+    
+    with zipfile.ZipFile(source) as archive:
+        parts = sheet_parts(archive)
+        for sheet_name in patches:
+            if sheet_name not in parts:
+                raise XlsxPatchError(f"シート「{sheet_name}」のパーツが見つかりません")
+        patchers = {parts[sheet_name]: _SheetPatcher(*patch) for sheet_name, patch in patches.items()}
+        
+        replaced = {parts[name]: _hidden_sheet_xml(rows) for name, rows in hidden_sheets.items() if name in parts}
+        new_sheets = [name for name in hidden_sheets if name not in parts]
+        added = {}
+        if new_sheets:
+            paths, rewritten = _add_hidden_sheets(archive, new_sheets, parts[next(iter(patches))])
+            replaced.update(rewritten)
+            added = {paths[name]: _hidden_sheet_xml(hidden_sheets[name]) for name in new_sheets}
+        
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as patched:
+            for info in archive.infolist():
+                target_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                target_info.compress_type = info.compress_type
+                target_info.external_attr = info.external_attr
+                
+                if info.filename in replaced:
+                    patched.writestr(target_info, replaced[info.filename])
+                elif info.filename in patchers:
+                    with archive.open(info) as src, patched.open(target_info, 'w', force_zip64=True) as dst:
+                        _patch_sheet(src, dst, patchers[info.filename])
+                else:
+                    # 内容は変えないが、圧縮データのままは写せないので展開・再圧縮しながら流す
+                    with archive.open(info) as src, patched.open(target_info, 'w', force_zip64=info.file_size > 0x7FFFFFFF) as dst:
+                        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            
+            for path, data in added.items():
+                patched.writestr(path, data)